@@ -1,4 +1,8 @@
 # __init__.py
+import time
+
+
 def classFactory(iface):
+    start = time.perf_counter()
     from .relation_manager import RelationManager
-    return RelationManager(iface)
\ No newline at end of file
+    return RelationManager(iface, start)
@@ -0,0 +1,192 @@
+# cardinality.py
+# Statistiche di cardinalità delle relazioni: padri, figli, figli per padre
+# e orfani. Con layer nello stesso database il calcolo è fatto dal database
+# con una query di aggregazione (COUNT ... GROUP BY); negli altri casi
+# vengono letti solo gli attributi delle chiavi, senza geometria.
+# I job sono quelli di integrity.integrity_jobs.
+from collections import Counter, defaultdict, namedtuple
+from functools import partial
+
+from .integrity import (ParentKeys, can_check_sql, is_null_key, key_getter, key_request,
+                        quote_identifier, run_jobs, sql_connection, table_expression)
+
+
+# method: 'sql' o 'stream'; linked: padri con almeno un figlio;
+# avg_children: media dei figli per padre, contando anche i padri senza figli
+CardinalityStats = namedtuple(
+    'CardinalityStats',
+    ['relation_id', 'method', 'parents', 'children', 'linked', 'max_children', 'avg_children',
+     'orphans', 'error'])
+
+
+def _stats(job, method, parents, children, linked, matched, max_children):
+    """Statistiche dai conteggi; matched: figli con un padre corrispondente"""
+    average = matched / parents if parents else 0.0
+    return CardinalityStats(job.relation_id, method, parents, children, linked, max_children,
+                            average, children - matched, None)
+
+
+def cardinality_query(job):
+    """Query che restituisce padri, figli, padri collegati, figli collegati e massimo per padre"""
+    child_fields = [quote_identifier(field) for field in job.child.fields]
+    parent_fields = [quote_identifier(field) for field in job.parent.fields]
+    child_keys = ", ".join(f"c.{field}" for field in child_fields)
+    parent_keys = ", ".join(f"p.{field}" for field in parent_fields)
+    child_not_null = " AND ".join(f"c.{field} IS NOT NULL" for field in child_fields)
+    parent_not_null = " AND ".join(f"p.{field} IS NOT NULL" for field in parent_fields)
+    join = " AND ".join(f"p.{parent_field} = g.{child_field}"
+                        for child_field, parent_field in zip(child_fields, parent_fields))
+    child_table = table_expression(job.child)
+    parent_table = table_expression(job.parent)
+    return (f"SELECT "
+            f"(SELECT COUNT(*) FROM (SELECT DISTINCT {parent_keys} FROM {parent_table} p "
+            f"WHERE {parent_not_null}) d), "
+            f"(SELECT COUNT(*) FROM {child_table} c WHERE {child_not_null}), "
+            f"COUNT(*), COALESCE(SUM(g.n), 0), COALESCE(MAX(g.n), 0) "
+            f"FROM (SELECT {child_keys}, COUNT(*) AS n FROM {child_table} c "
+            f"WHERE {child_not_null} GROUP BY {child_keys}) g "
+            f"WHERE EXISTS (SELECT 1 FROM {parent_table} p WHERE {join})")
+
+
+def stats_sql(job):
+    """Statistiche calcolate dal database con una sola query"""
+    row = sql_connection(job.child).executeSql(cardinality_query(job))[0]
+    parents, children, linked, matched, max_children = (int(value or 0) for value in row)
+    return _stats(job, 'sql', parents, children, linked, matched, max_children)
+
+
+def stats_stream(job, parent_keys, is_canceled=None):
+    """Statistiche leggendo solo gli attributi delle chiavi, senza geometria"""
+    keys = parent_keys.get(job.parent)
+    single_parent = len(job.parent.indices) == 1
+    parents = sum(1 for key in keys if not is_null_key(key, single_parent))
+
+    getter = key_getter(job.child.indices)
+    single = len(job.child.indices) == 1
+    counts = Counter()
+    for i, feature in enumerate(job.child.source.getFeatures(key_request(job.child))):
+        if i % 10000 == 0 and is_canceled is not None and is_canceled():
+            raise InterruptedError("calcolo annullato")
+        key = getter(feature.attributes())
+        if not is_null_key(key, single):
+            counts[key] += 1
+
+    matched = [count for key, count in counts.items() if key in keys]
+    return _stats(job, 'stream', parents, sum(counts.values()), len(matched), sum(matched),
+                  max(matched, default=0))
+
+
+def relation_stats(job, parent_keys, is_canceled=None, log=print):
+    """Statistiche di una relazione: SQL se possibile, altrimenti lettura in streaming"""
+    if can_check_sql(job):
+        try:
+            return stats_sql(job)
+        except Exception as e:
+            log(f"⚠️ Query SQL non riuscita per '{job.name}', lettura dei dati: {str(e)}")
+    return stats_stream(job, parent_keys, is_canceled)
+
+
+def compute_cardinality(jobs, log=print, is_canceled=None, set_progress=None, max_workers=4):
+    """Calcola le statistiche in parallelo; restituisce i CardinalityStats nell'ordine dei job"""
+    parent_keys = ParentKeys(is_canceled)
+    return run_jobs(
+        jobs, lambda job: relation_stats(job, parent_keys, is_canceled, log),
+        lambda job, error: CardinalityStats(job.relation_id, None, None, None, None, None, None,
+                                            None, error),
+        set_progress, max_workers)
+
+
+def job_key(job):
+    """Cosa determina le statistiche di una relazione: layer, chiavi e filtri"""
+    return (job.child.layer_id, job.child.indices, job.child.subset,
+            job.parent.layer_id, job.parent.indices, job.parent.subset)
+
+
+class CardinalityCache:
+    """Statistiche già calcolate per relazione, indicizzate per layer
+
+    Le statistiche restano valide finché le modifiche di uno dei due layer
+    non vengono salvate (afterCommitChanges), il filtro del layer non
+    cambia o il layer non viene rimosso; una relazione ridefinita su altri
+    campi viene ricalcolata perché cambia job_key.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._layer_relations = defaultdict(set)
+        # layer_id -> (layer, slot) per poter scollegare i segnali
+        self._watched_layers = {}
+        self._project = None
+        self.on_invalidated = None
+
+    def get(self, job):
+        """Statistiche salvate per il job, se ancora valide"""
+        cached = self._stats.get(job.relation_id)
+        if cached is None or cached[0] != job_key(job):
+            return None
+        return cached[1]
+
+    def missing(self, jobs):
+        """Job senza statistiche valide"""
+        return [job for job in jobs if self.get(job) is None]
+
+    def store(self, job, stats):
+        self._stats[job.relation_id] = (job_key(job), stats)
+        self._layer_relations[job.child.layer_id].add(job.relation_id)
+        self._layer_relations[job.parent.layer_id].add(job.relation_id)
+
+    def stats(self):
+        """Dizionario relation_id -> CardinalityStats"""
+        return {relation_id: stats for relation_id, (key, stats) in self._stats.items()}
+
+    def invalidate_layer(self, layer_id):
+        """Scarta le statistiche delle relazioni che usano il layer"""
+        relation_ids = {relation_id for relation_id in self._layer_relations.pop(layer_id, ())
+                        if relation_id in self._stats}
+        for relation_id in relation_ids:
+            del self._stats[relation_id]
+        if relation_ids and self.on_invalidated is not None:
+            self.on_invalidated(relation_ids)
+
+    def clear(self):
+        relation_ids = set(self._stats)
+        self._stats.clear()
+        self._layer_relations.clear()
+        if relation_ids and self.on_invalidated is not None:
+            self.on_invalidated(relation_ids)
+
+    def watch(self, project):
+        """Invalida le statistiche seguendo i segnali del progetto e dei layer (vedi unwatch)"""
+        self.unwatch()
+        self._project = project
+        project.layersAdded.connect(self.watch_layers)
+        project.layersWillBeRemoved.connect(self._layers_removed)
+        project.cleared.connect(self.clear)
+        self.watch_layers(project.mapLayers().values())
+
+    def watch_layers(self, layers):
+        for layer in layers:
+            if layer.id() in self._watched_layers or not hasattr(layer, 'afterCommitChanges'):
+                continue
+            invalidate = partial(self.invalidate_layer, layer.id())
+            self._watched_layers[layer.id()] = (layer, invalidate)
+            layer.afterCommitChanges.connect(invalidate)
+            layer.subsetStringChanged.connect(invalidate)
+
+    def unwatch(self):
+        """Scollega la cache dai segnali del progetto e dei layer"""
+        if self._project is None:
+            return
+        project, self._project = self._project, None
+        project.layersAdded.disconnect(self.watch_layers)
+        project.layersWillBeRemoved.disconnect(self._layers_removed)
+        project.cleared.disconnect(self.clear)
+        for layer, invalidate in self._watched_layers.values():
+            layer.afterCommitChanges.disconnect(invalidate)
+            layer.subsetStringChanged.disconnect(invalidate)
+        self._watched_layers.clear()
+
+    def _layers_removed(self, layer_ids):
+        for layer_id in layer_ids:
+            self._watched_layers.pop(layer_id, None)
+            self.invalidate_layer(layer_id)
@@ -0,0 +1,293 @@
+# catalog_io.py
+# Lettura e scrittura dei file di catalogo delle relazioni.
+# Oltre al formato JSON supporta una variante NDJSON (una riga di
+# intestazione, nella versione 2.0 una riga per layer, poi una relazione
+# per riga), anche compressa con gzip, che può essere scritta e letta una
+# relazione alla volta.
+import gzip
+import io
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .import_stats import ImportStats
+from .relation_core import (FORMAT_VERSION, LEGACY_FORMAT_VERSION, layer_keys,
+                            encode_layers, encode_relation, decode_layer,
+                            decode_layers, iter_specs)
+
+
+NDJSON_FORMAT = "relation-manager-ndjson"
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Filtri per QFileDialog
+EXPORT_FILTERS = ("JSON Files (*.json);;NDJSON Files (*.ndjson);;NDJSON gzip (*.ndjson.gz);;"
+                  "JSON 1.0 compatibile (*.json)")
+IMPORT_FILTERS = "Cataloghi relazioni (*.json *.ndjson *.jsonl *.gz);;Tutti i file (*)"
+CATALOG_EXTENSIONS = ('.json', '.ndjson', '.jsonl', '.ndjson.gz', '.jsonl.gz')
+
+# Risultato della lettura di un catalogo: relazioni decodificate, messaggi
+# di log, tempi di lettura, eventuale errore che ha impedito la lettura e
+# ID delle relazioni saltate perché non valide (None se non leggibile)
+CatalogRead = namedtuple('CatalogRead', ['filename', 'specs', 'messages', 'stats', 'error',
+                                         'invalid'])
+
+
+def is_gzip_path(filename):
+    return filename.lower().endswith('.gz')
+
+
+def is_ndjson_path(filename):
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return name.endswith('.ndjson') or name.endswith('.jsonl')
+
+
+def catalog_files(paths):
+    """File di catalogo indicati: i file così come sono, delle cartelle i file
+    con estensione da catalogo in ordine alfabetico. Senza ripetizioni."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.lower().endswith(CATALOG_EXTENSIONS)
+                             and os.path.isfile(os.path.join(path, name)))
+        else:
+            filenames.append(path)
+    return list(dict.fromkeys(filenames))
+
+
+def export_filename(filename, selected_filter):
+    """Aggiunge l'estensione del filtro scelto se il nome non ne ha una nota"""
+    name = filename.lower()
+    if name.endswith('.json') or is_ndjson_path(name):
+        return filename
+    if 'gzip' in selected_filter:
+        return filename + '.ndjson.gz'
+    if 'NDJSON' in selected_filter:
+        return filename + '.ndjson'
+    return filename + '.json'
+
+
+def export_version(selected_filter):
+    """Versione del formato corrispondente al filtro scelto nel dialog"""
+    if LEGACY_FORMAT_VERSION in selected_filter:
+        return LEGACY_FORMAT_VERSION
+    return FORMAT_VERSION
+
+
+def write_catalog(filename, specs, project_file, is_canceled=None, set_progress=None,
+                  version=FORMAT_VERSION):
+    """Scrive le relazioni nel file; il formato dipende dall'estensione
+
+    .json produce lo stesso testo di json.dump(..., indent=2) di
+    encode_catalog, .ndjson/.jsonl una riga per record, .gz comprime con
+    gzip. Restituisce False (e rimuove il file) se l'operazione viene
+    annullata.
+    """
+    keys = None if version == LEGACY_FORMAT_VERSION else layer_keys(specs)
+    header = {"version": version, "export_date": project_file}
+    if is_gzip_path(filename):
+        f = gzip.open(filename, 'wt', encoding='utf-8')
+    else:
+        f = open(filename, 'w', encoding='utf-8')
+
+    with f:
+        if is_ndjson_path(filename):
+            completed = _write_ndjson(f, header, specs, keys, is_canceled, set_progress)
+        else:
+            completed = _write_json(f, header, specs, keys, is_canceled, set_progress)
+
+    if not completed:
+        os.remove(filename)
+    return completed
+
+
+def _write_ndjson(f, header, specs, keys, is_canceled, set_progress):
+    header = dict(header, format=NDJSON_FORMAT)
+    f.write(json.dumps(header, ensure_ascii=False) + "\n")
+
+    # I layer precedono le relazioni che li usano
+    if keys is not None:
+        for key, layer_data in encode_layers(keys).items():
+            f.write(json.dumps(dict(layer_data, layer=key), ensure_ascii=False) + "\n")
+
+    for i, spec in enumerate(specs):
+        if is_canceled is not None and is_canceled():
+            return False
+        if set_progress is not None:
+            set_progress(100.0 * i / len(specs))
+        f.write(json.dumps(encode_relation(spec, keys), ensure_ascii=False) + "\n")
+
+    if set_progress is not None:
+        set_progress(100.0)
+    return True
+
+
+def _write_json(f, header, specs, keys, is_canceled, set_progress):
+    """Scrive lo stesso testo di json.dump(..., indent=2) una relazione per volta"""
+    if keys is not None:
+        header = dict(header, layers=encode_layers(keys))
+
+    f.write("{\n")
+    for key, value in header.items():
+        text = json.dumps(value, indent=2, ensure_ascii=False)
+        f.write(f"  {json.dumps(key)}: {text.replace(chr(10), chr(10) + '  ')},\n")
+
+    if not specs:
+        f.write('  "relations": []\n}')
+        return True
+
+    f.write('  "relations": [\n')
+    for i, spec in enumerate(specs):
+        if is_canceled is not None and is_canceled():
+            return False
+        if set_progress is not None:
+            set_progress(100.0 * i / len(specs))
+
+        text = json.dumps(encode_relation(spec, keys), indent=2, ensure_ascii=False)
+        f.write("    " + text.replace("\n", "\n    "))
+        f.write(",\n" if i < len(specs) - 1 else "\n")
+    f.write("  ]\n}")
+
+    if set_progress is not None:
+        set_progress(100.0)
+    return True
+
+
+class CatalogReader:
+    """Lettura incrementale di un file di catalogo
+
+    Iterando si ottengono i dizionari delle relazioni. Per i file NDJSON
+    (anche compressi) ogni riga viene letta e decodificata solo quando
+    richiesta, quindi la memoria usata non dipende dalla dimensione del
+    file. I file JSON vengono invece letti per intero.
+
+    self.layers è la tabella dei layer del formato 2.0 (chiave -> LayerRef)
+    da passare a iter_specs; nei file NDJSON si riempie durante la lettura.
+    I tempi di lettura e decodifica vengono sommati in stats (ImportStats).
+    """
+
+    def __init__(self, filename, stats=None):
+        self.filename = filename
+        self.stats = stats if stats is not None else ImportStats()
+        self.header = {}
+        self.streaming = False
+        self.layers = {}
+        self._size = max(os.path.getsize(filename), 1)
+        self._raw = open(filename, 'rb')
+        self._text = None
+        self._relations = None
+        self._index = 0
+
+        try:
+            stream = self._raw
+            if self._raw.peek(2)[:2] == GZIP_MAGIC:
+                stream = gzip.GzipFile(fileobj=self._raw)
+            self._text = io.TextIOWrapper(stream, encoding='utf-8')
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_header(self):
+        with self.stats.phase('file_read'):
+            first_line = self._text.readline()
+        try:
+            with self.stats.phase('json_parse'):
+                header = json.loads(first_line)
+        except ValueError:
+            header = None
+
+        if isinstance(header, dict) and header.get("format") == NDJSON_FORMAT:
+            self.streaming = True
+            self.header = header
+            return
+
+        # Formato JSON: l'intero file è un solo oggetto
+        with self.stats.phase('file_read'):
+            text = first_line + self._text.read()
+        with self.stats.phase('json_parse'):
+            relations_data = json.loads(text)
+        if "relations" not in relations_data:
+            raise ValueError("Formato file non valido: manca la sezione 'relations'")
+        self._relations = relations_data.pop("relations")
+        self.layers = decode_layers(relations_data.pop("layers", {}))
+        self.header = relations_data
+
+    def __iter__(self):
+        if not self.streaming:
+            for relation_data in self._relations:
+                self._index += 1
+                yield relation_data
+            return
+
+        line_number = 1
+        while True:
+            start = time.perf_counter()
+            line = self._text.readline()
+            read = time.perf_counter()
+            self.stats.add_time('file_read', read - start)
+            if not line:
+                break
+            line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                relation_data = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Riga {line_number} non valida: {str(e)}")
+            finally:
+                self.stats.add_time('json_parse', time.perf_counter() - read)
+
+            if "layer" in relation_data:
+                self.layers[relation_data["layer"]] = decode_layer(relation_data)
+                continue
+            yield relation_data
+
+    def progress(self):
+        """Avanzamento della lettura in percentuale"""
+        if not self.streaming:
+            return 100.0 * self._index / max(len(self._relations), 1)
+        return 100.0 * self._raw.tell() / self._size
+
+    def close(self):
+        if self._text is not None:
+            self._text.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_catalog(filename, is_canceled=None):
+    """Legge e decodifica per intero un catalogo; gli errori finiscono nel CatalogRead"""
+    stats = ImportStats()
+    messages = []
+    specs = []
+    invalid = []
+    try:
+        with CatalogReader(filename, stats) as reader:
+            for spec in iter_specs(reader, messages.append, reader.layers, invalid.append):
+                if is_canceled is not None and is_canceled():
+                    break
+                specs.append(spec)
+    except Exception as e:
+        return CatalogRead(filename, specs, messages, stats, e, invalid)
+    return CatalogRead(filename, specs, messages, stats, None, invalid)
+
+
+def read_catalogs(filenames, is_canceled=None, set_progress=None, max_workers=4):
+    """Legge più cataloghi in parallelo; i risultati sono nell'ordine dei file"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(read_catalog, filename, is_canceled) for filename in filenames]
+        for done, future in enumerate(as_completed(futures), 1):
+            if set_progress is not None:
+                set_progress(100.0 * done / len(futures))
+        return [future.result() for future in futures]
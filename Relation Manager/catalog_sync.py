@@ -0,0 +1,223 @@
+# catalog_sync.py
+# Sincronizzazione automatica delle relazioni da cataloghi condivisi:
+# all'apertura di un progetto e quando i file dei cataloghi cambiano, le
+# relazioni vengono importate con la stessa logica di "Importa Relazioni".
+# Data di modifica e dimensione dei file e impronta del contenuto
+# dell'ultima sincronizzazione sono salvate nel progetto: se i cataloghi non
+# sono cambiati non vengono né letti né confrontati con i layer.
+import hashlib
+import os
+
+from qgis.PyQt.QtCore import QFileSystemWatcher, QObject, QSettings, QTimer
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
+
+from .catalog_io import catalog_files
+from .log_sink import ERROR, WARNING, message_level
+from .mapping_cache import MappingCache
+from .relation_core import ProjectSnapshot, apply_relations
+from .relation_tasks import ImportRelationsTask
+
+
+SETTINGS_GROUP = 'relation_manager/sync'
+ENTRY_SCOPE = 'RelationManager'
+
+
+def sync_settings():
+    """(attiva, cataloghi, politica) dalle impostazioni di QGIS"""
+    settings = QSettings()
+    enabled = settings.value(f'{SETTINGS_GROUP}/enabled', False, type=bool)
+    catalogs = settings.value(f'{SETTINGS_GROUP}/catalogs', [], type=list)
+    policy = settings.value(f'{SETTINGS_GROUP}/policy', 'update')
+    return enabled, catalogs, policy
+
+
+def save_sync_settings(enabled=None, catalogs=None):
+    settings = QSettings()
+    if enabled is not None:
+        settings.setValue(f'{SETTINGS_GROUP}/enabled', enabled)
+    if catalogs is not None:
+        settings.setValue(f'{SETTINGS_GROUP}/catalogs', list(catalogs))
+
+
+def catalog_state(filenames):
+    """Firma economica dei cataloghi: percorso, data di modifica e dimensione"""
+    lines = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        lines.append(f"{filename}|{stat.st_mtime_ns}|{stat.st_size}")
+    return "\n".join(lines)
+
+
+def catalog_hash(filenames, chunk_size=1 << 20):
+    """Impronta SHA-1 del contenuto dei cataloghi"""
+    digest = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CatalogSync(QObject):
+    """Applica i cataloghi al progetto quando viene aperto o quando cambiano
+
+    Al controllo viene prima confrontata la firma dei file con quella
+    salvata nel progetto; solo se è diversa i file vengono letti per
+    calcolarne l'impronta, e solo se anche questa è cambiata viene avviata
+    l'importazione in background. Le modifiche ai file durante la sessione
+    arrivano da QFileSystemWatcher e vengono raggruppate: una serie di
+    salvataggi ravvicinati produce una sola sincronizzazione.
+    """
+
+    def __init__(self, project, catalogs, policy='update', delay=2000, parent=None):
+        super(CatalogSync, self).__init__(parent)
+        self.project = project
+        self.catalogs = list(catalogs)
+        self.policy = policy
+        self.task = None
+        self._pending = False
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.sync)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.catalog_changed)
+        self.watcher.directoryChanged.connect(self.folder_changed)
+        self.watch_catalogs()
+
+        self.project.readProject.connect(self.project_read)
+
+    def log(self, message, level=Qgis.Info):
+        QgsMessageLog.logMessage(message, 'Relation Manager', level)
+
+    def log_task_message(self, message):
+        """Dal log dell'importazione riporta solo avvisi ed errori"""
+        level = message_level(message)
+        if level >= ERROR:
+            self.log(message.strip(), Qgis.Critical)
+        elif level >= WARNING:
+            self.log(message.strip(), Qgis.Warning)
+
+    def set_catalogs(self, catalogs):
+        """Cambia i cataloghi sorvegliati e sincronizza subito"""
+        self.catalogs = list(catalogs)
+        self.watch_catalogs()
+        self.sync()
+
+    def watch_catalogs(self):
+        """Sorveglia i file dei cataloghi e le cartelle indicate"""
+        paths = self.watcher.files() + self.watcher.directories()
+        if paths:
+            self.watcher.removePaths(paths)
+        paths = [path for path in self.catalogs + catalog_files(self.catalogs)
+                 if os.path.exists(path)]
+        if paths:
+            self.watcher.addPaths(list(dict.fromkeys(paths)))
+
+    def catalog_changed(self, path):
+        # Molti programmi salvano sostituendo il file: il watcher lo perde
+        if os.path.exists(path) and path not in self.watcher.files() + self.watcher.directories():
+            self.watcher.addPath(path)
+        self.timer.start()
+
+    def folder_changed(self, path):
+        # Cataloghi aggiunti, rimossi o rinominati nella cartella: i file
+        # sorvegliati vengono ricalcolati, così anche quelli nuovi sono seguiti
+        self.watch_catalogs()
+        self.timer.start()
+
+    def project_read(self, *args):
+        self.timer.stop()
+        self.sync()
+
+    def sync(self):
+        """Importa i cataloghi se sono cambiati dall'ultima sincronizzazione del progetto"""
+        if self.task is not None:
+            # Nuovo controllo al termine dell'importazione in corso
+            self._pending = True
+            return
+        if not self.project.mapLayers():
+            return
+
+        filenames = catalog_files(self.catalogs)
+        if not filenames:
+            self.log("Nessun catalogo da sincronizzare", Qgis.Warning)
+            return
+        try:
+            state = catalog_state(filenames)
+            stored_state, _ = self.project.readEntry(ENTRY_SCOPE, 'catalog_state', '')
+            if state == stored_state:
+                return
+
+            digest = catalog_hash(filenames)
+        except OSError as e:
+            self.log(f"Cataloghi non leggibili: {str(e)}", Qgis.Warning)
+            return
+
+        stored_hash, _ = self.project.readEntry(ENTRY_SCOPE, 'catalog_hash', '')
+        if digest == stored_hash:
+            # Solo la data di modifica è cambiata: aggiorna la firma senza
+            # segnare il progetto come modificato
+            dirty = self.project.isDirty()
+            self.project.writeEntry(ENTRY_SCOPE, 'catalog_state', state)
+            self.project.setDirty(dirty)
+            return
+
+        self.log(f"Sincronizzazione delle relazioni da {len(filenames)} cataloghi")
+        task = ImportRelationsTask(
+            filenames, ProjectSnapshot.from_project(self.project), self.policy,
+            mapping_cache=MappingCache(os.path.join(QgsApplication.qgisSettingsDirPath(),
+                                                    'relation_manager', 'layer_mapping.json')),
+            project_key=self.project.absoluteFilePath())
+        project_file = self.project.absoluteFilePath()
+        task.messageLogged.connect(self.log_task_message)
+        task.taskCompleted.connect(lambda: self.sync_completed(task, project_file, state, digest))
+        task.taskTerminated.connect(lambda: self.sync_terminated(task))
+        self.task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def sync_completed(self, task, project_file, state, digest):
+        """Chiamata nel thread principale: applica le relazioni e salva l'impronta"""
+        self.task = None
+        if self.project.absoluteFilePath() != project_file:
+            # Nel frattempo è stato aperto un altro progetto
+            self._pending = True
+        else:
+            try:
+                result = apply_relations(self.project, task.planned,
+                                         self.log_task_message, task.diff.replace_ids,
+                                         task.diff.remove_ids, task.stats)
+            except Exception as e:
+                self.log(f"Sincronizzazione non riuscita: {str(e)}", Qgis.Critical)
+            else:
+                self.project.writeEntry(ENTRY_SCOPE, 'catalog_state', state)
+                self.project.writeEntry(ENTRY_SCOPE, 'catalog_hash', digest)
+                self.log(f"Sincronizzazione completata: {result.added} relazioni importate o "
+                         f"aggiornate, {result.removed} rimosse\n{task.diff.summary()}")
+        self._finished()
+
+    def sync_terminated(self, task):
+        self.task = None
+        if task.exception is not None:
+            self.log(f"Sincronizzazione non riuscita: {str(task.exception)}", Qgis.Critical)
+        self._finished()
+
+    def _finished(self):
+        if self._pending:
+            self._pending = False
+            self.timer.start()
+
+    def stop(self):
+        """Smette di seguire progetto e cataloghi e annulla l'importazione in corso"""
+        self.timer.stop()
+        self._pending = False
+        self.project.readProject.disconnect(self.project_read)
+        paths = self.watcher.files() + self.watcher.directories()
+        if paths:
+            self.watcher.removePaths(paths)
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
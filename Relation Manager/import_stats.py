@@ -0,0 +1,124 @@
+# import_stats.py
+# Misure di un'importazione: tempo per fase, strategia con cui è stato
+# trovato ogni layer, relazioni più lente e, se richiesto, profilo cProfile.
+import cProfile
+import heapq
+import io
+import json
+import pstats
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+# Fasi misurate, nell'ordine in cui compaiono nel report
+PHASES = ('file_read', 'json_parse', 'layer_resolution', 'field_validation', 'add_relation')
+
+
+class ImportStats:
+    """Raccoglie le misure di un'importazione e le esporta in JSON
+
+    Le fasi che si alternano (lettura in streaming, risoluzione) sommano
+    i tempi di tutte le loro esecuzioni. Non è thread-safe: va usato da un
+    thread alla volta (il task in background e poi il thread principale).
+    """
+
+    def __init__(self, slowest=20):
+        self.phases = defaultdict(float)
+        self.strategies = Counter()
+        self.counters = Counter()
+        self.started = time.time()
+        self.profile_text = None
+        self.profiler = None
+        self._slowest_limit = slowest
+        self._slowest = []
+        self._start = time.perf_counter()
+        self._elapsed = None
+
+    @contextmanager
+    def phase(self, name):
+        """Misura il tempo del blocco e lo somma a quello della fase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def add_time(self, name, seconds):
+        self.phases[name] += seconds
+
+    def record_strategy(self, strategy):
+        """Conta la strategia con cui è stato trovato un layer (None: non trovato)"""
+        self.strategies[strategy or 'not_found'] += 1
+
+    def record_relation(self, relation_id, name, seconds):
+        """Tiene le relazioni più lente da elaborare"""
+        item = (seconds, relation_id, name)
+        if len(self._slowest) < self._slowest_limit:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    @contextmanager
+    def profiling(self, enabled=True):
+        """Esegue il blocco sotto cProfile e ne conserva le funzioni più costose"""
+        if not enabled:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(40)
+            self.profile_text = text.getvalue()
+            self.profiler = profiler
+
+    def finish(self):
+        self._elapsed = time.perf_counter() - self._start
+
+    @property
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+    def report(self):
+        """Dizionario del report, pronto per json.dump"""
+        elapsed = self._elapsed if self._elapsed is not None else time.perf_counter() - self._start
+        phases = {name: round(self.phases.get(name, 0.0), 6) for name in PHASES}
+        phases.update({name: round(value, 6) for name, value in self.phases.items()
+                       if name not in phases})
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "total_seconds": round(elapsed, 6),
+            "phases": phases,
+            "strategies": dict(self.strategies),
+            "counters": dict(self.counters),
+            "slowest_relations": [
+                {"id": relation_id, "name": name, "seconds": round(seconds, 6)}
+                for seconds, relation_id, name in self.slowest],
+        }
+        if self.profile_text is not None:
+            report["profile"] = self.profile_text
+        return report
+
+    def summary(self):
+        """Riepilogo testuale per il log"""
+        lines = ["Tempi per fase:"]
+        for name, seconds in self.report()["phases"].items():
+            lines.append(f"  {name}: {seconds:.3f} s")
+        if self.strategies:
+            lines.append("Layer trovati per strategia: " + ", ".join(
+                f"{strategy}={count}" for strategy, count in self.strategies.most_common()))
+        return "\n".join(lines)
+
+    def save(self, filename):
+        """Scrive il report JSON; con cProfile attivo salva anche il file .prof"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+        if self.profiler is not None:
+            self.profiler.dump_stats(filename + '.prof')
@@ -0,0 +1,266 @@
+# integrity.py
+# Verifica dell'integrità referenziale delle relazioni: per ogni relazione
+# conta i record figli la cui chiave non esiste nel layer padre.
+# I dati dei layer vengono letti nel thread principale solo per creare le
+# sorgenti (QgsVectorLayerFeatureSource); il controllo può poi girare in
+# background, in parallelo sulle relazioni. Ogni lato di ogni job ha una
+# sorgente propria: una sorgente non può essere letta da più thread insieme.
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from operator import itemgetter
+
+from qgis.core import (NULL, QgsDataSourceUri, QgsFeatureRequest, QgsProviderRegistry,
+                       QgsVectorLayerFeatureSource)
+
+
+SAMPLE_SIZE = 10
+
+# Provider per cui il controllo può essere eseguito con una query SQL
+SQL_PROVIDERS = ('postgres', 'spatialite', 'ogr')
+
+# Lato di una relazione: layer, campi della chiave e dati per la query SQL
+KeySide = namedtuple(
+    'KeySide',
+    ['layer_id', 'name', 'source', 'indices', 'fields', 'primary_key', 'database', 'table',
+     'subset'])
+
+IntegrityJob = namedtuple('IntegrityJob', ['relation_id', 'name', 'child', 'parent'])
+
+# method: 'sql' o 'stream'; samples: ID dei primi figli orfani
+IntegrityResult = namedtuple(
+    'IntegrityResult', ['relation_id', 'name', 'method', 'checked', 'orphans', 'samples', 'error'])
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _database_table(layer):
+    """(provider, database, tabella) del layer se interrogabile in SQL, altrimenti None
+
+    database identifica la connessione (provider, URI di connessione): due
+    layer con lo stesso valore possono essere confrontati con una sola query.
+    """
+    provider = layer.providerType()
+    if provider not in SQL_PROVIDERS:
+        return None
+
+    if provider in ('postgres', 'spatialite'):
+        uri = QgsDataSourceUri(layer.source())
+        if not uri.table() or uri.table().startswith('('):
+            return None
+        table = quote_identifier(uri.table())
+        if provider == 'postgres':
+            table = f"{quote_identifier(uri.schema() or 'public')}.{table}"
+        return provider, (provider, uri.connectionInfo(False)), table
+
+    if provider == 'ogr':
+        parts = QgsProviderRegistry.instance().decodeUri('ogr', layer.source())
+        path = parts.get('path') or ''
+        layer_name = parts.get('layerName')
+        if not path.lower().endswith('.gpkg') or not layer_name:
+            return None
+        return provider, ('ogr', path), quote_identifier(layer_name)
+
+    return None
+
+
+def _key_side(layer, indices):
+    """Descrive un lato della relazione, con una sorgente dei dati propria"""
+    fields = layer.fields()
+    primary_key = [fields.at(index).name() for index in layer.primaryKeyAttributes()]
+    database = table = None
+    location = _database_table(layer)
+    if location is not None and len(primary_key) <= 1:
+        database, table = location[1], location[2]
+    return KeySide(layer.id(), layer.name(), QgsVectorLayerFeatureSource(layer), tuple(indices),
+                   tuple(fields.at(index).name() for index in indices),
+                   primary_key[0] if primary_key else None, database, table,
+                   layer.subsetString())
+
+
+def integrity_jobs(project, relation_ids=None):
+    """Prepara nel thread principale i controlli per le relazioni indicate (tutte se None)"""
+    jobs = []
+    for relation_id, relation in project.relationManager().relations().items():
+        if relation_ids is not None and relation_id not in relation_ids:
+            continue
+        child = relation.referencingLayer()
+        parent = relation.referencedLayer()
+        if child is None or parent is None or not relation.isValid():
+            continue
+        jobs.append(IntegrityJob(relation_id, relation.name(),
+                                 _key_side(child, relation.referencingFields()),
+                                 _key_side(parent, relation.referencedFields())))
+    return jobs
+
+
+def key_getter(indices):
+    """Funzione che estrae la chiave dagli attributi (valore singolo o tupla)"""
+    if len(indices) == 1:
+        return itemgetter(indices[0])
+    return itemgetter(*indices)
+
+
+def is_null_key(key, single):
+    """True se la chiave (o uno dei suoi valori) è nulla"""
+    if single:
+        return key is None or key == NULL
+    return any(value is None or value == NULL for value in key)
+
+
+def key_request(side):
+    """Richiesta che legge solo gli attributi della chiave, senza geometria"""
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(list(side.indices))
+    return request
+
+
+class ParentKeys:
+    """Insiemi delle chiavi dei layer padre, condivisi tra le relazioni
+
+    Il primo thread che chiede un insieme lo costruisce leggendo la
+    sorgente del proprio job; gli altri ne attendono il risultato invece
+    di rileggere il layer.
+    """
+
+    def __init__(self, is_canceled=None):
+        self.is_canceled = is_canceled
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, side):
+        key = (side.layer_id, side.indices)
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(self._read(side))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def _read(self, side):
+        getter = key_getter(side.indices)
+        keys = set()
+        for i, feature in enumerate(side.source.getFeatures(key_request(side))):
+            if i % 10000 == 0 and self.is_canceled is not None and self.is_canceled():
+                raise InterruptedError("verifica annullata")
+            keys.add(getter(feature.attributes()))
+        return keys
+
+
+def check_stream(job, parent_keys, is_canceled=None, sample_size=SAMPLE_SIZE):
+    """Controllo leggendo solo gli attributi delle chiavi, senza geometria"""
+    keys = parent_keys.get(job.parent)
+    getter = key_getter(job.child.indices)
+    single = len(job.child.indices) == 1
+    checked = orphans = 0
+    samples = []
+    for i, feature in enumerate(job.child.source.getFeatures(key_request(job.child))):
+        if i % 10000 == 0 and is_canceled is not None and is_canceled():
+            raise InterruptedError("verifica annullata")
+        key = getter(feature.attributes())
+        if is_null_key(key, single):
+            continue
+        checked += 1
+        if key not in keys:
+            orphans += 1
+            if len(samples) < sample_size:
+                samples.append(feature.id())
+    return IntegrityResult(job.relation_id, job.name, 'stream', checked, orphans, samples, None)
+
+
+def can_check_sql(job):
+    """True se padre e figlio sono tabelle dello stesso database"""
+    return job.child.database is not None and job.child.database == job.parent.database
+
+
+def table_expression(side):
+    """Tabella del lato della relazione, filtrata come il layer"""
+    if side.subset:
+        return f"(SELECT * FROM {side.table} WHERE {side.subset})"
+    return side.table
+
+
+def orphan_query(job, select):
+    """Query sui figli con chiave non nulla senza un padre corrispondente"""
+    child_fields = [quote_identifier(field) for field in job.child.fields]
+    parent_fields = [quote_identifier(field) for field in job.parent.fields]
+    not_null = " AND ".join(f"c.{field} IS NOT NULL" for field in child_fields)
+    join = " AND ".join(f"p.{parent_field} = c.{child_field}"
+                        for child_field, parent_field in zip(child_fields, parent_fields))
+    return (f"SELECT {select} FROM {table_expression(job.child)} c "
+            f"WHERE {not_null} AND NOT EXISTS "
+            f"(SELECT 1 FROM {table_expression(job.parent)} p WHERE {join})")
+
+
+def sql_connection(side):
+    """Connessione al database del layer (vedi can_check_sql)"""
+    provider, uri = side.database
+    metadata = QgsProviderRegistry.instance().providerMetadata(provider)
+    return metadata.createConnection(uri, {})
+
+
+def check_sql(job, sample_size=SAMPLE_SIZE):
+    """Controllo eseguito dal database con una sola query (più una per gli esempi)"""
+    connection = sql_connection(job.child)
+    orphans = int(connection.executeSql(orphan_query(job, "COUNT(*)"))[0][0])
+    samples = []
+    if orphans and job.child.primary_key:
+        query = orphan_query(job, f"c.{quote_identifier(job.child.primary_key)}")
+        samples = [row[0] for row in connection.executeSql(f"{query} LIMIT {int(sample_size)}")]
+    return IntegrityResult(job.relation_id, job.name, 'sql', None, orphans, samples, None)
+
+
+def check_relation(job, parent_keys, is_canceled=None, log=print):
+    """Controlla una relazione: SQL se possibile, altrimenti lettura in streaming"""
+    if can_check_sql(job):
+        try:
+            return check_sql(job)
+        except Exception as e:
+            log(f"⚠️ Query SQL non riuscita per '{job.name}', lettura dei dati: {str(e)}")
+    return check_stream(job, parent_keys, is_canceled)
+
+
+def run_jobs(jobs, check, failed, set_progress=None, max_workers=4):
+    """Esegue check(job) in parallelo; failed(job, errore) dà il risultato di un job fallito"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(check, job): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                results[job.relation_id] = future.result()
+            except Exception as e:
+                results[job.relation_id] = failed(job, str(e))
+            if set_progress is not None:
+                set_progress(100.0 * done / len(jobs))
+    return [results[job.relation_id] for job in jobs]
+
+
+def check_integrity(jobs, log=print, is_canceled=None, set_progress=None, max_workers=4):
+    """Esegue i controlli in parallelo; restituisce gli IntegrityResult nell'ordine dei job"""
+    parent_keys = ParentKeys(is_canceled)
+    return run_jobs(
+        jobs, lambda job: check_relation(job, parent_keys, is_canceled, log),
+        lambda job, error: IntegrityResult(job.relation_id, job.name, None, None, None, [], error),
+        set_progress, max_workers)
+
+
+def format_result(result):
+    """Riga di log per il risultato di un controllo"""
+    if result.error is not None:
+        return f"❌ {result.name}: verifica non riuscita ({result.error})"
+    checked = f" su {result.checked}" if result.checked is not None else ""
+    method = "SQL" if result.method == 'sql' else "lettura dati"
+    if not result.orphans:
+        return f"✅ {result.name}: nessun record orfano{checked} ({method})"
+    samples = ", ".join(str(fid) for fid in result.samples)
+    return (f"⚠️ {result.name}: {result.orphans} record orfani{checked} ({method})"
+            + (f", esempi: {samples}" if samples else ""))
@@ -0,0 +1,195 @@
+# layer_resolver.py
+import os
+from collections import defaultdict
+
+
+# Lunghezza massima degli n-grammi indicizzati per la ricerca parziale
+NGRAM_SIZE = 3
+
+
+def normalize_name(name):
+    """Normalizza un nome di layer come nel confronto 'nome simile'"""
+    return name.replace("-", "_").replace(" ", "_").lower()
+
+
+def table_key(source):
+    """Estrae il nome della tabella dal parametro table= della sorgente"""
+    if not source or 'table=' not in source:
+        return None
+    try:
+        return source.split('table=')[1].split()[0].strip('"')
+    except IndexError:
+        return None
+
+
+def canonical_source_key(source):
+    """Restituisce una chiave canonica della sorgente in base al provider
+
+    - PostGIS/Spatialite (table=): ('table', tabella come scritta, senza le
+      virgolette esterne: 'schema"."tabella' oppure 'schema.tabella')
+    - GeoPackage/OGR con layername: ('layer', percorso, nome layer)
+    - File: ('file', percorso)
+    """
+    if not source:
+        return None
+
+    table = table_key(source)
+    if table is not None:
+        return ('table', table)
+    if 'table=' in source:
+        return None
+
+    parts = source.split('|')
+    path = parts[0].strip()
+    if '?' in path or ('/' not in path and '\\' not in path):
+        return None
+    path = os.path.normcase(os.path.normpath(path))
+
+    for option in parts[1:]:
+        if option.startswith('layername='):
+            return ('layer', path, option[len('layername='):])
+    return ('file', path)
+
+
+def ngrams(text):
+    """Tutte le sottostringhe di lunghezza da 1 a NGRAM_SIZE"""
+    grams = set()
+    for size in range(1, NGRAM_SIZE + 1):
+        for start in range(len(text) - size + 1):
+            grams.add(text[start:start + size])
+    return grams
+
+
+class LayerResolver:
+    """Indice dei layer di un progetto per la ricerca per nome o sorgente
+
+    Va costruito una volta per importazione. Ogni ricerca segue lo stesso
+    ordine di find_layer_by_name_or_source (nome esatto, nome normalizzato,
+    nome parziale, tabella della sorgente) e, a parità di criterio,
+    restituisce il primo layer nell'ordine di project.mapLayers().
+    """
+
+    def __init__(self, layers):
+        """layers: iterabile di (layer_id, nome, sorgente)"""
+        self._ids = []
+        self._exact = {}
+        self._normalized = {}
+        self._lower = {}
+        self._lower_names = []
+        self._lengths = set()
+        self._ngrams = defaultdict(set)
+        self._sources = {}
+        self._cache = {}
+
+        for position, (layer_id, name, source) in enumerate(layers):
+            self._ids.append(layer_id)
+            name = name or ""
+            lower = name.lower()
+
+            self._lower_names.append(lower)
+            self._exact.setdefault(name, position)
+            self._normalized.setdefault(normalize_name(name), position)
+            self._lower.setdefault(lower, position)
+            self._lengths.add(len(lower))
+            for gram in ngrams(lower):
+                self._ngrams[gram].add(position)
+
+            key = canonical_source_key(source)
+            if key is not None:
+                self._sources.setdefault(key, position)
+
+    @classmethod
+    def from_project(cls, project):
+        """Costruisce l'indice dai layer del progetto indicato"""
+        return cls((layer_id, layer.name(), layer.source())
+                   for layer_id, layer in project.mapLayers().items())
+
+    def __len__(self):
+        return len(self._ids)
+
+    def find(self, name, source):
+        """Restituisce l'ID del layer corrispondente oppure None"""
+        return self.resolve(name, source)[0]
+
+    def resolve(self, name, source):
+        """Restituisce (ID del layer, strategia) oppure (None, None)
+
+        La strategia è 'exact', 'normalized', 'partial' o 'source'.
+        """
+        cache_key = (name, source)
+        if cache_key not in self._cache:
+            self._cache[cache_key] = self._resolve(name, source)
+        return self._cache[cache_key]
+
+    def _resolve(self, name, source):
+        if name:
+            # Nome esatto
+            position = self._exact.get(name)
+            if position is not None:
+                return self._ids[position], 'exact'
+
+            # Nome simile (caratteri speciali rimossi)
+            position = self._normalized.get(normalize_name(name))
+            if position is not None:
+                return self._ids[position], 'normalized'
+
+            # Ricerca parziale
+            positions = self._partial_positions(name.lower())
+            if positions:
+                return self._ids[min(positions)], 'partial'
+
+        # Sorgente
+        key = canonical_source_key(source)
+        if key is not None:
+            position = self._sources.get(key)
+            if position is not None:
+                return self._ids[position], 'source'
+
+        return None, None
+
+    def partial_candidates(self, name, limit=None):
+        """ID dei layer che corrispondono parzialmente al nome, ordinati
+
+        L'ordine è quello di priorità della ricerca: il primo elemento è
+        il layer che find() sceglierebbe nella fase di ricerca parziale.
+        """
+        positions = sorted(self._partial_positions(name.lower()))
+        if limit is not None:
+            positions = positions[:limit]
+        return [self._ids[position] for position in positions]
+
+    def _partial_positions(self, query):
+        """Posizioni dei layer il cui nome contiene o è contenuto nella query"""
+        positions = set()
+
+        # Nome del layer contenuto nella query: basta cercare le
+        # sottostringhe della query con una lunghezza presente nell'indice
+        for size in self._lengths:
+            if size > len(query):
+                continue
+            for start in range(len(query) - size + 1):
+                position = self._lower.get(query[start:start + size])
+                if position is not None:
+                    positions.add(position)
+
+        # Query contenuta nel nome del layer: intersezione degli n-grammi
+        if len(query) <= NGRAM_SIZE:
+            positions.update(self._ngrams.get(query, ()))
+        else:
+            postings = []
+            for start in range(len(query) - NGRAM_SIZE + 1):
+                posting = self._ngrams.get(query[start:start + NGRAM_SIZE])
+                if not posting:
+                    return positions
+                postings.append(posting)
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting
+                if not candidates:
+                    break
+            for position in candidates:
+                if query in self._lower_names[position]:
+                    positions.add(position)
+
+        return positions
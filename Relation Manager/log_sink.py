@@ -0,0 +1,176 @@
+# log_sink.py
+# Log delle operazioni: i messaggi vengono accumulati in un buffer circolare
+# (anche dal thread del task) e mostrati a blocchi da un modello a lista,
+# mentre il log completo viene scritto su file.
+import threading
+import time
+from collections import deque, namedtuple
+
+from qgis.PyQt.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+from qgis.PyQt.QtGui import QColor
+
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LEVEL_COLORS = {DEBUG: QColor('gray'), WARNING: QColor('darkorange'), ERROR: QColor('red')}
+
+LogRecord = namedtuple('LogRecord', ['time', 'level', 'message'])
+
+
+def message_level(message):
+    """Livello di un messaggio dedotto dal suo prefisso"""
+    text = message.lstrip()
+    if text.startswith('❌') or text.startswith('ERRORE'):
+        return ERROR
+    if text.startswith('⚠'):
+        return WARNING
+    if text.startswith('✅') or text.startswith('ID: '):
+        return DEBUG
+    return INFO
+
+
+class LogSink:
+    """Buffer circolare dei messaggi di log, con copia completa su file
+
+    write può essere chiamato da qualsiasi thread. Il buffer conserva solo
+    gli ultimi maxlen messaggi; quelli non ancora mostrati si ottengono con
+    take_pending. Se è aperto un file, ogni messaggio vi viene scritto.
+    """
+
+    def __init__(self, maxlen=5000):
+        self.maxlen = maxlen
+        self.filename = None
+        self.generation = 0
+        self._records = deque(maxlen=maxlen)
+        self._pending = deque(maxlen=maxlen)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, message, level=None):
+        """Aggiunge un messaggio; i messaggi su più righe diventano più record"""
+        now = time.time()
+        if level is None:
+            level = message_level(message)
+        records = [LogRecord(now, level, line) for line in message.split("\n")]
+        with self._lock:
+            self._records.extend(records)
+            self._pending.extend(records)
+            if self._file is not None:
+                stamp = time.strftime("%H:%M:%S", time.localtime(now))
+                for record in records:
+                    self._file.write(f"{stamp} {LEVEL_NAMES[level]:<7} {record.message}\n")
+
+    def take_pending(self):
+        """Messaggi arrivati dall'ultima chiamata; None se il buffer è stato superato"""
+        with self._lock:
+            if not self._pending:
+                return []
+            overflow = len(self._pending) == self.maxlen
+            pending = list(self._pending)
+            self._pending.clear()
+        return None if overflow else pending
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._pending.clear()
+            self.generation += 1
+
+    def open(self, filename):
+        """Inizia a scrivere il log completo nel file (sovrascritto)"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(filename, 'w', encoding='utf-8')
+            self.filename = filename
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class LogListModel(QAbstractListModel):
+    """Modello a lista dei messaggi di un LogSink
+
+    Un timer trasferisce i nuovi messaggi a blocchi, con un solo
+    inserimento di righe per blocco; le righe oltre maxlen vengono rimosse
+    dall'inizio. I messaggi sotto min_level non vengono mostrati.
+    """
+
+    def __init__(self, sink, interval=100, parent=None):
+        super(LogListModel, self).__init__(parent)
+        self.sink = sink
+        self.min_level = INFO
+        self._rows = deque()
+        self._generation = sink.generation
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        record = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return record.message
+        if role == Qt.ForegroundRole:
+            return LEVEL_COLORS.get(record.level)
+        if role == Qt.ToolTipRole:
+            return time.strftime("%H:%M:%S", time.localtime(record.time))
+        return None
+
+    def set_min_level(self, level):
+        self.min_level = level
+        self.reset()
+
+    def reset(self):
+        """Ricarica le righe dall'intero buffer del sink"""
+        self.sink.take_pending()
+        self._generation = self.sink.generation
+        self.beginResetModel()
+        self._rows = deque(record for record in self.sink.records()
+                           if record.level >= self.min_level)
+        self.endResetModel()
+
+    def flush(self):
+        """Mostra i messaggi arrivati dall'ultimo trasferimento"""
+        if self._generation != self.sink.generation:
+            self.reset()
+            return
+
+        pending = self.sink.take_pending()
+        if pending is None:
+            self.reset()
+            return
+        records = [record for record in pending if record.level >= self.min_level]
+        if not records:
+            return
+
+        overflow = len(self._rows) + len(records) - self.sink.maxlen
+        if overflow > 0:
+            overflow = min(overflow, len(self._rows))
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for _ in range(overflow):
+                self._rows.popleft()
+            self.endRemoveRows()
+
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+        self._rows.extend(records)
+        self.endInsertRows()
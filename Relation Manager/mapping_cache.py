@@ -0,0 +1,208 @@
+# mapping_cache.py
+# Cache persistente delle corrispondenze tra i layer dei cataloghi e i layer
+# dei progetti: importando di nuovo lo stesso catalogo nello stesso progetto
+# i layer non vengono cercati un'altra volta. Non usa Qt.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .layer_resolver import LayerResolver
+
+
+CACHE_VERSION = 1
+
+# Serializza i salvataggi dello stesso processo (task di importazione e
+# sincronizzazione dei cataloghi possono salvare insieme)
+_save_lock = threading.Lock()
+
+# Ordine di priorità delle strategie di LayerResolver.resolve
+STRATEGY_RANK = {'exact': 0, 'normalized': 1, 'partial': 2, 'source': 3}
+
+
+def layer_digest(name, source, fields):
+    """Impronta di un layer: nome, sorgente e campi"""
+    content = json.dumps([name, source, fields], ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def registry_fingerprint(digests):
+    """Impronta dell'insieme dei layer di un progetto (dizionario ID -> impronta)"""
+    content = json.dumps(sorted(digests.items()), ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _entry_key(name, source):
+    return json.dumps([name, source], ensure_ascii=False)
+
+
+class LayerMapping:
+    """Corrispondenze (nome, sorgente) -> layer per un progetto
+
+    lookup restituisce una corrispondenza salvata solo se è ancora quella
+    che LayerResolver troverebbe: il layer di destinazione deve esistere con
+    nome, sorgente e campi invariati e, se i layer del progetto sono
+    cambiati, nessun layer nuovo o modificato deve corrispondere con una
+    strategia di pari o maggiore priorità. Va usata da un thread alla volta.
+    """
+
+    def __init__(self, project_key, layers, fields):
+        """layers: lista di (layer_id, nome, sorgente); fields: layer_id -> nomi dei campi
+
+        Senza project_key (progetto non salvato) il progetto è identificato
+        dall'impronta dei suoi layer.
+        """
+        self.layers = layers
+        self.digests = {layer_id: layer_digest(name, source, fields.get(layer_id))
+                        for layer_id, name, source in layers}
+        self.registry = registry_fingerprint(self.digests)
+        self.project_key = project_key or self.registry
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._stored_entries = {}
+        self._stored_digests = {}
+        self._unchanged = False
+        self._changed_resolver = None
+
+    def restore(self, stored):
+        """Usa le corrispondenze salvate (dizionario di to_dict)"""
+        self._stored_entries = stored.get("entries", {})
+        self._stored_digests = stored.get("layers", {})
+        self._unchanged = stored.get("registry") == self.registry
+        self._changed_resolver = None
+
+    @property
+    def changed_resolver(self):
+        """Indice dei soli layer nuovi o modificati dall'ultimo salvataggio"""
+        if self._changed_resolver is None:
+            self._changed_resolver = LayerResolver(
+                (layer_id, name, source) for layer_id, name, source in self.layers
+                if self._stored_digests.get(layer_id) != self.digests[layer_id])
+        return self._changed_resolver
+
+    def lookup(self, name, source):
+        """(layer_id, strategia) salvati e ancora validi, altrimenti None"""
+        key = _entry_key(name, source)
+        stored = self._stored_entries.get(key)
+        if stored is None or not self._is_valid(name, source, *stored):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = stored
+        return stored[0], stored[1]
+
+    def _is_valid(self, name, source, layer_id, strategy):
+        if layer_id is not None:
+            digest = self.digests.get(layer_id)
+            if digest is None or digest != self._stored_digests.get(layer_id):
+                return False
+        if self._unchanged:
+            return True
+
+        # Layer del progetto cambiati: la corrispondenza resta valida solo
+        # se nessun layer nuovo o modificato la batterebbe
+        changed_id, changed_strategy = self.changed_resolver.resolve(name, source)
+        if changed_id is None:
+            return True
+        return (layer_id is not None
+                and STRATEGY_RANK[changed_strategy] > STRATEGY_RANK[strategy])
+
+    def record(self, name, source, layer_id, strategy):
+        """Salva il risultato di una ricerca completa"""
+        self._entries[_entry_key(name, source)] = [layer_id, strategy]
+
+    def to_dict(self):
+        entries = dict(self._stored_entries) if self._unchanged else {}
+        entries.update(self._entries)
+        return {"registry": self.registry, "layers": self.digests, "entries": entries}
+
+
+class MappingCache:
+    """File JSON con le corrispondenze di più progetti, con rimozione LRU
+
+    Ogni progetto è identificato da project_key (di solito il percorso del
+    file di progetto); oltre max_projects vengono eliminati i progetti
+    usati meno di recente. Più istanze possono usare lo stesso file: save
+    rilegge il file e vi aggiunge solo i progetti aggiornati con store.
+    """
+
+    def __init__(self, filename, max_projects=20):
+        self.filename = filename
+        self.max_projects = max_projects
+        self.projects = OrderedDict()
+        self._updated = []
+
+    def _read(self):
+        """Progetti salvati nel file; vuoto se manca o è di un'altra versione"""
+        if not os.path.exists(self.filename):
+            return OrderedDict()
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != CACHE_VERSION:
+            return OrderedDict()
+        return OrderedDict(data.get("projects", {}))
+
+    def load(self):
+        """Legge il file; se manca, o è di un'altra versione, la cache parte vuota"""
+        self.projects = OrderedDict()
+        self._updated = []
+        self.projects = self._read()
+
+    def save(self):
+        """Scrive i progetti aggiornati con store sopra quelli attualmente nel file
+
+        Il file viene riletto sotto lock, così i progetti salvati nel frattempo
+        da altre istanze non vanno persi, e sostituito in modo atomico con un
+        file temporaneo univoco nella stessa cartella.
+        """
+        folder = os.path.dirname(self.filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with _save_lock:
+            try:
+                projects = self._read()
+            except ValueError:
+                # File illeggibile: viene sostituito
+                projects = OrderedDict()
+            for project_key in self._updated:
+                if project_key not in self.projects:
+                    continue
+                projects.pop(project_key, None)
+                projects[project_key] = self.projects[project_key]
+            while len(projects) > self.max_projects:
+                projects.popitem(last=False)
+
+            handle, temp_filename = tempfile.mkstemp(
+                prefix=os.path.basename(self.filename) + '.', suffix='.tmp',
+                dir=folder or os.curdir)
+            try:
+                with os.fdopen(handle, 'w', encoding='utf-8') as f:
+                    json.dump({"version": CACHE_VERSION, "projects": projects}, f,
+                              ensure_ascii=False)
+                os.replace(temp_filename, self.filename)
+            finally:
+                if os.path.exists(temp_filename):
+                    os.remove(temp_filename)
+        self.projects = projects
+        self._updated = []
+
+    def mapping(self, project_key, layers, fields):
+        """LayerMapping del progetto, con le corrispondenze salvate se presenti"""
+        mapping = LayerMapping(project_key, layers, fields)
+        stored = self.projects.get(mapping.project_key)
+        if stored is not None:
+            mapping.restore(stored)
+        return mapping
+
+    def store(self, mapping):
+        """Aggiorna le corrispondenze del progetto e lo segna come usato di recente"""
+        self.projects.pop(mapping.project_key, None)
+        self.projects[mapping.project_key] = mapping.to_dict()
+        if mapping.project_key in self._updated:
+            self._updated.remove(mapping.project_key)
+        self._updated.append(mapping.project_key)
+        while len(self.projects) > self.max_projects:
+            self.projects.popitem(last=False)
@@ -0,0 +1,376 @@
+# project_files.py
+# Lettura e aggiornamento delle relazioni direttamente nei file di progetto
+# .qgs/.qgz, senza aprirli in QGIS. Il file viene letto con un parser XML in
+# streaming (expat); in scrittura viene sostituita solo la sezione
+# <relations>, lasciando il resto del file byte per byte com'era.
+# Non usa Qt né qgis: può girare in processi separati.
+import os
+import shutil
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
+
+from .relation_core import (LayerRef, FieldPair, RelationSpec, CatalogDiff, ProjectSnapshot,
+                            relation_fingerprint, plan_relations, is_composition)
+from .relation_graph import dependency_order
+
+
+PROJECT_EXTENSIONS = ('.qgs', '.qgz')
+
+# Prefissi dei percorsi salvati relativi alla cartella del progetto
+RELATIVE_PREFIXES = ('./', '../')
+
+# Relazione come scritta nel progetto; start e end_tag sono le posizioni (in
+# byte) dell'inizio dell'elemento e dell'inizio del suo tag di chiusura (per
+# un elemento vuoto, <x/>, della fine dell'elemento)
+ProjectRelation = namedtuple(
+    'ProjectRelation',
+    ['id', 'name', 'strength', 'referencing_layer', 'referenced_layer', 'field_pairs',
+     'start', 'end_tag'])
+
+# Contenuto del progetto letto dal parser. layers: lista di (id, nome,
+# sorgente), con i percorsi relativi risolti se la cartella è nota;
+# fields: layer_id -> nomi dei campi, solo per i layer vettoriali;
+# relations_span: (inizio, inizio del tag di chiusura) di <relations>;
+# root_end: inizio di </qgis>
+ProjectData = namedtuple('ProjectData', ['layers', 'fields', 'relations', 'relations_span',
+                                         'root_end'])
+
+# Esito dell'aggiornamento di un file
+ProjectResult = namedtuple('ProjectResult', ['path', 'imported', 'removed', 'summary',
+                                             'messages', 'error'])
+
+
+class _ProjectParser:
+    """Gestori expat che raccolgono layer e relazioni del progetto"""
+
+    LAYER_PATH = ['qgis', 'projectlayers', 'maplayer']
+    RELATIONS_PATH = ['qgis', 'relations']
+    LAYER_TEXT = ('id', 'layername', 'datasource')
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir
+        self.layers = []
+        self.fields = {}
+        self.relations = []
+        self.relations_span = None
+        self.root_end = None
+        self._path = []
+        self._layer = None
+        self._relation = None
+        self._relations_start = None
+        self._text = None
+
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.data
+
+    def start(self, name, attrs):
+        self._path.append(name)
+        path = self._path
+        if path == self.LAYER_PATH:
+            self._layer = {'type': attrs.get('type'), 'fields': []}
+        elif self._layer is not None and len(path) == 4:
+            if name in self.LAYER_TEXT:
+                self._text = []
+        elif self._layer is not None and path[3:] == ['fieldConfiguration', 'field']:
+            self._layer['fields'].append(attrs.get('name'))
+        elif path == self.RELATIONS_PATH:
+            self._relations_start = self.parser.CurrentByteIndex
+        elif path == self.RELATIONS_PATH + ['relation']:
+            self._relation = (attrs, [], self.parser.CurrentByteIndex)
+        elif path == self.RELATIONS_PATH + ['relation', 'fieldRef'] and self._relation:
+            self._relation[1].append(FieldPair(attrs.get('referencingField'),
+                                               attrs.get('referencedField')))
+
+    def data(self, text):
+        if self._text is not None:
+            self._text.append(text)
+
+    def end(self, name):
+        path = self._path
+        if self._text is not None and len(path) == 4:
+            self._layer[name] = "".join(self._text)
+            self._text = None
+        elif path == self.LAYER_PATH:
+            layer = self._layer
+            self._layer = None
+            if layer.get('id'):
+                self.layers.append((layer['id'], layer.get('layername', ''),
+                                    absolute_source(layer.get('datasource', ''),
+                                                    self.base_dir)))
+                if layer['type'] == 'vector':
+                    self.fields[layer['id']] = layer['fields']
+        elif path == self.RELATIONS_PATH + ['relation'] and self._relation:
+            attrs, field_pairs, start = self._relation
+            self._relation = None
+            self.relations.append(ProjectRelation(
+                attrs.get('id'), attrs.get('name', ''), attrs.get('strength'),
+                attrs.get('referencingLayer'), attrs.get('referencedLayer'),
+                tuple(field_pairs), start, self.parser.CurrentByteIndex))
+        elif path == self.RELATIONS_PATH:
+            self.relations_span = (self._relations_start, self.parser.CurrentByteIndex)
+        elif len(path) == 1:
+            self.root_end = self.parser.CurrentByteIndex
+        path.pop()
+
+    def result(self):
+        return ProjectData(self.layers, self.fields, self.relations, self.relations_span,
+                           self.root_end)
+
+
+def absolute_source(source, base_dir):
+    """Sorgente con il percorso relativo (./, ../) risolto rispetto a base_dir
+
+    Le opzioni dopo il percorso (|layername=...) restano invariate; senza
+    base_dir o con percorsi assoluti e sorgenti di database la sorgente
+    viene restituita com'è.
+    """
+    if base_dir is None or not source.startswith(RELATIVE_PREFIXES):
+        return source
+    path, separator, options = source.partition('|')
+    return os.path.normpath(os.path.join(base_dir, path)) + separator + options
+
+
+def parse_project_xml(data, base_dir=None):
+    """ProjectData dai byte dell'XML del progetto; base_dir: cartella del file"""
+    parser = _ProjectParser(base_dir)
+    parser.parser.Parse(data, True)
+    return parser.result()
+
+
+def project_dir(path):
+    """Cartella rispetto a cui QGIS salva i percorsi relativi del progetto"""
+    return os.path.dirname(os.path.abspath(path))
+
+
+def _qgz_member(archive):
+    for name in archive.namelist():
+        if name.lower().endswith('.qgs'):
+            return name
+    raise ValueError("nessun file .qgs nell'archivio")
+
+
+def read_project(path):
+    """ProjectData di un file .qgs/.qgz, letto in streaming"""
+    parser = _ProjectParser(project_dir(path))
+    if path.lower().endswith('.qgz'):
+        with zipfile.ZipFile(path) as archive:
+            with archive.open(_qgz_member(archive)) as f:
+                parser.parser.ParseFile(f)
+    else:
+        with open(path, 'rb') as f:
+            parser.parser.ParseFile(f)
+    return parser.result()
+
+
+def _field_index(field, fields):
+    """Indice del campo come nelle esportazioni dal progetto aperto, se noto"""
+    if fields is not None and field in fields:
+        return fields.index(field)
+    return field
+
+
+def project_specs(project):
+    """RelationSpec delle relazioni del progetto, come relation_core.project_specs"""
+    refs = {layer_id: LayerRef(layer_id, name, source) for layer_id, name, source in project.layers}
+    missing = LayerRef(None, None, None)
+    specs = []
+    for relation in project.relations:
+        referencing_fields = project.fields.get(relation.referencing_layer)
+        referenced_fields = project.fields.get(relation.referenced_layer)
+        field_pairs = tuple(
+            FieldPair(_field_index(pair.referencing_field, referencing_fields),
+                      _field_index(pair.referenced_field, referenced_fields))
+            for pair in relation.field_pairs)
+        specs.append(RelationSpec(relation.id, relation.name, relation.strength,
+                                  refs.get(relation.referencing_layer, missing),
+                                  refs.get(relation.referenced_layer, missing),
+                                  field_pairs))
+    return specs
+
+
+def project_snapshot(project):
+    """ProjectSnapshot del progetto letto da file, per plan_relations"""
+    fingerprints = {spec.id: relation_fingerprint(spec) for spec in project_specs(project)}
+    return ProjectSnapshot(project.layers, project.fields, fingerprints)
+
+
+def relation_xml(planned, indent):
+    """Elemento <relation> per una relazione pianificata"""
+    strength = ("Composition" if planned.strength is not None and is_composition(planned.strength)
+                else "Association")
+    lines = [f"<relation id={quoteattr(planned.id)} name={quoteattr(planned.name)} "
+             f"referencingLayer={quoteattr(planned.referencing_layer_id)} "
+             f"referencedLayer={quoteattr(planned.referenced_layer_id)} "
+             f"strength={quoteattr(strength)}>"]
+    for referencing_field, referenced_field in planned.field_pairs:
+        lines.append(f"{indent}  <fieldRef referencingField={quoteattr(referencing_field)} "
+                     f"referencedField={quoteattr(referenced_field)}/>")
+    lines.append(f"{indent}</relation>")
+    return "\n".join(lines)
+
+
+def _element_end(data, end_tag):
+    """Posizione successiva alla fine dell'elemento (anche se vuoto, <x/>)"""
+    if data.startswith(b'</', end_tag):
+        return data.index(b'>', end_tag) + 1
+    return end_tag
+
+
+def replace_relations(data, project, keep_ids, planned):
+    """XML del progetto con la sezione <relations> riscritta
+
+    Le relazioni esistenti in keep_ids vengono copiate così come sono, le
+    planned vengono aggiunte in fondo. Il resto del file non cambia.
+    """
+    if project.relations_span is not None:
+        start = project.relations_span[0]
+        end = _element_end(data, project.relations_span[1])
+    else:
+        start = end = project.root_end
+    line_start = data.rfind(b'\n', 0, start) + 1
+    indent = data[line_start:start].decode('utf-8')
+    if indent.strip() or project.relations_span is None:
+        indent = "  "
+
+    child_indent = indent + "  "
+    items = [data[relation.start:_element_end(data, relation.end_tag)].decode('utf-8')
+             for relation in project.relations if relation.id in keep_ids]
+    items.extend(relation_xml(planned_relation, child_indent) for planned_relation in planned)
+    if items:
+        section = ("<relations>\n" + "".join(f"{child_indent}{item}\n" for item in items)
+                   + f"{indent}</relations>")
+    else:
+        section = "<relations/>"
+
+    if project.relations_span is None:
+        # Progetto senza sezione: la aggiunge prima della chiusura di <qgis>
+        section = f"{indent}{section}\n"
+        start = end = line_start
+    return data[:start] + section.encode('utf-8') + data[end:]
+
+
+def _read_bytes(path):
+    if path.lower().endswith('.qgz'):
+        with zipfile.ZipFile(path) as archive:
+            return archive.read(_qgz_member(archive))
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _write_bytes(path, data, backup=True):
+    """Sostituisce l'XML del progetto; per i .qgz copia gli altri file dell'archivio"""
+    if backup:
+        shutil.copy2(path, path + '~')
+    temp_path = path + '.tmp'
+    try:
+        if path.lower().endswith('.qgz'):
+            with zipfile.ZipFile(path) as source, zipfile.ZipFile(temp_path, 'w') as target:
+                member = _qgz_member(source)
+                for info in source.infolist():
+                    target.writestr(info, data if info.filename == member else source.read(info))
+        else:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def update_project_file(path, specs, policy='skip', dry_run=False, backup=True, invalid=()):
+    """Importa le relazioni specs nel file di progetto, come import_catalog
+
+    Layer e campi vengono cercati tra quelli scritti nel progetto con le
+    stesse regole dell'importazione nel progetto aperto. invalid sono gli
+    ID delle relazioni del catalogo non decodificabili (CatalogMerge.invalid),
+    che prune non rimuove. Con dry_run il file non viene modificato.
+    Restituisce un ProjectResult.
+    """
+    messages = []
+    log = messages.append
+    try:
+        data = _read_bytes(path)
+        project = parse_project_xml(data, project_dir(path))
+        snapshot = project_snapshot(project)
+        diff = CatalogDiff(snapshot.fingerprints, policy)
+        for relation_id in invalid:
+            diff.skip_invalid(relation_id)
+        selected = list(diff.select(specs, log))
+        planned = [] if dry_run else plan_relations(selected, snapshot, log)
+
+        # Stesse regole di apply_relations
+        existing = {relation.id for relation in project.relations}
+        replace_ids = diff.replace_ids
+        added = []
+        added_ids = set()
+        for planned_relation in planned:
+            if planned_relation.id in added_ids or (planned_relation.id in existing
+                                                    and planned_relation.id not in replace_ids):
+                log(f"⚠️ Relazione '{planned_relation.name}' già esistente, saltata")
+                continue
+            added.append(planned_relation)
+            added_ids.add(planned_relation.id)
+        added, cycles = dependency_order(added)
+
+        drop_ids = (added_ids & existing) | set(diff.remove_ids)
+        removed = len(existing & set(diff.remove_ids))
+        if (added or removed) and not dry_run:
+            keep_ids = existing - drop_ids
+            _write_bytes(path, replace_relations(data, project, keep_ids, added), backup)
+        return ProjectResult(path, len(added), removed, diff.summary(), messages, None)
+
+    except Exception as e:
+        return ProjectResult(path, 0, 0, "", messages, str(e))
+
+
+def project_paths(paths):
+    """File di progetto indicati; delle cartelle tutti i .qgs/.qgz, anche nelle sottocartelle"""
+    filenames = []
+    for path in paths:
+        if not os.path.isdir(path):
+            filenames.append(path)
+            continue
+        for folder, dirs, files in os.walk(path):
+            dirs.sort()
+            filenames.extend(os.path.join(folder, name) for name in sorted(files)
+                             if name.lower().endswith(PROJECT_EXTENSIONS))
+    return list(dict.fromkeys(filenames))
+
+
+# Catalogo condiviso dai processi: viene passato una volta per processo
+_worker_options = None
+
+
+def _init_worker(specs, policy, dry_run, backup, invalid):
+    global _worker_options
+    _worker_options = (specs, policy, dry_run, backup, invalid)
+
+
+def _update_in_worker(path):
+    return update_project_file(path, *_worker_options)
+
+
+def update_project_files(paths, specs, policy='skip', dry_run=False, backup=True,
+                         max_workers=None, on_result=None, invalid=()):
+    """Aggiorna più file di progetto in parallelo con un pool di processi
+
+    invalid come in update_project_file; on_result viene chiamata con ogni ProjectResult appena pronto;
+    i risultati restituiti sono nell'ordine di paths.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(specs, policy, dry_run, backup,
+                                       list(invalid))) as executor:
+        futures = {executor.submit(_update_in_worker, path): path for path in paths}
+        results = {}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if on_result is not None:
+                on_result(result)
+    return [results[path] for path in paths]
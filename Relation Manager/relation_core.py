@@ -0,0 +1,731 @@
+# relation_core.py
+# Logica di esportazione e importazione delle relazioni, indipendente da Qt.
+# Non importa PyQt né qgis a livello di modulo: le funzioni che lavorano su
+# un progetto lo ricevono come argomento, così possono essere usate anche in
+# script senza interfaccia grafica. Il dialog è un'interfaccia sopra queste
+# funzioni.
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+from .import_stats import ImportStats
+from .layer_resolver import LayerResolver
+from .relation_graph import dependency_order
+
+
+# Versione 2.0: tabella "layers" con ogni layer scritto una sola volta e
+# relazioni che vi fanno riferimento per chiave. La 1.0 ripete i dati del
+# layer in ogni relazione e resta supportata in lettura e scrittura.
+FORMAT_VERSION = "2.0"
+LEGACY_FORMAT_VERSION = "1.0"
+
+# Layer di un capo della relazione, come scritto nel file
+LayerRef = namedtuple('LayerRef', ['id', 'name', 'source'])
+
+# Coppia di campi; i valori possono essere nomi o indici dei campi
+FieldPair = namedtuple('FieldPair', ['referencing_field', 'referenced_field'])
+
+# Relazione letta dal file o dal progetto. Come nel formato JSON,
+# parent_layer è il layer referencing e child_layer il layer referenced
+RelationSpec = namedtuple(
+    'RelationSpec',
+    ['id', 'name', 'strength', 'parent_layer', 'child_layer', 'field_pairs'])
+
+# Relazione validata, pronta per essere creata nel thread principale
+PlannedRelation = namedtuple(
+    'PlannedRelation',
+    ['id', 'name', 'strength', 'referencing_layer_id', 'referenced_layer_id', 'field_pairs'])
+
+# Esito di apply_relations: relazioni aggiunte (nuove o aggiornate) e
+# relazioni rimosse perché assenti dal catalogo
+ApplyResult = namedtuple('ApplyResult', ['added', 'removed'])
+
+# Politiche per le relazioni del catalogo già presenti nel progetto:
+# skip     importa solo le relazioni nuove
+# update   importa le nuove e sostituisce quelle modificate
+# replace  importa e sostituisce tutte le relazioni del catalogo
+# prune    come update, e rimuove le relazioni assenti dal catalogo
+IMPORT_POLICIES = ('skip', 'update', 'replace', 'prune')
+
+
+def layer_ref(layer, layer_refs=None):
+    """LayerRef di un layer del progetto (None se il layer manca)
+
+    layer_refs, se indicato, è un dizionario layer_id -> LayerRef usato
+    per leggere nome e sorgente una sola volta per layer.
+    """
+    if not layer:
+        return LayerRef(None, None, None)
+    if layer_refs is None:
+        return LayerRef(layer.id(), layer.name(), layer.source())
+    layer_id = layer.id()
+    if layer_id not in layer_refs:
+        layer_refs[layer_id] = LayerRef(layer_id, layer.name(), layer.source())
+    return layer_refs[layer_id]
+
+
+def spec_from_relation(rel_id, relation, layer_refs=None):
+    """Legge una QgsRelation in una RelationSpec"""
+    referencing_fields = relation.referencingFields()
+    referenced_fields = relation.referencedFields()
+    field_pairs = tuple(FieldPair(referencing_field, referenced_field)
+                        for referencing_field, referenced_field
+                        in zip(referencing_fields, referenced_fields))
+
+    return RelationSpec(rel_id, relation.name(), str(relation.strength()),
+                        layer_ref(relation.referencingLayer(), layer_refs),
+                        layer_ref(relation.referencedLayer(), layer_refs),
+                        field_pairs)
+
+
+def relation_specs(relations, log=print):
+    """RelationSpec delle relazioni indicate (dizionario id -> QgsRelation)"""
+    specs = []
+    layer_refs = {}
+    for rel_id, relation in relations.items():
+        try:
+            specs.append(spec_from_relation(rel_id, relation, layer_refs))
+        except Exception as e:
+            log(f"Errore nella serializzazione della relazione {rel_id}: {str(e)}")
+    return specs
+
+
+def project_specs(project, log=print):
+    """RelationSpec di tutte le relazioni del progetto indicato"""
+    return relation_specs(project.relationManager().relations(), log)
+
+
+def layer_keys(specs):
+    """Chiavi della tabella dei layer: dizionario LayerRef -> chiave
+
+    La chiave è l'ID del layer; se lo stesso ID compare con nome o
+    sorgente diversi (cataloghi di progetti diversi) viene resa univoca.
+    """
+    keys = {}
+    used = set()
+    for spec in specs:
+        for ref in (spec.parent_layer, spec.child_layer):
+            if ref in keys:
+                continue
+            key = ref.id or "layer"
+            suffix = 1
+            while key in used:
+                suffix += 1
+                key = f"{ref.id or 'layer'}_{suffix}"
+            keys[ref] = key
+            used.add(key)
+    return keys
+
+
+def encode_relation(spec, keys=None):
+    """Dizionario JSON di una relazione
+
+    Con keys (vedi layer_keys) i layer sono scritti come chiavi della
+    tabella dei layer (formato 2.0), altrimenti per esteso (formato 1.0).
+    """
+    if keys is None:
+        parent_layer = spec.parent_layer._asdict()
+        child_layer = spec.child_layer._asdict()
+    else:
+        parent_layer = keys[spec.parent_layer]
+        child_layer = keys[spec.child_layer]
+
+    return {
+        "id": spec.id,
+        "name": spec.name,
+        "strength": spec.strength,
+        "parent_layer": parent_layer,
+        "child_layer": child_layer,
+        "field_pairs": [pair._asdict() for pair in spec.field_pairs]
+    }
+
+
+def encode_layers(keys):
+    """Sezione "layers" del formato 2.0"""
+    return {key: ref._asdict() for ref, key in keys.items()}
+
+
+def encode_catalog(specs, project_file, version=FORMAT_VERSION):
+    """Dizionario JSON completo del file di esportazione"""
+    if version == LEGACY_FORMAT_VERSION:
+        return {
+            "version": version,
+            "export_date": project_file,
+            "relations": [encode_relation(spec) for spec in specs]
+        }
+
+    keys = layer_keys(specs)
+    return {
+        "version": version,
+        "export_date": project_file,
+        "layers": encode_layers(keys),
+        "relations": [encode_relation(spec, keys) for spec in specs]
+    }
+
+
+def decode_layer(layer_data):
+    """LayerRef da un dizionario JSON"""
+    return LayerRef(layer_data.get("id"), layer_data["name"], layer_data["source"])
+
+
+def decode_layers(layers_data):
+    """Tabella dei layer del formato 2.0: dizionario chiave -> LayerRef"""
+    return {key: decode_layer(layer_data) for key, layer_data in layers_data.items()}
+
+
+def decode_relation(relation_data, layer_refs=None, layers=None):
+    """RelationSpec da un dizionario JSON; KeyError se mancano dati
+
+    layers è la tabella dei layer del formato 2.0, in cui i capi della
+    relazione sono indicati per chiave. layer_refs, se indicato, è un
+    dizionario usato per condividere lo stesso LayerRef tra tutte le
+    relazioni del formato 1.0 che puntano allo stesso layer.
+    """
+    def relation_layer(layer_data):
+        if isinstance(layer_data, str):
+            if layers is None:
+                raise KeyError("layers")
+            return layers[layer_data]
+        ref = decode_layer(layer_data)
+        if layer_refs is None:
+            return ref
+        return layer_refs.setdefault(ref, ref)
+
+    return RelationSpec(
+        relation_data["id"],
+        relation_data["name"],
+        relation_data.get("strength"),
+        relation_layer(relation_data["parent_layer"]),
+        relation_layer(relation_data["child_layer"]),
+        tuple(FieldPair(field_pair["referencing_field"], field_pair["referenced_field"])
+              for field_pair in relation_data["field_pairs"]))
+
+
+def invalid_relation_id(relation_data):
+    """ID di una relazione non decodificabile, se leggibile"""
+    relation_id = relation_data.get('id') if isinstance(relation_data, dict) else None
+    return relation_id if isinstance(relation_id, str) and relation_id else None
+
+
+def iter_specs(relations, log=print, layers=None, on_invalid=None):
+    """RelationSpec dai dizionari JSON delle relazioni, una alla volta
+
+    Accetta qualunque iterabile (anche una lettura in streaming del file);
+    layers è la tabella dei layer del formato 2.0. Le relazioni incomplete
+    vengono segnalate nel log e saltate; on_invalid, se indicata, viene
+    chiamata con il loro ID (None se non leggibile).
+    """
+    layer_refs = {}
+    for relation_data in relations:
+        try:
+            yield decode_relation(relation_data, layer_refs, layers)
+        except (KeyError, TypeError, AttributeError) as e:
+            name = relation_data.get('name', 'sconosciuta') if isinstance(relation_data, dict) else 'sconosciuta'
+            log(f"❌ Errore nell'importazione della relazione '{name}': dato mancante {str(e)}")
+            if on_invalid is not None:
+                on_invalid(invalid_relation_id(relation_data))
+
+
+def decode_catalog(relations_data, log=print, on_invalid=None):
+    """Lista di RelationSpec dal contenuto di un file di esportazione (vedi iter_specs)"""
+    if "relations" not in relations_data:
+        raise ValueError("Formato file non valido: manca la sezione 'relations'")
+    layers = decode_layers(relations_data["layers"]) if "layers" in relations_data else None
+    return list(iter_specs(relations_data["relations"], log, layers, on_invalid))
+
+
+def relation_fingerprint(spec):
+    """Impronta del contenuto di una relazione
+
+    Considera i capi (nome e sorgente dei layer), le coppie di campi
+    nell'ordine, la forza e il nome; non l'ID della relazione. La forza
+    conta solo come composizione o associazione, comunque sia scritta.
+    """
+    strength = None if spec.strength is None else is_composition(spec.strength)
+    content = json.dumps([
+        spec.name, strength,
+        spec.parent_layer.name, spec.parent_layer.source,
+        spec.child_layer.name, spec.child_layer.source,
+        [[str(pair.referencing_field), str(pair.referenced_field)] for pair in spec.field_pairs]
+    ], ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def is_composition(strength):
+    """True se la forza scritta nel file indica una composizione"""
+    strength = str(strength)
+    return strength == "1" or strength.endswith("Composition")
+
+
+class CatalogDiff:
+    """Confronto tra le relazioni del catalogo e quelle del progetto
+
+    Classifica ogni relazione come invariata, modificata o nuova usando
+    le impronte, prima di qualunque ricerca di layer o campi, e lascia
+    passare verso la risoluzione solo quelle richieste dalla politica.
+    Al termine della lettura removed contiene le relazioni del progetto
+    assenti dal catalogo. Le relazioni del catalogo non decodificabili
+    vanno segnalate con skip_invalid: il loro ID conta come presente e,
+    se l'ID non è leggibile, prune non rimuove niente.
+    """
+
+    def __init__(self, fingerprints, policy='skip'):
+        """fingerprints: dizionario ID relazione -> impronta, per il progetto"""
+        if policy not in IMPORT_POLICIES:
+            raise ValueError(f"Politica di importazione non valida: {policy}")
+        self.fingerprints = fingerprints
+        self.policy = policy
+        self.unchanged = []
+        self.changed = []
+        self.new = []
+        self.duplicates = []
+        self.invalid = []
+        self._seen = set()
+
+    def select(self, specs, log=print):
+        """Relazioni del catalogo da risolvere secondo la politica"""
+        for spec in specs:
+            if spec.id in self._seen:
+                self.duplicates.append(spec.id)
+                log(f"⚠️ Relazione '{spec.name}' duplicata nel catalogo, saltata")
+                continue
+            self._seen.add(spec.id)
+
+            fingerprint = self.fingerprints.get(spec.id)
+            if fingerprint is None:
+                self.new.append(spec.id)
+                yield spec
+            elif fingerprint == relation_fingerprint(spec):
+                self.unchanged.append(spec.id)
+                if self.policy == 'replace':
+                    yield spec
+            else:
+                self.changed.append(spec.id)
+                if self.policy == 'skip':
+                    log(f"⚠️ Relazione '{spec.name}' già esistente, saltata")
+                else:
+                    yield spec
+
+    def skip_invalid(self, relation_id=None):
+        """Segnala una relazione del catalogo saltata perché non decodificabile"""
+        self.invalid.append(relation_id)
+        if relation_id is not None:
+            self._seen.add(relation_id)
+
+    @property
+    def removed(self):
+        return sorted(set(self.fingerprints) - self._seen)
+
+    @property
+    def can_prune(self):
+        """False se il catalogo contiene relazioni non valide senza ID leggibile"""
+        return None not in self.invalid
+
+    @property
+    def replace_ids(self):
+        """Relazioni esistenti che l'importazione può sostituire"""
+        if self.policy == 'skip':
+            return set()
+        if self.policy == 'replace':
+            return set(self.changed) | set(self.unchanged)
+        return set(self.changed)
+
+    @property
+    def remove_ids(self):
+        """Relazioni esistenti da rimuovere perché assenti dal catalogo"""
+        return self.removed if self.policy == 'prune' and self.can_prune else []
+
+    def summary(self):
+        """Riepilogo testuale del confronto"""
+        lines = [
+            f"Relazioni invariate: {len(self.unchanged)}",
+            f"Relazioni modificate: {len(self.changed)}",
+            f"Relazioni nuove: {len(self.new)}",
+            f"Relazioni del progetto assenti dal catalogo: {len(self.removed)}",
+        ]
+        if self.duplicates:
+            lines.append(f"Relazioni duplicate nel catalogo: {len(self.duplicates)}")
+        if self.invalid:
+            lines.append(f"Relazioni non valide nel catalogo: {len(self.invalid)}")
+        if self.policy == 'prune' and not self.can_prune:
+            lines.append("⚠️ Relazioni senza ID leggibile nel catalogo: nessuna relazione rimossa")
+        return "\n".join(lines)
+
+
+class CatalogMerge:
+    """Unione delle relazioni di più cataloghi in un solo insieme
+
+    Le relazioni con lo stesso ID e lo stesso contenuto (stessa impronta)
+    vengono tenute una volta sola; con contenuto diverso è un conflitto e
+    resta la relazione del primo catalogo aggiunto. files contiene il
+    riepilogo per ogni catalogo; invalid gli ID (None se non leggibili)
+    delle relazioni non decodificabili di tutti i cataloghi, da passare a
+    CatalogDiff.skip_invalid.
+    """
+
+    def __init__(self):
+        self.files = []
+        self.conflicts = []
+        self.invalid = []
+        self._specs = {}
+
+    def add(self, source, specs, log=print, invalid=()):
+        """Aggiunge le relazioni di un catalogo; source è il nome mostrato nel log
+
+        invalid: ID delle relazioni del catalogo saltate in lettura.
+        """
+        self.invalid.extend(invalid)
+        counts = {"source": source, "relations": 0, "added": 0, "duplicates": 0,
+                  "conflicts": 0, "errors": len(invalid)}
+        for spec in specs:
+            counts["relations"] += 1
+            fingerprint = relation_fingerprint(spec)
+            previous = self._specs.get(spec.id)
+            if previous is None:
+                self._specs[spec.id] = (spec, fingerprint, source)
+                counts["added"] += 1
+            elif previous[1] == fingerprint:
+                counts["duplicates"] += 1
+            else:
+                counts["conflicts"] += 1
+                self.conflicts.append((spec.id, previous[2], source))
+                log(f"⚠️ Relazione '{spec.name}' ({spec.id}) in conflitto: "
+                    f"diversa da quella di {previous[2]}, saltata")
+        self.files.append(counts)
+        return counts
+
+    @property
+    def specs(self):
+        """Relazioni unite, nell'ordine in cui sono state lette"""
+        return [spec for spec, fingerprint, source in self._specs.values()]
+
+    def summary(self):
+        """Riepilogo per catalogo"""
+        lines = []
+        for counts in self.files:
+            line = (f"{counts['source']}: {counts['relations']} relazioni, "
+                    f"{counts['added']} aggiunte, {counts['duplicates']} duplicate, "
+                    f"{counts['conflicts']} in conflitto")
+            if counts["errors"]:
+                line += f", {counts['errors']} non valide"
+            lines.append(line)
+        lines.append(f"Totale: {len(self._specs)} relazioni da {len(self.files)} cataloghi")
+        return "\n".join(lines)
+
+
+class ProjectSnapshot:
+    """Copia dei dati di progetto necessari all'importazione
+
+    Va creata nel thread principale; dopo la creazione non accede più
+    agli oggetti QGIS e può essere usata da un thread in background.
+    Se mapping (mapping_cache.LayerMapping) è impostato, le ricerche dei
+    layer usano prima le corrispondenze salvate.
+    """
+
+    def __init__(self, layers, fields, fingerprints):
+        """layers: lista di (layer_id, nome, sorgente) nell'ordine del progetto
+        fields: dizionario layer_id -> lista dei nomi dei campi (solo layer vettoriali)
+        fingerprints: dizionario ID -> impronta delle relazioni del progetto
+        """
+        self.layers = layers
+        self.fields = fields
+        self.fingerprints = fingerprints
+        self.mapping = None
+        self._names = {layer_id: name for layer_id, name, source in layers}
+        self._resolver = None
+
+    @classmethod
+    def from_project(cls, project):
+        """Legge layer, campi e relazioni esistenti dal progetto indicato"""
+        layers = []
+        fields = {}
+        for layer_id, layer in project.mapLayers().items():
+            layers.append((layer_id, layer.name(), layer.source()))
+            if hasattr(layer, 'fields'):
+                fields[layer_id] = [field.name() for field in layer.fields()]
+
+        fingerprints = {spec.id: relation_fingerprint(spec)
+                        for spec in project_specs(project)}
+        return cls(layers, fields, fingerprints)
+
+    @property
+    def resolver(self):
+        """Indice dei layer, costruito alla prima richiesta"""
+        if self._resolver is None:
+            self._resolver = LayerResolver(self.layers)
+        return self._resolver
+
+    def resolve(self, name, source):
+        """(layer_id, strategia) come LayerResolver.resolve; 'cache' se dalla cache"""
+        if self.mapping is not None:
+            cached = self.mapping.lookup(name, source)
+            if cached is not None:
+                return cached[0], 'cache' if cached[0] is not None else None
+        layer_id, strategy = self.resolver.resolve(name, source)
+        if self.mapping is not None:
+            self.mapping.record(name, source, layer_id, strategy)
+        return layer_id, strategy
+
+    def layer_name(self, layer_id):
+        return self._names.get(layer_id)
+
+    def layer_fields(self, layer_id):
+        """Nomi dei campi del layer; errore se il layer non è vettoriale"""
+        if layer_id not in self.fields:
+            raise ValueError(f"il layer '{self.layer_name(layer_id)}' non è vettoriale")
+        return self.fields[layer_id]
+
+
+def _resolve_field(field, fields):
+    """Converte un indice numerico nel nome del campo; None se non valido"""
+    if field.isdigit():
+        field_index = int(field)
+        if field_index < len(fields):
+            return fields[field_index]
+        return None
+    return field
+
+
+def _plan_relation(spec, snapshot, log, stats):
+    """PlannedRelation per una relazione del catalogo, None se non importabile"""
+    # Trova i layer nel progetto corrente
+    with stats.phase('layer_resolution'):
+        parent_layer_id, parent_strategy = snapshot.resolve(
+            spec.parent_layer.name, spec.parent_layer.source)
+        child_layer_id, child_strategy = snapshot.resolve(
+            spec.child_layer.name, spec.child_layer.source)
+    stats.record_strategy(parent_strategy)
+    stats.record_strategy(child_strategy)
+
+    if not parent_layer_id:
+        log(f"❌ Parent layer non trovato: {spec.parent_layer.name}")
+        return None
+
+    if not child_layer_id:
+        log(f"❌ Child layer non trovato: {spec.child_layer.name}")
+        return None
+
+    log(f"✅ Parent layer trovato: {snapshot.layer_name(parent_layer_id)} (ID: {parent_layer_id})")
+    log(f"✅ Child layer trovato: {snapshot.layer_name(child_layer_id)} (ID: {child_layer_id})")
+
+    with stats.phase('field_validation'):
+        parent_fields = snapshot.layer_fields(parent_layer_id)
+        child_fields = snapshot.layer_fields(child_layer_id)
+
+        # Verifica le coppie di campi
+        field_pairs = []
+        for field_pair in spec.field_pairs:
+            ref_field = _resolve_field(str(field_pair.referencing_field), parent_fields)
+            if ref_field is None:
+                log(f"⚠️ Indice campo parent non valido: {field_pair.referencing_field}")
+                continue
+
+            refd_field = _resolve_field(str(field_pair.referenced_field), child_fields)
+            if refd_field is None:
+                log(f"⚠️ Indice campo child non valido: {field_pair.referenced_field}")
+                continue
+
+            if ref_field not in parent_fields:
+                log(f"⚠️ Campo '{ref_field}' non trovato nel parent layer")
+                continue
+
+            if refd_field not in child_fields:
+                log(f"⚠️ Campo '{refd_field}' non trovato nel child layer")
+                continue
+
+            field_pairs.append(FieldPair(ref_field, refd_field))
+            log(f"✅ Campo aggiunto: {ref_field} -> {refd_field}")
+
+    if not field_pairs:
+        log(f"❌ Nessuna coppia di campi valida trovata")
+        return None
+
+    return PlannedRelation(spec.id, spec.name, spec.strength,
+                           parent_layer_id, child_layer_id, tuple(field_pairs))
+
+
+def plan_relations(specs, snapshot, log, is_canceled=None, set_progress=None, stats=None):
+    """Risolve layer e campi delle relazioni da importare
+
+    Non modifica il progetto: restituisce la lista di PlannedRelation
+    valide da creare. Non usa oggetti QGIS e può quindi essere eseguita
+    in un thread in background. Le relazioni già presenti nel progetto
+    vanno filtrate prima con CatalogDiff.select.
+
+    specs può essere anche un iteratore letto in streaming: in quel caso
+    ogni relazione viene risolta appena letta e set_progress non viene
+    chiamata (l'avanzamento è misurato da chi legge il file).
+    stats (ImportStats) raccoglie tempi e strategie di ricerca.
+    """
+    if stats is None:
+        stats = ImportStats()
+    planned = []
+    total = len(specs) if hasattr(specs, '__len__') else None
+
+    if total is None:
+        log("\nImportazione delle relazioni in streaming...")
+    else:
+        log(f"\nTentativo di importare {total} relazioni...")
+
+    for i, spec in enumerate(specs):
+        if is_canceled is not None and is_canceled():
+            break
+        if set_progress is not None and total:
+            set_progress(100.0 * i / total)
+
+        start = time.perf_counter()
+        stats.count('relations_resolved')
+        try:
+            log(f"\n--- Relazione {i + 1}: {spec.name} ---")
+            planned_relation = _plan_relation(spec, snapshot, log, stats)
+            if planned_relation is not None:
+                planned.append(planned_relation)
+
+        except Exception as e:
+            error_msg = f"Errore nell'importazione della relazione '{spec.name}': {str(e)}"
+            log(f"❌ {error_msg}")
+
+        stats.record_relation(spec.id, spec.name, time.perf_counter() - start)
+
+    stats.count('relations_planned', len(planned))
+    if set_progress is not None:
+        set_progress(100.0)
+
+    return planned
+
+
+def commit_relations(relation_manager, relations, remove_ids=()):
+    """Applica al progetto un insieme di modifiche in un'unica operazione
+
+    Rimuove le relazioni remove_ids e aggiunge relations. I segnali del
+    relation manager restano bloccati durante le modifiche e changed
+    viene emesso una sola volta alla fine, così form e widget si
+    aggiornano una volta sola. Se un passo fallisce tutte le modifiche
+    già fatte vengono annullate (tutto o niente).
+    Restituisce il numero di relazioni aggiunte e rimosse.
+    """
+    added = []
+    removed = []
+    signals_blocked = relation_manager.blockSignals(True)
+    try:
+        for relation_id in remove_ids:
+            previous = relation_manager.relation(relation_id)
+            if previous.isValid():
+                relation_manager.removeRelation(relation_id)
+                removed.append(previous)
+
+        for relation in relations:
+            relation_manager.addRelation(relation)
+            if not relation_manager.relation(relation.id()).isValid():
+                raise RuntimeError(f"impossibile aggiungere la relazione '{relation.name()}'")
+            added.append(relation.id())
+    except Exception:
+        for relation_id in added:
+            relation_manager.removeRelation(relation_id)
+        for previous in removed:
+            relation_manager.addRelation(previous)
+        raise
+    finally:
+        relation_manager.blockSignals(signals_blocked)
+
+    if added or removed:
+        relation_manager.changed.emit()
+    return len(added), len(removed)
+
+
+def apply_relations(project, planned, log=print, replace_ids=(), remove_ids=(), stats=None):
+    """Crea nel progetto le relazioni validate da plan_relations
+
+    Le relazioni già presenti vengono sostituite solo se il loro ID è in
+    replace_ids (vedi CatalogDiff); remove_ids sono relazioni da
+    eliminare. Le relazioni vengono create con i padri prima dei figli;
+    prima costruisce e verifica tutte le relazioni, poi applica le
+    modifiche in un'unica operazione: in caso di errore il progetto resta
+    invariato. Va chiamata nel thread principale. Restituisce un
+    ApplyResult.
+    """
+    from qgis.core import QgsRelation
+
+    if stats is None:
+        stats = ImportStats()
+    start = time.perf_counter()
+    relation_manager = project.relationManager()
+
+    planned, cycles = dependency_order(planned)
+    for cycle in cycles:
+        names = [project.mapLayer(layer_id).name() if project.mapLayer(layer_id) else layer_id
+                 for layer_id in cycle]
+        log(f"⚠️ Relazioni circolari tra i layer: {' -> '.join(names + names[:1])}")
+    relations = []
+    relation_ids = set()
+    replaced_ids = set()
+
+    for planned_relation in planned:
+        # Il progetto può essere cambiato durante l'elaborazione in background
+        exists = relation_manager.relation(planned_relation.id).isValid()
+        if (planned_relation.id in relation_ids
+                or (exists and planned_relation.id not in replace_ids)):
+            log(f"⚠️ Relazione '{planned_relation.name}' già esistente, saltata")
+            continue
+
+        relation = QgsRelation()
+        relation.setId(planned_relation.id)
+        relation.setName(planned_relation.name)
+        relation.setReferencingLayer(planned_relation.referencing_layer_id)
+        relation.setReferencedLayer(planned_relation.referenced_layer_id)
+        if planned_relation.strength is not None:
+            relation.setStrength(QgsRelation.Composition if is_composition(planned_relation.strength)
+                                 else QgsRelation.Association)
+        for ref_field, refd_field in planned_relation.field_pairs:
+            relation.addFieldPair(ref_field, refd_field)
+
+        # Controlla se la relazione è valida
+        if not relation.isValid():
+            log(f"❌ Relazione '{planned_relation.name}' non valida dopo la creazione")
+            continue
+
+        relations.append(relation)
+        relation_ids.add(planned_relation.id)
+        if exists:
+            replaced_ids.add(planned_relation.id)
+
+    try:
+        imported_count, removed_count = commit_relations(
+            relation_manager, relations, list(replaced_ids) + list(remove_ids))
+    except Exception as e:
+        log(f"❌ Importazione annullata, nessuna modifica applicata: {str(e)}")
+        raise
+    finally:
+        stats.add_time('add_relation', time.perf_counter() - start)
+    stats.count('relations_added', imported_count)
+
+    for relation in relations:
+        if relation.id() in replaced_ids:
+            log(f"✅ Relazione '{relation.name()}' aggiornata con successo!")
+        else:
+            log(f"✅ Relazione '{relation.name()}' importata con successo!")
+    pruned_count = removed_count - len(replaced_ids)
+    if remove_ids:
+        log(f"🗑️ Relazioni rimosse perché assenti dal catalogo: {pruned_count}")
+
+    return ApplyResult(imported_count, pruned_count)
+
+
+def export_catalog(project, log=print):
+    """Contenuto del file di esportazione per le relazioni del progetto"""
+    return encode_catalog(project_specs(project, log), project.fileName())
+
+
+def import_catalog(project, relations_data, log=print, policy='skip'):
+    """Importa nel progetto le relazioni di un file già letto
+
+    Esegue decodifica, confronto, risoluzione e applicazione nel thread
+    corrente; restituisce un ApplyResult.
+    """
+    snapshot = ProjectSnapshot.from_project(project)
+    diff = CatalogDiff(snapshot.fingerprints, policy)
+    specs = list(diff.select(decode_catalog(relations_data, log, diff.skip_invalid), log))
+    planned = plan_relations(specs, snapshot, log)
+    log(diff.summary())
+    return apply_relations(project, planned, log, diff.replace_ids, diff.remove_ids)
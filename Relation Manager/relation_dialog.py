@@ -1,28 +1,57 @@
 # relation_dialog.py
 import os
-import json
-from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtCore import Qt, QTimer, QUrl
+from qgis.PyQt.QtGui import QDesktopServices
 from qgis.PyQt.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout,
-                                 QPushButton, QTableWidget, QTableWidgetItem,
+                                 QPushButton, QTableView, QLineEdit,
                                  QLabel, QMessageBox, QFileDialog, QHeaderView,
                                  QDialogButtonBox, QSpacerItem, QSizePolicy,
-                                 QTextEdit, QCheckBox, QComboBox, QFormLayout,
-                                 QGroupBox)
-from qgis.core import QgsProject, QgsRelation, QgsVectorLayer, QgsRelationManager
+                                 QListView, QCheckBox, QComboBox,
+                                 QGroupBox, QProgressBar)
+from qgis.core import QgsApplication, QgsProject
+from .cardinality import CardinalityCache
+from .integrity import integrity_jobs
+from .layer_resolver import LayerResolver
+from .log_sink import LogSink, LogListModel, DEBUG, INFO
+from .mapping_cache import MappingCache
+from .catalog_io import (EXPORT_FILTERS, IMPORT_FILTERS, catalog_files, export_filename,
+                         export_version)
+from .relation_core import (ProjectSnapshot, relation_specs, encode_catalog,
+                            import_catalog, apply_relations)
+from .relation_graph import RelationGraph
+from .relation_model import RelationTableModel, RelationFilterProxyModel
+from .relation_tasks import (ImportRelationsTask, ExportRelationsTask, ValidateRelationsTask,
+                             CardinalityTask)
 
 
 class RelationDialog(QDialog):
     def __init__(self, parent=None):
         super(RelationDialog, self).__init__(parent)
+        self.task = None
+        self.import_stats = None
+        self._stats_pending = False
+        self.logSink = LogSink()
         self.setupUi()
 
         # Connetti i pulsanti
         self.exportButton.clicked.connect(self.export_relations)
         self.importButton.clicked.connect(self.import_relations)
+        self.importFolderButton.clicked.connect(self.import_folder)
         self.refreshButton.clicked.connect(self.refresh_relations)
-
-        # Carica le relazioni attuali
-        self.refresh_relations()
+        self.refreshButton.clicked.connect(self.update_stats)
+        self.validateButton.clicked.connect(lambda: self.validate_relations())
+        self.cancelButton.clicked.connect(self.cancel_task)
+        self.reportButton.clicked.connect(self.save_import_report)
+        self.logFileButton.clicked.connect(self.open_log_file)
+        self.detailsCheck.toggled.connect(self.show_log_details)
+        self.logModel.rowsInserted.connect(self.scroll_log)
+        self.filterEdit.textChanged.connect(self.proxyModel.set_filter_text)
+        self.layerFilterCombo.currentIndexChanged.connect(self.apply_layer_filter)
+        self.subtreeCheck.toggled.connect(self.apply_layer_filter)
+        self.statsCheck.toggled.connect(self.show_stats)
+
+        # Modello e grafo hanno già letto le relazioni attuali
+        self.update_info()
 
     def setupUi(self):
         """Crea l'interfaccia utente programmaticamente"""
@@ -43,11 +72,36 @@ class RelationDialog(QDialog):
 
         self.exportButton = QPushButton("Esporta Relazioni")
         self.importButton = QPushButton("Importa Relazioni")
+        self.importFolderButton = QPushButton("Importa Cartella")
+        self.importFolderButton.setToolTip("Importa insieme tutti i cataloghi contenuti in una cartella")
         self.refreshButton = QPushButton("Aggiorna")
+        self.validateButton = QPushButton("Verifica integrità")
+        self.validateButton.setToolTip("Cerca i record figli senza padre nelle relazioni selezionate (tutte se nessuna è selezionata)")
 
         button_layout.addWidget(self.exportButton)
         button_layout.addWidget(self.importButton)
+        button_layout.addWidget(self.importFolderButton)
         button_layout.addWidget(self.refreshButton)
+        button_layout.addWidget(self.validateButton)
+
+        # Opzioni di importazione
+        self.policyCombo = QComboBox()
+        self.policyCombo.addItem("Salta le esistenti", 'skip')
+        self.policyCombo.addItem("Aggiorna le modificate", 'update')
+        self.policyCombo.addItem("Sostituisci tutte", 'replace')
+        self.policyCombo.addItem("Aggiorna e rimuovi le mancanti", 'prune')
+        self.policyCombo.setToolTip("Cosa fare con le relazioni del catalogo già presenti nel progetto")
+        self.dryRunCheck = QCheckBox("Simulazione")
+        self.dryRunCheck.setToolTip("Mostra solo il confronto tra catalogo e progetto, senza modificarlo")
+        self.validateCheck = QCheckBox("Verifica dati")
+        self.validateCheck.setToolTip("Dopo l'importazione verifica l'integrità referenziale dei dati")
+        button_layout.addWidget(self.policyCombo)
+        button_layout.addWidget(self.dryRunCheck)
+        self.mappingCacheCheck = QCheckBox("Cache layer")
+        self.mappingCacheCheck.setChecked(True)
+        self.mappingCacheCheck.setToolTip("Riusa le corrispondenze dei layer trovate nelle importazioni precedenti in questo progetto")
+        button_layout.addWidget(self.validateCheck)
+        button_layout.addWidget(self.mappingCacheCheck)
 
         # Spacer per allineare i pulsanti a sinistra
         spacer = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
@@ -55,26 +109,110 @@ class RelationDialog(QDialog):
 
         layout.addLayout(button_layout)
 
+        # Avanzamento delle operazioni in background
+        progress_layout = QHBoxLayout()
+        self.progressBar = QProgressBar()
+        self.progressBar.setRange(0, 100)
+        self.cancelButton = QPushButton("Annulla")
+        progress_layout.addWidget(self.progressBar)
+        progress_layout.addWidget(self.cancelButton)
+        layout.addLayout(progress_layout)
+        self.progressBar.hide()
+        self.cancelButton.hide()
+
         # Label informativo per quando non ci sono relazioni
         self.info_label = QLabel()
         self.info_label.setAlignment(Qt.AlignCenter)
         self.info_label.setStyleSheet("color: gray; font-style: italic; margin: 20px;")
         layout.addWidget(self.info_label)
 
-        # Tabella relazioni
-        self.relationsTable = QTableWidget()
+        # Filtro testuale e per layer sulla tabella
+        filter_layout = QHBoxLayout()
+        self.filterEdit = QLineEdit()
+        self.filterEdit.setPlaceholderText("Filtra relazioni...")
+        self.filterEdit.setClearButtonEnabled(True)
+        self.layerFilterCombo = QComboBox()
+        self.layerFilterCombo.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+        self.layerFilterCombo.setToolTip("Mostra solo le relazioni del layer scelto")
+        self.subtreeCheck = QCheckBox("Includi discendenti")
+        self.subtreeCheck.setToolTip("Mostra tutte le relazioni dell'albero dei figli del layer")
+        filter_layout.addWidget(self.filterEdit)
+        filter_layout.addWidget(self.layerFilterCombo)
+        self.statsCheck = QCheckBox("Statistiche")
+        self.statsCheck.setToolTip("Mostra per ogni relazione padri, figli, figli per padre e orfani, calcolati in background")
+        filter_layout.addWidget(self.subtreeCheck)
+        filter_layout.addWidget(self.statsCheck)
+        layout.addLayout(filter_layout)
+
+        # Grafo delle relazioni per layer; collegato ai segnali prima del
+        # modello, così è già aggiornato quando la tabella cambia
+        self.relationGraph = RelationGraph()
+        self.relationGraph.watch(QgsProject.instance().relationManager())
+        self._graph_version = None
+
+        # Tabella relazioni: modello aggiornato dai segnali del progetto
+        self.relationsModel = RelationTableModel(QgsProject.instance(), self)
+        self.proxyModel = RelationFilterProxyModel(self)
+        self.proxyModel.setSourceModel(self.relationsModel)
+        self.relationsModel.rowsInserted.connect(self.update_info)
+        self.relationsModel.rowsRemoved.connect(self.update_info)
+        self.relationsModel.dataChanged.connect(self.update_layer_filter)
+
+        self.relationsTable = QTableView()
+        self.relationsTable.setModel(self.proxyModel)
         self.relationsTable.setAlternatingRowColors(True)
-        self.relationsTable.setSelectionBehavior(QTableWidget.SelectRows)
+        self.relationsTable.setSelectionBehavior(QTableView.SelectRows)
         self.relationsTable.setSortingEnabled(True)
+        self.relationsTable.sortByColumn(0, Qt.AscendingOrder)
+
+        # Altezza fissa delle righe e colonne ridimensionabili a mano:
+        # nessun calcolo sul contenuto di tutte le righe
+        vertical_header = self.relationsTable.verticalHeader()
+        vertical_header.setSectionResizeMode(QHeaderView.Fixed)
+        vertical_header.setDefaultSectionSize(self.fontMetrics().height() + 6)
+        header = self.relationsTable.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setDefaultSectionSize(200)
+        header.setStretchLastSection(True)
         layout.addWidget(self.relationsTable)
 
+        # Statistiche di cardinalità: colonne nascoste finché non richieste,
+        # valori conservati finché i layer non cambiano
+        self.cardinalityCache = CardinalityCache()
+        self.cardinalityCache.watch(QgsProject.instance())
+        self.cardinalityCache.on_invalidated = self.stats_invalidated
+        for column in range(RelationTableModel.FIRST_STATS_COLUMN, len(RelationTableModel.COLUMNS)):
+            header.resizeSection(column, 90)
+            self.relationsTable.setColumnHidden(column, True)
+
         # Area di debug/log
         debug_group = QGroupBox("Log Importazione")
         debug_layout = QVBoxLayout()
-        self.debugText = QTextEdit()
-        self.debugText.setMaximumHeight(150)
-        self.debugText.setReadOnly(True)
-        debug_layout.addWidget(self.debugText)
+        # Lista virtualizzata: vengono disegnate solo le righe visibili
+        self.logModel = LogListModel(self.logSink, parent=self)
+        self.logView = QListView()
+        self.logView.setModel(self.logModel)
+        self.logView.setMaximumHeight(150)
+        self.logView.setUniformItemSizes(True)
+        self.logView.setSelectionMode(QListView.ExtendedSelection)
+        debug_layout.addWidget(self.logView)
+
+        # Misure dell'importazione
+        report_layout = QHBoxLayout()
+        self.profileCheck = QCheckBox("Profilo cProfile")
+        self.profileCheck.setToolTip("Esegue l'importazione sotto cProfile e include il profilo nel report")
+        self.reportButton = QPushButton("Salva report...")
+        self.reportButton.setEnabled(False)
+        self.detailsCheck = QCheckBox("Mostra dettagli")
+        self.detailsCheck.setToolTip("Mostra anche i messaggi di dettaglio (sempre presenti nel log completo)")
+        self.logFileButton = QPushButton("Log completo...")
+        self.logFileButton.setEnabled(False)
+        report_layout.addWidget(self.detailsCheck)
+        report_layout.addWidget(self.profileCheck)
+        report_layout.addStretch()
+        report_layout.addWidget(self.logFileButton)
+        report_layout.addWidget(self.reportButton)
+        debug_layout.addLayout(report_layout)
         debug_group.setLayout(debug_layout)
         layout.addWidget(debug_group)
 
@@ -87,21 +225,131 @@ class RelationDialog(QDialog):
 
     def log_message(self, message):
         """Aggiunge un messaggio al log di debug"""
-        self.debugText.append(message)
+        self.logSink.write(message)
+
+    def profile_filename(self, name):
+        """File del plugin nella cartella del profilo utente"""
+        folder = os.path.join(QgsApplication.qgisSettingsDirPath(), 'relation_manager')
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
+
+    def log_filename(self):
+        """File del log completo dell'ultima importazione, nel profilo utente"""
+        return self.profile_filename('import.log')
+
+    def scroll_log(self):
+        """Segue la fine del log se la vista era già in fondo"""
+        scroll_bar = self.logView.verticalScrollBar()
+        if scroll_bar.value() >= scroll_bar.maximum() - 1:
+            self.logView.scrollToBottom()
+
+    def show_log_details(self, checked):
+        self.logModel.set_min_level(DEBUG if checked else INFO)
+
+    def open_log_file(self):
+        """Apre il log completo con l'applicazione predefinita"""
+        if self.logSink.filename is None:
+            return
+        self.logSink.flush()
+        QDesktopServices.openUrl(QUrl.fromLocalFile(self.logSink.filename))
 
     def refresh_relations(self):
         """Aggiorna la tabella con le relazioni attuali"""
+        # Il modello segue già i segnali del progetto: qui allinea solo
+        # eventuali differenze rimaste
+        self.relationGraph.sync(QgsProject.instance().relationManager().relations())
+        self.relationsModel.sync()
+        self.update_info()
+
+    def update_layer_filter(self):
+        """Aggiorna l'elenco dei layer del filtro se le relazioni sono cambiate"""
+        if self._graph_version == self.relationGraph.version:
+            return
+        self._graph_version = self.relationGraph.version
+
         project = QgsProject.instance()
-        relation_manager = project.relationManager()
-        relations = relation_manager.relations()
+        current = self.layerFilterCombo.currentData()
+        layers = []
+        for layer_id in self.relationGraph.layers():
+            layer = project.mapLayer(layer_id)
+            layers.append((layer.name() if layer else layer_id, layer_id))
+
+        self.layerFilterCombo.blockSignals(True)
+        self.layerFilterCombo.clear()
+        self.layerFilterCombo.addItem("Tutti i layer", None)
+        for name, layer_id in sorted(layers, key=lambda item: item[0].lower()):
+            self.layerFilterCombo.addItem(name, layer_id)
+        index = self.layerFilterCombo.findData(current)
+        self.layerFilterCombo.setCurrentIndex(max(index, 0))
+        self.layerFilterCombo.blockSignals(False)
+        self.apply_layer_filter()
+
+    def apply_layer_filter(self):
+        """Filtra la tabella sulle relazioni del layer scelto, usando il grafo"""
+        layer_id = self.layerFilterCombo.currentData()
+        if layer_id is None:
+            self.proxyModel.set_relation_ids(None)
+        elif self.subtreeCheck.isChecked():
+            self.proxyModel.set_relation_ids(self.relationGraph.subtree_relations(layer_id))
+        else:
+            self.proxyModel.set_relation_ids(self.relationGraph.relations_of(layer_id))
 
-        if not relations:
+    def show_stats(self, checked):
+        """Mostra o nasconde le colonne delle statistiche"""
+        for column in range(RelationTableModel.FIRST_STATS_COLUMN, len(RelationTableModel.COLUMNS)):
+            self.relationsTable.setColumnHidden(column, not checked)
+        self.update_stats()
+
+    def update_stats(self):
+        """Mostra le statistiche salvate e calcola in background quelle mancanti"""
+        if not self.statsCheck.isChecked():
+            return
+        if self.task is not None:
+            # Ricalcolo al termine del task in corso
+            self._stats_pending = True
+            return
+
+        # Le sorgenti dei layer vanno create nel thread principale
+        jobs = integrity_jobs(QgsProject.instance())
+        self.relationsModel.set_stats(self.cardinalityCache.stats())
+        missing = self.cardinalityCache.missing(jobs)
+        if not missing:
+            return
+
+        task = CardinalityTask(missing)
+        task.messageLogged.connect(self.logSink.write, Qt.DirectConnection)
+        task.taskCompleted.connect(lambda: self.stats_completed(task))
+        task.taskTerminated.connect(lambda: self.stats_terminated(task))
+        self.start_task(task)
+
+    def stats_completed(self, task):
+        """Chiamata nel thread principale: salva e mostra le statistiche calcolate"""
+        for job, stats in zip(task.jobs, task.results):
+            # Gli errori non vengono salvati: la relazione verrà ricalcolata
+            if stats.error is None:
+                self.cardinalityCache.store(job, stats)
+        self.relationsModel.update_stats(task.results)
+        self.finish_task()
+
+    def stats_terminated(self, task):
+        """Chiamata nel thread principale se il calcolo fallisce o viene annullato"""
+        self.finish_task()
+        if task.exception is not None:
+            self.log_message(f"\nERRORE: calcolo delle statistiche non riuscito: {str(task.exception)}")
+        else:
+            self.log_message("\n=== STATISTICHE ANNULLATE ===")
+
+    def stats_invalidated(self, relation_ids):
+        """Statistiche scartate perché i layer sono cambiati: ricalcolo se visibili"""
+        self.relationsModel.clear_stats(relation_ids)
+        if self.isVisible():
+            self.update_stats()
+
+    def update_info(self):
+        """Mostra il messaggio informativo se non ci sono relazioni"""
+        self.update_layer_filter()
+        if self.relationsModel.rowCount() == 0:
             # Nessuna relazione trovata
-            self.relationsTable.setRowCount(0)
-            self.relationsTable.setColumnCount(4)
-            self.relationsTable.setHorizontalHeaderLabels([
-                'ID', 'Nome', 'Layer Figlio', 'Layer Padre'
-            ])
             self.info_label.setText(
                 "Nessuna relazione trovata nel progetto corrente.\nUtilizza 'Importa Relazioni' per caricare relazioni da un file JSON.")
             self.info_label.show()
@@ -109,31 +357,7 @@ class RelationDialog(QDialog):
         else:
             # Ci sono relazioni da mostrare
             self.info_label.hide()
-            self.exportButton.setEnabled(True)
-
-            self.relationsTable.setRowCount(len(relations))
-            self.relationsTable.setColumnCount(4)
-            self.relationsTable.setHorizontalHeaderLabels([
-                'ID', 'Nome', 'Layer Figlio', 'Layer Padre'
-            ])
-
-            for row, (rel_id, relation) in enumerate(relations.items()):
-                self.relationsTable.setItem(row, 0, QTableWidgetItem(rel_id))
-                self.relationsTable.setItem(row, 1, QTableWidgetItem(relation.name()))
-
-                # Layer padre (referencing layer)
-                parent_layer = relation.referencingLayer()
-                parent_name = parent_layer.name() if parent_layer else "N/A"
-                self.relationsTable.setItem(row, 2, QTableWidgetItem(parent_name))
-
-                # Layer figlio (referenced layer)
-                child_layer = relation.referencedLayer()
-                child_name = child_layer.name() if child_layer else "N/A"
-                self.relationsTable.setItem(row, 3, QTableWidgetItem(child_name))
-
-        # Ridimensiona le colonne
-        header = self.relationsTable.horizontalHeader()
-        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+            self.exportButton.setEnabled(self.task is None)
 
     def export_relations(self):
         """Esporta le relazioni in un file JSON"""
@@ -146,257 +370,286 @@ class RelationDialog(QDialog):
                                     "Nessuna relazione trovata nel progetto corrente.")
             return
 
-        # Seleziona il file di destinazione
-        filename, _ = QFileDialog.getSaveFileName(
-            self, "Esporta Relazioni", "", "JSON Files (*.json)")
+        # Seleziona il file di destinazione (JSON, NDJSON o NDJSON compresso)
+        filename, selected_filter = QFileDialog.getSaveFileName(
+            self, "Esporta Relazioni", "", EXPORT_FILTERS)
 
         if not filename:
             return
+        filename = export_filename(filename, selected_filter)
+
+        # La lettura delle relazioni resta nel thread principale,
+        # la codifica e la scrittura del file avvengono in background
+        specs = relation_specs(relations)
+        task = ExportRelationsTask(filename, specs, project.fileName(),
+                                   export_version(selected_filter))
+        task.taskCompleted.connect(lambda: self.export_completed(task))
+        task.taskTerminated.connect(lambda: self.export_terminated(task))
+        self.start_task(task)
+
+    def export_completed(self, task):
+        """Chiamata nel thread principale al termine dell'esportazione"""
+        self.finish_task()
+        QMessageBox.information(self, "Successo",
+                                f"Relazioni esportate con successo in {task.filename}")
+
+    def export_terminated(self, task):
+        """Chiamata nel thread principale se l'esportazione fallisce o viene annullata"""
+        self.finish_task()
+        if task.exception is not None:
+            QMessageBox.critical(self, "Errore",
+                                 f"Errore durante l'esportazione: {str(task.exception)}")
 
-        try:
-            relations_data = self.serialize_relations(relations)
-
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(relations_data, f, indent=2, ensure_ascii=False)
+    def import_relations(self):
+        """Importa le relazioni da uno o più file di catalogo"""
+        # Seleziona i file da importare
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self, "Importa Relazioni", "", IMPORT_FILTERS)
+
+        if filenames:
+            self.start_import(filenames)
+
+    def import_folder(self):
+        """Importa insieme i cataloghi di una cartella"""
+        folder = QFileDialog.getExistingDirectory(self, "Importa Cartella")
+        if not folder:
+            return
 
-            QMessageBox.information(self, "Successo",
-                                    f"Relazioni esportate con successo in {filename}")
+        filenames = catalog_files([folder])
+        if not filenames:
+            QMessageBox.information(self, "Informazione",
+                                    "Nessun file di catalogo trovato nella cartella.")
+            return
+        self.start_import(filenames)
 
-        except Exception as e:
-            QMessageBox.critical(self, "Errore",
-                                 f"Errore durante l'esportazione: {str(e)}")
+    def start_import(self, filenames):
+        """Avvia l'importazione dei cataloghi indicati, uniti in un solo insieme"""
+        # Pulisce il log e ne inizia la copia completa su file
+        self.logSink.clear()
+        try:
+            self.logSink.open(self.log_filename())
+            self.logFileButton.setEnabled(True)
+        except OSError as e:
+            self.log_message(f"⚠️ Impossibile scrivere il log completo: {str(e)}")
 
-    def import_relations(self):
-        """Importa le relazioni da un file JSON"""
-        # Pulisce il log
-        self.debugText.clear()
+        # Lettura dei file e risoluzione di layer e campi in background
+        project = QgsProject.instance()
+        mapping_cache = None
+        if self.mappingCacheCheck.isChecked():
+            mapping_cache = MappingCache(self.profile_filename('layer_mapping.json'))
+        task = ImportRelationsTask(filenames, ProjectSnapshot.from_project(project),
+                                   self.policyCombo.currentData(), self.dryRunCheck.isChecked(),
+                                   self.profileCheck.isChecked(), mapping_cache,
+                                   project.absoluteFilePath())
+        # I messaggi vanno direttamente nel buffer dal thread del task,
+        # senza un evento Qt per ogni riga
+        task.messageLogged.connect(self.logSink.write, Qt.DirectConnection)
+        task.taskCompleted.connect(lambda: self.import_completed(task))
+        task.taskTerminated.connect(lambda: self.import_terminated(task))
+        self.start_task(task)
+
+    def import_completed(self, task):
+        """Chiamata nel thread principale: crea le relazioni validate dal task"""
+        self.finish_task()
+        if task.dry_run:
+            self.show_import_stats(task.stats)
+            QMessageBox.information(self, "Simulazione",
+                                    f"Confronto tra catalogo e progetto:\n\n{task.diff.summary()}")
+            self.log_message("\n=== SIMULAZIONE COMPLETATA: nessuna modifica applicata ===")
+            return
 
-        # Seleziona il file da importare
-        filename, _ = QFileDialog.getOpenFileName(
-            self, "Importa Relazioni", "", "JSON Files (*.json)")
+        try:
+            result = self.apply_relations(task.planned, task.diff.replace_ids,
+                                          task.diff.remove_ids, task.stats)
+        except Exception as e:
+            self.show_import_stats(task.stats)
+            self.import_failed(e)
+            return
+        self.show_import_stats(task.stats)
+
+        if result.added or result.removed:
+            self.refresh_relations()
+            summary = f"{result.added} relazioni importate"
+            if result.removed:
+                summary += f", {result.removed} rimosse"
+            QMessageBox.information(self, "Successo", f"{summary} con successo.")
+            self.log_message(f"\n=== IMPORTAZIONE COMPLETATA: {summary} ===")
+            if result.added and self.validateCheck.isChecked():
+                self.validate_relations({planned.id for planned in task.planned})
+            # Dopo la verifica, se avviata, le statistiche delle nuove relazioni
+            self.update_stats()
+        else:
+            QMessageBox.warning(self, "Attenzione",
+                                "Nessuna relazione è stata importata. Controlla il log per i dettagli.")
+            self.log_message("\n=== NESSUNA RELAZIONE IMPORTATA ===")
+
+    def import_terminated(self, task):
+        """Chiamata nel thread principale se l'importazione fallisce o viene annullata"""
+        self.finish_task()
+        self.show_import_stats(task.stats)
+        if task.exception is not None:
+            self.import_failed(task.exception)
+        else:
+            self.log_message("\n=== IMPORTAZIONE ANNULLATA ===")
+
+    def show_import_stats(self, stats):
+        """Chiude le misure dell'importazione e ne mostra il riepilogo nel log"""
+        stats.finish()
+        self.import_stats = stats
+        self.reportButton.setEnabled(True)
+        self.log_message("\n--- Prestazioni ---")
+        self.log_message(stats.summary())
+
+    def save_import_report(self):
+        """Salva il report JSON dell'ultima importazione"""
+        if self.import_stats is None:
+            return
 
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "Salva report importazione", "", "JSON Files (*.json)")
         if not filename:
             return
 
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                relations_data = json.load(f)
-
-            self.log_message("=== INIZIO IMPORTAZIONE ===")
-            self.log_message(f"File: {filename}")
-
-            # Mostra i layer disponibili nel progetto
-            self.log_message("\n--- Layer disponibili nel progetto ---")
-            project = QgsProject.instance()
-            for layer_id, layer in project.mapLayers().items():
-                self.log_message(f"ID: {layer_id}, Nome: {layer.name()}")
-
-            imported_count = self.deserialize_relations(relations_data)
-
-            if imported_count > 0:
-                self.refresh_relations()
-                QMessageBox.information(self, "Successo",
-                                        f"{imported_count} relazioni importate con successo.")
-                self.log_message(f"\n=== IMPORTAZIONE COMPLETATA: {imported_count} relazioni ===")
-            else:
-                QMessageBox.warning(self, "Attenzione",
-                                    "Nessuna relazione è stata importata. Controlla il log per i dettagli.")
-                self.log_message("\n=== NESSUNA RELAZIONE IMPORTATA ===")
-
+            self.import_stats.save(filename)
         except Exception as e:
-            error_msg = f"Errore durante l'importazione: {str(e)}"
-            QMessageBox.critical(self, "Errore", error_msg)
-            self.log_message(f"\nERRORE: {error_msg}")
+            QMessageBox.critical(self, "Errore",
+                                 f"Errore durante il salvataggio del report: {str(e)}")
+
+    def selected_relation_ids(self):
+        """ID delle relazioni selezionate nella tabella"""
+        rows = {self.proxyModel.mapToSource(index).row()
+                for index in self.relationsTable.selectionModel().selectedRows()}
+        return {self.relationsModel.relation_id(row) for row in rows}
+
+    def validate_relations(self, relation_ids=None):
+        """Verifica in background l'integrità referenziale delle relazioni"""
+        if relation_ids is None:
+            relation_ids = self.selected_relation_ids() or None
+
+        # Le sorgenti dei layer vanno create nel thread principale
+        jobs = integrity_jobs(QgsProject.instance(), relation_ids)
+        if not jobs:
+            QMessageBox.information(self, "Informazione", "Nessuna relazione valida da verificare.")
+            return
+
+        task = ValidateRelationsTask(jobs)
+        task.messageLogged.connect(self.logSink.write, Qt.DirectConnection)
+        task.taskCompleted.connect(lambda: self.validation_completed(task))
+        task.taskTerminated.connect(lambda: self.validation_terminated(task))
+        self.start_task(task)
+
+    def validation_completed(self, task):
+        """Chiamata nel thread principale al termine della verifica"""
+        self.finish_task()
+        failed = [result for result in task.results if result.error is not None]
+        with_orphans = [result for result in task.results if result.orphans]
+        orphans = sum(result.orphans for result in with_orphans)
+        if not failed and not with_orphans:
+            QMessageBox.information(self, "Verifica integrità",
+                                    f"Nessun record orfano in {len(task.results)} relazioni.")
+            return
+        QMessageBox.warning(self, "Verifica integrità",
+                            f"{orphans} record orfani in {len(with_orphans)} relazioni, "
+                            f"{len(failed)} verifiche non riuscite.\n"
+                            f"Controlla il log per i dettagli.")
+
+    def validation_terminated(self, task):
+        """Chiamata nel thread principale se la verifica fallisce o viene annullata"""
+        self.finish_task()
+        if task.exception is not None:
+            QMessageBox.critical(self, "Errore",
+                                 f"Errore durante la verifica: {str(task.exception)}")
+        else:
+            self.log_message("\n=== VERIFICA ANNULLATA ===")
+
+    def import_failed(self, exception):
+        error_msg = f"Errore durante l'importazione: {str(exception)}"
+        QMessageBox.critical(self, "Errore", error_msg)
+        self.log_message(f"\nERRORE: {error_msg}")
+
+    def start_task(self, task):
+        """Avvia un task in background mostrando avanzamento e pulsante Annulla"""
+        self.task = task
+        task.progressChanged.connect(lambda progress: self.progressBar.setValue(int(progress)))
+
+        self.exportButton.setEnabled(False)
+        self.importButton.setEnabled(False)
+        self.importFolderButton.setEnabled(False)
+        self.validateButton.setEnabled(False)
+        self.progressBar.setValue(0)
+        self.progressBar.show()
+        self.cancelButton.show()
+
+        QgsApplication.taskManager().addTask(task)
+
+    def finish_task(self):
+        """Ripristina l'interfaccia al termine di un task"""
+        self.task = None
+        self.logModel.flush()
+        self.progressBar.hide()
+        self.cancelButton.hide()
+        self.importButton.setEnabled(True)
+        self.importFolderButton.setEnabled(True)
+        self.validateButton.setEnabled(True)
+        self.exportButton.setEnabled(
+            bool(QgsProject.instance().relationManager().relations()))
+        if self._stats_pending:
+            self._stats_pending = False
+            QTimer.singleShot(0, self.update_stats)
+
+    def showEvent(self, event):
+        # Riprende gli aggiornamenti della tabella: solo le relazioni
+        # cambiate mentre il dialog era nascosto vengono riallineate
+        self.relationsModel.set_suspended(False)
+        self.update_info()
+        self.update_stats()
+        super(RelationDialog, self).showEvent(event)
+
+    def hideEvent(self, event):
+        self.relationsModel.set_suspended(True)
+        super(RelationDialog, self).hideEvent(event)
+
+    def shutdown(self):
+        """Annulla il task in corso, scollega i segnali del progetto e chiude il log
+
+        Da chiamare prima di eliminare il dialog.
+        """
+        self.cancel_task()
+        self.relationsModel.unwatch()
+        self.relationGraph.unwatch()
+        self.cardinalityCache.unwatch()
+        self.cardinalityCache.on_invalidated = None
+        self.logSink.close()
+        self.close()
+
+    def cancel_task(self):
+        """Annulla il task in corso"""
+        if self.task is not None:
+            self.task.cancel()
 
     def serialize_relations(self, relations):
         """Serializza le relazioni in un formato JSON"""
-        relations_data = {
-            "version": "1.0",
-            "export_date": QgsProject.instance().fileName(),
-            "relations": []
-        }
-
-        for rel_id, relation in relations.items():
-            try:
-                relation_data = {
-                    "id": rel_id,
-                    "name": relation.name(),
-                    "strength": str(relation.strength()),
-                    "parent_layer": {
-                        "id": relation.referencingLayer().id() if relation.referencingLayer() else None,
-                        "name": relation.referencingLayer().name() if relation.referencingLayer() else None,
-                        "source": relation.referencingLayer().source() if relation.referencingLayer() else None
-                    },
-                    "child_layer": {
-                        "id": relation.referencedLayer().id() if relation.referencedLayer() else None,
-                        "name": relation.referencedLayer().name() if relation.referencedLayer() else None,
-                        "source": relation.referencedLayer().source() if relation.referencedLayer() else None
-                    },
-                    "field_pairs": []
-                }
-
-                # Metodo corretto per ottenere le coppie di campi
-                referencing_fields = relation.referencingFields()
-                referenced_fields = relation.referencedFields()
-
-                # Crea le coppie di campi con i nomi dei campi
-                for i in range(len(referencing_fields)):
-                    if i < len(referenced_fields):
-                        field_pair = {
-                            "referencing_field": referencing_fields[i],
-                            "referenced_field": referenced_fields[i]
-                        }
-                        relation_data["field_pairs"].append(field_pair)
-
-                relations_data["relations"].append(relation_data)
-
-            except Exception as e:
-                print(f"Errore nella serializzazione della relazione {rel_id}: {str(e)}")
-                continue
-
-        return relations_data
-
-    def deserialize_relations(self, relations_data):
+        return encode_catalog(relation_specs(relations), QgsProject.instance().fileName())
+
+    def deserialize_relations(self, relations_data, policy='skip'):
         """Deserializza le relazioni da un formato JSON"""
-        if "relations" not in relations_data:
-            raise ValueError("Formato file non valido: manca la sezione 'relations'")
+        return import_catalog(QgsProject.instance(), relations_data, self.log_message, policy)
 
-        project = QgsProject.instance()
-        relation_manager = project.relationManager()
-        imported_count = 0
-
-        self.log_message(f"\nTentativo di importare {len(relations_data['relations'])} relazioni...")
-
-        for i, relation_data in enumerate(relations_data["relations"]):
-            try:
-                self.log_message(f"\n--- Relazione {i + 1}: {relation_data['name']} ---")
-
-                # Trova i layer nel progetto corrente
-                parent_layer = self.find_layer_by_name_or_source(
-                    relation_data["parent_layer"]["name"],
-                    relation_data["parent_layer"]["source"]
-                )
-                child_layer = self.find_layer_by_name_or_source(
-                    relation_data["child_layer"]["name"],
-                    relation_data["child_layer"]["source"]
-                )
-
-                if not parent_layer:
-                    self.log_message(f"❌ Parent layer non trovato: {relation_data['parent_layer']['name']}")
-                    continue
-
-                if not child_layer:
-                    self.log_message(f"❌ Child layer non trovato: {relation_data['child_layer']['name']}")
-                    continue
-
-                self.log_message(f"✅ Parent layer trovato: {parent_layer.name()} (ID: {parent_layer.id()})")
-                self.log_message(f"✅ Child layer trovato: {child_layer.name()} (ID: {child_layer.id()})")
-
-                # Controlla se la relazione esiste già
-                existing_relation = relation_manager.relation(relation_data["id"])
-                if existing_relation.isValid():
-                    self.log_message(f"⚠️ Relazione già esistente, saltata")
-                    continue
-
-                # Crea la nuova relazione
-                relation = QgsRelation()
-                relation.setId(relation_data["id"])
-                relation.setName(relation_data["name"])
-                relation.setReferencingLayer(parent_layer.id())
-                relation.setReferencedLayer(child_layer.id())
-
-                # Aggiungi le coppie di campi
-                field_pairs_added = 0
-                for field_pair in relation_data["field_pairs"]:
-                    ref_field = str(field_pair["referencing_field"])
-                    refd_field = str(field_pair["referenced_field"])
-
-                    # Verifica che i campi esistano nei layer
-                    parent_fields = [field.name() for field in parent_layer.fields()]
-                    child_fields = [field.name() for field in child_layer.fields()]
-
-                    # Se il campo è un numero, prova a convertirlo in nome campo
-                    if ref_field.isdigit():
-                        field_index = int(ref_field)
-                        if field_index < len(parent_fields):
-                            ref_field = parent_fields[field_index]
-                        else:
-                            self.log_message(f"⚠️ Indice campo parent non valido: {field_index}")
-                            continue
-
-                    if refd_field.isdigit():
-                        field_index = int(refd_field)
-                        if field_index < len(child_fields):
-                            refd_field = child_fields[field_index]
-                        else:
-                            self.log_message(f"⚠️ Indice campo child non valido: {field_index}")
-                            continue
-
-                    # Verifica che i campi esistano
-                    if ref_field not in parent_fields:
-                        self.log_message(f"⚠️ Campo '{ref_field}' non trovato nel parent layer")
-                        continue
-
-                    if refd_field not in child_fields:
-                        self.log_message(f"⚠️ Campo '{refd_field}' non trovato nel child layer")
-                        continue
-
-                    relation.addFieldPair(ref_field, refd_field)
-                    field_pairs_added += 1
-                    self.log_message(f"✅ Campo aggiunto: {ref_field} -> {refd_field}")
-
-                if field_pairs_added == 0:
-                    self.log_message(f"❌ Nessuna coppia di campi valida trovata")
-                    continue
-
-                # Controlla se la relazione è valida
-                if relation.isValid():
-                    relation_manager.addRelation(relation)
-                    imported_count += 1
-                    self.log_message(f"✅ Relazione importata con successo!")
-                else:
-                    self.log_message(f"❌ Relazione non valida dopo la creazione")
-
-            except Exception as e:
-                error_msg = f"Errore nell'importazione della relazione '{relation_data.get('name', 'sconosciuta')}': {str(e)}"
-                self.log_message(f"❌ {error_msg}")
-
-        return imported_count
-
-    def find_layer_by_name_or_source(self, name, source):
+    def apply_relations(self, planned, replace_ids=(), remove_ids=(), stats=None):
+        """Crea nel progetto le relazioni validate dal task di importazione"""
+        return apply_relations(QgsProject.instance(), planned, self.log_message,
+                               replace_ids, remove_ids, stats)
+
+    def find_layer_by_name_or_source(self, name, source, resolver=None):
         """Trova un layer per nome o sorgente con ricerca fuzzy"""
         project = QgsProject.instance()
 
-        # Prima prova per nome esatto
-        if name:
-            layers = project.mapLayersByName(name)
-            if layers:
-                return layers[0]
-
-            # Prova con nome simile (rimuovi caratteri speciali)
-            name_clean = name.replace("-", "_").replace(" ", "_")
-            for layer in project.mapLayers().values():
-                layer_name_clean = layer.name().replace("-", "_").replace(" ", "_")
-                if layer_name_clean.lower() == name_clean.lower():
-                    return layer
-
-            # Prova ricerca parziale
-            for layer in project.mapLayers().values():
-                if name.lower() in layer.name().lower() or layer.name().lower() in name.lower():
-                    return layer
-
-        # Poi prova per sorgente (solo se accessibile)
-        if source:
-            for layer in project.mapLayers().values():
-                if hasattr(layer, 'source'):
-                    try:
-                        # Confronta solo la parte del nome della tabella
-                        if 'table=' in source and 'table=' in layer.source():
-                            source_table = source.split('table=')[1].split()[0].strip('"')
-                            layer_table = layer.source().split('table=')[1].split()[0].strip('"')
-                            if source_table == layer_table:
-                                return layer
-                    except:
-                        continue
-
-        return None
+        # Senza un indice già pronto ne costruisce uno per questa ricerca
+        if resolver is None:
+            resolver = LayerResolver.from_project(project)
+
+        layer_id = resolver.find(name, source)
+        if layer_id is None:
+            return None
+        return project.mapLayer(layer_id)
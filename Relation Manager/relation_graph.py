@@ -0,0 +1,240 @@
+# relation_graph.py
+# Indice delle relazioni come grafo tra layer: ogni relazione è un arco dal
+# layer padre (referenced) al layer figlio (referencing). Non usa Qt e può
+# essere costruito sia dal relation manager sia dalle relazioni da importare.
+from collections import defaultdict, deque
+
+
+class RelationGraph:
+    """Liste di adiacenza delle relazioni per layer
+
+    Le ricerche per layer costano quanto il numero di relazioni del layer;
+    i discendenti di un layer vengono calcolati una volta e riusati finché
+    il grafo non cambia.
+    """
+
+    def __init__(self, edges=()):
+        """edges: iterabile di (relation_id, child_layer_id, parent_layer_id)"""
+        self._edges = {}
+        self._child_relations = defaultdict(set)
+        self._parent_relations = defaultdict(set)
+        self._closure = {}
+        self._watched = None
+        self.version = 0
+        for relation_id, child, parent in edges:
+            self.add(relation_id, child, parent)
+
+    @classmethod
+    def from_relations(cls, relations):
+        """Grafo dal dizionario ID -> QgsRelation del relation manager"""
+        return cls(relation_edges(relations))
+
+    def watch(self, relation_manager):
+        """Mantiene il grafo allineato alle relazioni del relation manager (vedi unwatch)"""
+        self.unwatch()
+
+        def sync():
+            self.sync(relation_manager.relations())
+        relation_manager.changed.connect(sync)
+        relation_manager.relationsLoaded.connect(sync)
+        self._watched = (relation_manager, sync)
+        self.sync(relation_manager.relations())
+
+    def unwatch(self):
+        """Scollega il grafo dai segnali del relation manager"""
+        if self._watched is None:
+            return
+        relation_manager, sync = self._watched
+        self._watched = None
+        relation_manager.changed.disconnect(sync)
+        relation_manager.relationsLoaded.disconnect(sync)
+
+    def add(self, relation_id, child, parent):
+        if relation_id in self._edges:
+            self.remove(relation_id)
+        self._edges[relation_id] = (child, parent)
+        self._child_relations[parent].add(relation_id)
+        self._parent_relations[child].add(relation_id)
+        self._changed()
+
+    def remove(self, relation_id):
+        child, parent = self._edges.pop(relation_id)
+        self._discard(self._child_relations, parent, relation_id)
+        self._discard(self._parent_relations, child, relation_id)
+        self._changed()
+
+    @staticmethod
+    def _discard(index, layer_id, relation_id):
+        relation_ids = index[layer_id]
+        relation_ids.discard(relation_id)
+        if not relation_ids:
+            del index[layer_id]
+
+    def _changed(self):
+        self._closure.clear()
+        self.version += 1
+
+    def sync(self, relations):
+        """Aggiorna solo gli archi delle relazioni aggiunte, rimosse o modificate"""
+        edges = {relation_id: (child, parent)
+                 for relation_id, child, parent in relation_edges(relations)}
+        for relation_id in [relation_id for relation_id in self._edges if relation_id not in edges]:
+            self.remove(relation_id)
+        for relation_id, edge in edges.items():
+            if self._edges.get(relation_id) != edge:
+                self.add(relation_id, *edge)
+
+    def __len__(self):
+        return len(self._edges)
+
+    def __contains__(self, relation_id):
+        return relation_id in self._edges
+
+    def edge(self, relation_id):
+        """(layer figlio, layer padre) della relazione"""
+        return self._edges[relation_id]
+
+    def layers(self):
+        """Layer coinvolti in almeno una relazione"""
+        return set(self._child_relations) | set(self._parent_relations)
+
+    def child_relations(self, layer_id):
+        """Relazioni in cui il layer è il padre"""
+        return set(self._child_relations.get(layer_id, ()))
+
+    def parent_relations(self, layer_id):
+        """Relazioni in cui il layer è il figlio"""
+        return set(self._parent_relations.get(layer_id, ()))
+
+    def relations_of(self, layer_id):
+        return self.child_relations(layer_id) | self.parent_relations(layer_id)
+
+    def children(self, layer_id):
+        return {self._edges[relation_id][0]
+                for relation_id in self._child_relations.get(layer_id, ())}
+
+    def parents(self, layer_id):
+        return {self._edges[relation_id][1]
+                for relation_id in self._parent_relations.get(layer_id, ())}
+
+    def descendants(self, layer_id):
+        """Tutti i layer raggiungibili dal layer scendendo verso i figli"""
+        if layer_id not in self._closure:
+            seen = set()
+            queue = deque(self.children(layer_id))
+            while queue:
+                current = queue.popleft()
+                if current in seen:
+                    continue
+                seen.add(current)
+                if current in self._closure:
+                    seen.update(self._closure[current])
+                else:
+                    queue.extend(self.children(current) - seen)
+            self._closure[layer_id] = frozenset(seen)
+        return self._closure[layer_id]
+
+    def subtree_relations(self, layer_id):
+        """Relazioni dell'albero dei figli sotto il layer"""
+        relation_ids = set()
+        for current in {layer_id} | self.descendants(layer_id):
+            relation_ids.update(self._child_relations.get(current, ()))
+        return relation_ids
+
+    def cycles(self):
+        """Gruppi di layer che si riferiscono a vicenda (componenti fortemente connesse)"""
+        return [component for component in self.components()
+                if len(component) > 1 or component[0] in self.children(component[0])]
+
+    def components(self):
+        """Componenti fortemente connesse, compresi i layer isolati (un elemento)"""
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        # Tarjan iterativo, per non dipendere dal limite di ricorsione
+        for root in self.layers():
+            if root in index:
+                continue
+            work = [(root, iter(self.children(root)))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.children(child))))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component[::-1])
+        return components
+
+    def topological_order(self):
+        """Layer ordinati con i padri prima dei figli (algoritmo di Kahn)
+
+        I layer di un ciclo non hanno un ordine valido tra loro: ogni ciclo
+        viene ordinato come un solo nodo, con i suoi layer uno dopo
+        l'altro, e i layer che ne dipendono vengono comunque dopo.
+        """
+        # Grafo delle componenti (condensazione), aciclico per costruzione
+        components = {min(component): sorted(component) for component in self.components()}
+        component_of = {layer_id: key for key, members in components.items()
+                        for layer_id in members}
+        children = {key: set() for key in components}
+        in_degree = dict.fromkeys(components, 0)
+        for key, members in components.items():
+            for layer_id in members:
+                for child in self.children(layer_id):
+                    child_key = component_of[child]
+                    if child_key != key and child_key not in children[key]:
+                        children[key].add(child_key)
+                        in_degree[child_key] += 1
+
+        queue = deque(sorted(key for key, degree in in_degree.items() if degree == 0))
+        order = []
+        while queue:
+            key = queue.popleft()
+            order.extend(components[key])
+            for child_key in sorted(children[key]):
+                in_degree[child_key] -= 1
+                if in_degree[child_key] == 0:
+                    queue.append(child_key)
+        return order
+
+
+def relation_edges(relations):
+    """(relation_id, layer figlio, layer padre) dal dizionario ID -> QgsRelation"""
+    for relation_id, relation in relations.items():
+        yield relation_id, relation.referencingLayerId(), relation.referencedLayerId()
+
+
+def dependency_order(planned):
+    """Relazioni pianificate ordinate in modo che i padri precedano i figli
+
+    Una relazione viene dopo quelle che collegano il suo layer padre ai
+    rispettivi padri. Restituisce le relazioni ordinate e i cicli trovati.
+    """
+    graph = RelationGraph((i, relation.referencing_layer_id, relation.referenced_layer_id)
+                          for i, relation in enumerate(planned))
+    rank = {layer_id: i for i, layer_id in enumerate(graph.topological_order())}
+    ordered = sorted(planned, key=lambda relation: rank[relation.referenced_layer_id])
+    return ordered, graph.cycles()
@@ -1,14 +1,16 @@
 # relation_manager.py
 import os
+import time
 from qgis.PyQt.QtCore import QTranslator, QCoreApplication, QSettings
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtWidgets import QAction
-from .relation_dialog import RelationDialog
+from qgis.PyQt.QtWidgets import QAction, QFileDialog
+from qgis.core import Qgis, QgsMessageLog, QgsProject
 
 
 class RelationManager:
-    def __init__(self, iface):
+    def __init__(self, iface, load_start=None):
         self.iface = iface
+        self.load_start = load_start if load_start is not None else time.perf_counter()
         self.plugin_dir = os.path.dirname(__file__)
 
         # Inizializza locale
@@ -25,11 +27,17 @@ class RelationManager:
 
         self.actions = []
         self.menu = self.tr('&Relation Manager')
-        self.dlg = None  # Inizializza come None
+        self.dlg = None  # Creato alla prima apertura e poi riutilizzato
+        self.catalog_sync = None  # Creato solo se la sincronizzazione è attiva
 
     def tr(self, message):
         return QCoreApplication.translate('RelationManager', message)
 
+    def log_timing(self, message, start):
+        """Scrive nel log dei messaggi di QGIS il tempo trascorso da start"""
+        elapsed = (time.perf_counter() - start) * 1000.0
+        QgsMessageLog.logMessage(f"{message}: {elapsed:.1f} ms", 'Relation Manager', Qgis.Info)
+
     def add_action(self, icon_path, text, callback, enabled_flag=True,
                    add_to_menu=True, add_to_toolbar=True, status_tip=None,
                    whats_this=None, parent=None):
@@ -68,19 +76,95 @@ class RelationManager:
             callback=self.run,
             parent=self.iface.mainWindow())
 
+        # Sincronizzazione automatica dai cataloghi condivisi (solo menu)
+        enabled = QSettings().value('relation_manager/sync/enabled', False, type=bool)
+        self.syncAction = self.add_action(
+            icon_path,
+            text=self.tr('Sincronizza relazioni dai cataloghi'),
+            callback=self.toggle_sync,
+            add_to_toolbar=False,
+            status_tip=self.tr('Importa automaticamente i cataloghi scelti all\'apertura dei progetti e quando cambiano'),
+            parent=self.iface.mainWindow())
+        self.syncAction.setCheckable(True)
+        self.syncAction.setChecked(enabled)
+        self.add_action(
+            icon_path,
+            text=self.tr('Cataloghi da sincronizzare...'),
+            callback=self.choose_sync_catalogs,
+            add_to_toolbar=False,
+            parent=self.iface.mainWindow())
+        if enabled:
+            self.start_sync()
+
+        self.log_timing("Caricamento del plugin", self.load_start)
+
     def unload(self):
         """Rimuove le voci di menu e i pulsanti della toolbar"""
         for action in self.actions:
             self.iface.removePluginMenu(self.tr('&Relation Manager'), action)
             self.iface.removeToolBarIcon(action)
 
+        self.stop_sync()
+        if self.dlg is not None:
+            self.dlg.shutdown()
+            self.dlg.deleteLater()
+            self.dlg = None
+
     def run(self):
         """Esegue il plugin"""
-        # Crea sempre una nuova istanza del dialog
-        self.dlg = RelationDialog()
-
-        # Mostra il dialog
+        start = time.perf_counter()
+        first_run = self.dlg is None
+        if first_run:
+            # Il dialog (e tutto ciò che usa) viene importato solo alla prima
+            # apertura, per non pesare sull'avvio di QGIS
+            from .relation_dialog import RelationDialog
+            self.dlg = RelationDialog(self.iface.mainWindow())
+
+        # Dialog non modale, riutilizzato: alla riapertura aggiorna solo
+        # le relazioni cambiate nel frattempo
         self.dlg.show()
-
-        # Esegue il dialog e aspetta la risposta
-        result = self.dlg.exec_()
\ No newline at end of file
+        self.dlg.raise_()
+        self.dlg.activateWindow()
+        self.log_timing("Prima apertura del dialog" if first_run else "Riapertura del dialog",
+                        start)
+
+    def start_sync(self):
+        """Attiva la sincronizzazione con i cataloghi salvati nelle impostazioni"""
+        # Importato solo se la sincronizzazione è attiva
+        from .catalog_sync import CatalogSync, sync_settings
+        _, catalogs, policy = sync_settings()
+        if self.catalog_sync is None:
+            self.catalog_sync = CatalogSync(QgsProject.instance(), catalogs, policy,
+                                            parent=self.iface.mainWindow())
+        self.catalog_sync.set_catalogs(catalogs)
+
+    def stop_sync(self):
+        if self.catalog_sync is not None:
+            self.catalog_sync.stop()
+            self.catalog_sync.deleteLater()
+            self.catalog_sync = None
+
+    def toggle_sync(self, checked):
+        """Attiva o disattiva la sincronizzazione dai cataloghi"""
+        from .catalog_sync import save_sync_settings, sync_settings
+        if checked and not sync_settings()[1] and not self.choose_sync_catalogs():
+            self.syncAction.setChecked(False)
+            return
+        save_sync_settings(enabled=checked)
+        if checked:
+            self.start_sync()
+        else:
+            self.stop_sync()
+
+    def choose_sync_catalogs(self):
+        """Sceglie i cataloghi da sincronizzare; False se la scelta è annullata"""
+        from .catalog_io import IMPORT_FILTERS
+        from .catalog_sync import save_sync_settings
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self.iface.mainWindow(), self.tr('Cataloghi da sincronizzare'), "", IMPORT_FILTERS)
+        if not filenames:
+            return False
+        save_sync_settings(catalogs=filenames)
+        if self.catalog_sync is not None:
+            self.catalog_sync.set_catalogs(filenames)
+        return True
@@ -0,0 +1,290 @@
+# relation_model.py
+from collections import defaultdict, namedtuple
+from functools import partial
+
+from qgis.PyQt.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+
+
+# Dati di una riga della tabella, letti una volta sola dalla relazione;
+# sort_keys: testo in minuscolo delle colonne, per l'ordinamento
+RelationRow = namedtuple(
+    'RelationRow',
+    ['id', 'name', 'referencing_layer_id', 'referenced_layer_id',
+     'referencing_name', 'referenced_name', 'filter_key', 'sort_keys'])
+
+# Ruolo con la chiave di ordinamento (testo in minuscolo, numero per le statistiche)
+SortRole = Qt.UserRole + 1
+
+# Colonne delle statistiche di cardinalità (campi di CardinalityStats)
+STATS_COLUMNS = [('Padri', 'parents'), ('Figli', 'children'), ('Max figli', 'max_children'),
+                 ('Media figli', 'avg_children'), ('Orfani', 'orphans')]
+
+
+def relation_row(rel_id, relation):
+    """Costruisce la riga della tabella per una relazione"""
+    referencing_layer = relation.referencingLayer()
+    referenced_layer = relation.referencedLayer()
+    referencing_name = referencing_layer.name() if referencing_layer else "N/A"
+    referenced_name = referenced_layer.name() if referenced_layer else "N/A"
+    values = (rel_id, relation.name(), referencing_name, referenced_name)
+    sort_keys = tuple(value.lower() for value in values)
+    return RelationRow(rel_id, relation.name(),
+                       relation.referencingLayerId(), relation.referencedLayerId(),
+                       referencing_name, referenced_name, "\n".join(sort_keys), sort_keys)
+
+
+class RelationTableModel(QAbstractTableModel):
+    """Modello delle relazioni del progetto, aggiornato in modo incrementale
+
+    Ascolta i segnali del relation manager e dei layer: a ogni modifica
+    confronta le relazioni con le righe correnti e inserisce, rimuove o
+    aggiorna solo le righe coinvolte. Mentre è sospeso (dialog nascosto)
+    le modifiche vengono solo annotate e allineate alla ripresa. Le
+    colonne delle statistiche restano vuote finché non vengono impostate
+    con set_stats.
+    """
+
+    COLUMNS = ['ID', 'Nome', 'Layer Figlio', 'Layer Padre'] + [title for title, _ in STATS_COLUMNS]
+    FIRST_STATS_COLUMN = 4
+
+    def __init__(self, project, parent=None):
+        super(RelationTableModel, self).__init__(parent)
+        self.project = project
+        self.relation_manager = project.relationManager()
+        self._rows = []
+        self._row_index = {}
+        self._layer_relations = defaultdict(set)
+        self._stats = {}
+        # layer_id -> (layer, slot) per poter scollegare i segnali
+        self._watched_layers = {}
+        self._renamed_layers = set()
+        self._suspended = False
+        self._dirty = False
+        self._watching = True
+
+        self.relation_manager.changed.connect(self.sync)
+        self.relation_manager.relationsLoaded.connect(self.sync)
+        self.project.layersAdded.connect(self.watch_layers)
+        self.project.layersWillBeRemoved.connect(self.unwatch_layers)
+        self.watch_layers(self.project.mapLayers().values())
+
+        self.sync()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if index.column() >= self.FIRST_STATS_COLUMN:
+            return self._stats_data(row, index.column(), role)
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return self._value(row, index.column())
+        if role == SortRole:
+            return row.sort_keys[index.column()]
+        return None
+
+    def _stats_data(self, row, column, role):
+        stats = self._stats.get(row.id)
+        if stats is None:
+            return -1 if role == SortRole else None
+        if stats.error is not None:
+            if role == Qt.DisplayRole:
+                return "errore"
+            if role == Qt.ToolTipRole:
+                return stats.error
+            return -1 if role == SortRole else None
+
+        value = getattr(stats, STATS_COLUMNS[column - self.FIRST_STATS_COLUMN][1])
+        if role == SortRole:
+            return value
+        if role == Qt.DisplayRole:
+            return f"{value:.1f}" if isinstance(value, float) else str(value)
+        if role == Qt.ToolTipRole:
+            return "Calcolate con una query SQL" if stats.method == 'sql' else "Calcolate leggendo i dati"
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    @staticmethod
+    def _value(row, column):
+        return (row.id, row.name, row.referencing_name, row.referenced_name)[column]
+
+    def relation_id(self, row):
+        return self._rows[row].id
+
+    def filter_key(self, row):
+        return self._rows[row].filter_key
+
+    def set_stats(self, stats):
+        """Imposta le statistiche (dizionario relation_id -> CardinalityStats)"""
+        self._stats = dict(stats)
+        self._stats_changed()
+
+    def update_stats(self, results):
+        """Aggiunge o sostituisce le statistiche delle relazioni calcolate"""
+        self._stats.update((stats.relation_id, stats) for stats in results)
+        self._stats_changed()
+
+    def clear_stats(self, relation_ids):
+        for relation_id in relation_ids:
+            self._stats.pop(relation_id, None)
+        self._stats_changed()
+
+    def _stats_changed(self):
+        if self._rows:
+            self.dataChanged.emit(self.index(0, self.FIRST_STATS_COLUMN),
+                                  self.index(len(self._rows) - 1, len(self.COLUMNS) - 1))
+
+    def watch_layers(self, layers):
+        """Segue il cambio di nome dei layer per aggiornare le righe"""
+        for layer in layers:
+            if layer.id() in self._watched_layers:
+                continue
+            renamed = partial(self.layer_renamed, layer.id())
+            self._watched_layers[layer.id()] = (layer, renamed)
+            layer.nameChanged.connect(renamed)
+            # Le relazioni caricate prima del layer mostrano "N/A"
+            if layer.id() in self._layer_relations:
+                self.layer_renamed(layer.id())
+
+    def unwatch_layers(self, layer_ids):
+        for layer_id in layer_ids:
+            self._watched_layers.pop(layer_id, None)
+
+    def unwatch(self):
+        """Scollega il modello dai segnali del progetto e dei layer"""
+        if not self._watching:
+            return
+        self._watching = False
+        self.relation_manager.changed.disconnect(self.sync)
+        self.relation_manager.relationsLoaded.disconnect(self.sync)
+        self.project.layersAdded.disconnect(self.watch_layers)
+        self.project.layersWillBeRemoved.disconnect(self.unwatch_layers)
+        for layer, renamed in self._watched_layers.values():
+            layer.nameChanged.disconnect(renamed)
+        self._watched_layers.clear()
+
+    def layer_renamed(self, layer_id):
+        """Aggiorna solo le righe delle relazioni che usano il layer"""
+        if self._suspended:
+            self._renamed_layers.add(layer_id)
+            self._dirty = True
+            return
+        relations = self.relation_manager.relations()
+        for rel_id in list(self._layer_relations.get(layer_id, ())):
+            relation = relations.get(rel_id)
+            if relation is not None:
+                self._update_row(self._row_index[rel_id], relation_row(rel_id, relation))
+
+    def set_suspended(self, suspended):
+        self._suspended = suspended
+        if not suspended and self._dirty:
+            self.sync()
+
+    def _index_layers(self, row, add=True):
+        """Aggiorna l'indice layer -> relazioni per una riga"""
+        for layer_id in (row.referencing_layer_id, row.referenced_layer_id):
+            if add:
+                self._layer_relations[layer_id].add(row.id)
+            else:
+                relation_ids = self._layer_relations.get(layer_id)
+                if relation_ids is not None:
+                    relation_ids.discard(row.id)
+                    if not relation_ids:
+                        del self._layer_relations[layer_id]
+
+    def sync(self):
+        """Allinea le righe alle relazioni del progetto"""
+        if self._suspended:
+            self._dirty = True
+            return
+        self._dirty = False
+        relations = self.relation_manager.relations()
+
+        # Righe rimosse, a blocchi contigui dal fondo per non spostare gli indici
+        removed = sorted((row for rel_id, row in self._row_index.items()
+                          if rel_id not in relations), reverse=True)
+        if removed:
+            i = 0
+            while i < len(removed):
+                last = first = removed[i]
+                i += 1
+                while i < len(removed) and removed[i] == first - 1:
+                    first = removed[i]
+                    i += 1
+                self.beginRemoveRows(QModelIndex(), first, last)
+                for row in self._rows[first:last + 1]:
+                    self._index_layers(row, add=False)
+                del self._rows[first:last + 1]
+                self.endRemoveRows()
+            self._row_index = {row.id: i for i, row in enumerate(self._rows)}
+
+        # Righe modificate: la riga viene ricostruita (con la ricerca dei
+        # layer) solo se cambiano il nome o i layer della relazione
+        for rel_id, row in self._row_index.items():
+            relation = relations[rel_id]
+            current = self._rows[row]
+            if (relation.name() != current.name
+                    or relation.referencingLayerId() != current.referencing_layer_id
+                    or relation.referencedLayerId() != current.referenced_layer_id):
+                self._update_row(row, relation_row(rel_id, relation))
+
+        # Layer rinominati mentre il modello era sospeso
+        renamed, self._renamed_layers = self._renamed_layers, set()
+        for layer_id in renamed:
+            self.layer_renamed(layer_id)
+
+        # Righe nuove, inserite in un unico blocco
+        added = [relation_row(rel_id, relation) for rel_id, relation in relations.items()
+                 if rel_id not in self._row_index]
+        if added:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            self._rows.extend(added)
+            for i, row in enumerate(added, first):
+                self._row_index[row.id] = i
+                self._index_layers(row)
+            self.endInsertRows()
+
+    def _update_row(self, row, updated):
+        self._index_layers(self._rows[row], add=False)
+        self._rows[row] = updated
+        self._index_layers(updated)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+
+class RelationFilterProxyModel(QSortFilterProxyModel):
+    """Ordinamento e filtro testuale sulle chiavi precalcolate del modello"""
+
+    def __init__(self, parent=None):
+        super(RelationFilterProxyModel, self).__init__(parent)
+        self._filter_text = ""
+        self._relation_ids = None
+        self.setSortRole(SortRole)
+
+    def set_filter_text(self, text):
+        self._filter_text = text.strip().lower()
+        self.invalidateFilter()
+
+    def set_relation_ids(self, relation_ids):
+        """Mostra solo le relazioni indicate (tutte se None)"""
+        self._relation_ids = relation_ids
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        model = self.sourceModel()
+        if self._relation_ids is not None and model.relation_id(source_row) not in self._relation_ids:
+            return False
+        if not self._filter_text:
+            return True
+        return self._filter_text in model.filter_key(source_row)
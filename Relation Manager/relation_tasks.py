@@ -0,0 +1,240 @@
+# relation_tasks.py
+import os
+
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.core import QgsTask
+
+from .cardinality import compute_cardinality
+from .catalog_io import CatalogReader, read_catalogs, write_catalog
+from .import_stats import ImportStats
+from .integrity import check_integrity, format_result
+from .relation_core import CatalogDiff, CatalogMerge, iter_specs, plan_relations
+
+
+class ImportRelationsTask(QgsTask):
+    """Legge i file di catalogo e risolve layer e campi in background
+
+    Con un solo file le relazioni vengono lette e risolte una alla volta,
+    anche dai file NDJSON in streaming. Con più file i cataloghi vengono
+    letti in parallelo e uniti (CatalogMerge) prima di un'unica
+    risoluzione; se un catalogo non si legge l'importazione si interrompe. Le relazioni escluse dalla politica scelta vengono
+    scartate dal confronto delle impronte prima della risoluzione. Al
+    termine le relazioni validate sono in self.planned e vanno create nel
+    thread principale (vedi RelationDialog.apply_relations). Con dry_run
+    viene eseguito solo il confronto. Tempi e strategie di ricerca sono
+    raccolti in self.stats; con profile il lavoro in background viene
+    eseguito sotto cProfile. Con mapping_cache (mapping_cache.MappingCache)
+    le corrispondenze dei layer trovate per il progetto project_key vengono
+    riusate e salvate.
+    """
+
+    messageLogged = pyqtSignal(str)
+
+    def __init__(self, filenames, snapshot, policy='skip', dry_run=False, profile=False,
+                 mapping_cache=None, project_key=None):
+        super(ImportRelationsTask, self).__init__("Importazione relazioni", QgsTask.CanCancel)
+        self.filenames = filenames
+        self.snapshot = snapshot
+        self.diff = CatalogDiff(snapshot.fingerprints, policy)
+        self.dry_run = dry_run
+        self.profile = profile
+        self.mapping_cache = mapping_cache
+        self.project_key = project_key
+        self.stats = ImportStats()
+        self.planned = []
+        self.exception = None
+
+    def run(self):
+        try:
+            with self.stats.profiling(self.profile):
+                self._run()
+            return not self.isCanceled()
+
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def _run(self):
+        if self.mapping_cache is not None and not self.dry_run:
+            self._load_mapping()
+
+        if len(self.filenames) == 1:
+            with CatalogReader(self.filenames[0], self.stats) as reader:
+                self._log_start()
+                specs = iter_specs(self._read(reader), self.messageLogged.emit, reader.layers,
+                                   self.diff.skip_invalid)
+                self._plan(specs)
+        else:
+            self._log_start()
+            self._plan(self._merge(), lambda progress: self.setProgress(50.0 + progress / 2))
+
+        self.messageLogged.emit("\n--- Confronto con il progetto ---")
+        self.messageLogged.emit(self.diff.summary())
+
+        if self.snapshot.mapping is not None and not self.isCanceled():
+            self._save_mapping()
+
+    def _load_mapping(self):
+        """Collega allo snapshot le corrispondenze dei layer salvate per il progetto"""
+        try:
+            self.mapping_cache.load()
+        except (OSError, ValueError) as e:
+            self.messageLogged.emit(f"⚠️ Cache dei layer non leggibile, ignorata: {str(e)}")
+        self.snapshot.mapping = self.mapping_cache.mapping(
+            self.project_key, self.snapshot.layers, self.snapshot.fields)
+
+    def _save_mapping(self):
+        mapping = self.snapshot.mapping
+        self.messageLogged.emit(f"Layer dalla cache: {mapping.hits}, cercati: {mapping.misses}")
+        self.stats.count('mapping_cache_hits', mapping.hits)
+        self.stats.count('mapping_cache_misses', mapping.misses)
+        try:
+            self.mapping_cache.store(mapping)
+            self.mapping_cache.save()
+        except OSError as e:
+            self.messageLogged.emit(f"⚠️ Impossibile salvare la cache dei layer: {str(e)}")
+
+    def _log_start(self):
+        self.messageLogged.emit("=== INIZIO IMPORTAZIONE ===")
+        for filename in self.filenames:
+            self.messageLogged.emit(f"File: {filename}")
+
+        # Mostra i layer disponibili nel progetto
+        self.messageLogged.emit("\n--- Layer disponibili nel progetto ---")
+        for layer_id, name, source in self.snapshot.layers:
+            self.messageLogged.emit(f"ID: {layer_id}, Nome: {name}")
+
+    def _plan(self, specs, set_progress=None):
+        specs = self.diff.select(specs, self.messageLogged.emit)
+        if set_progress is not None:
+            # Relazioni già in memoria: la lista permette di misurare l'avanzamento
+            specs = list(specs)
+        if self.dry_run:
+            for spec in specs:
+                if self.isCanceled():
+                    break
+        else:
+            self.planned = plan_relations(specs, self.snapshot, self.messageLogged.emit,
+                                          self.isCanceled, set_progress, self.stats)
+
+    def _merge(self):
+        """Legge i cataloghi in parallelo e restituisce le relazioni unite"""
+        self.messageLogged.emit(f"\n--- Lettura di {len(self.filenames)} cataloghi ---")
+        reads = read_catalogs(self.filenames, self.isCanceled,
+                              lambda progress: self.setProgress(progress / 2))
+
+        merge = CatalogMerge()
+        unread = []
+        for read in reads:
+            name = os.path.basename(read.filename)
+            for message in read.messages:
+                self.messageLogged.emit(f"[{name}] {message}")
+            for phase, seconds in read.stats.phases.items():
+                self.stats.add_time(phase, seconds)
+            if read.error is not None:
+                self.messageLogged.emit(f"❌ [{name}] Catalogo non letto: {str(read.error)}")
+                unread.append(name)
+                continue
+            merge.add(name, read.specs, self.messageLogged.emit, read.invalid)
+
+        # Senza un catalogo le sue relazioni sembrerebbero assenti: con
+        # prune (e a ogni sincronizzazione) verrebbero rimosse dal progetto
+        if unread:
+            raise ValueError(f"Cataloghi non letti: {', '.join(unread)}; "
+                             "importazione interrotta senza modificare il progetto")
+
+        for relation_id in merge.invalid:
+            self.diff.skip_invalid(relation_id)
+        self.messageLogged.emit("\n--- Cataloghi ---")
+        self.messageLogged.emit(merge.summary())
+        return merge.specs
+
+    def _read(self, reader):
+        """Relazioni del file, aggiornando l'avanzamento durante la lettura"""
+        for relation_data in reader:
+            self.setProgress(reader.progress())
+            yield relation_data
+        self.setProgress(100.0)
+
+
+class ExportRelationsTask(QgsTask):
+    """Scrive su file le relazioni lette dal progetto, in background"""
+
+    def __init__(self, filename, specs, project_file, version):
+        super(ExportRelationsTask, self).__init__("Esportazione relazioni", QgsTask.CanCancel)
+        self.filename = filename
+        self.specs = specs
+        self.project_file = project_file
+        self.version = version
+        self.exception = None
+
+    def run(self):
+        try:
+            return write_catalog(self.filename, self.specs, self.project_file,
+                                 self.isCanceled, self.setProgress, self.version)
+
+        except Exception as e:
+            self.exception = e
+            return False
+
+
+class ValidateRelationsTask(QgsTask):
+    """Verifica in background l'integrità referenziale delle relazioni
+
+    jobs va preparato nel thread principale con integrity.integrity_jobs.
+    Al termine i risultati sono in self.results.
+    """
+
+    messageLogged = pyqtSignal(str)
+
+    def __init__(self, jobs, max_workers=4):
+        super(ValidateRelationsTask, self).__init__("Verifica integrità relazioni",
+                                                    QgsTask.CanCancel)
+        self.jobs = jobs
+        self.max_workers = max_workers
+        self.results = []
+        self.exception = None
+
+    def run(self):
+        try:
+            self.messageLogged.emit(f"\n=== VERIFICA INTEGRITÀ: {len(self.jobs)} relazioni ===")
+            self.results = check_integrity(self.jobs, self.messageLogged.emit, self.isCanceled,
+                                           self.setProgress, self.max_workers)
+            for result in self.results:
+                self.messageLogged.emit(format_result(result))
+            return not self.isCanceled()
+
+        except Exception as e:
+            self.exception = e
+            return False
+
+
+class CardinalityTask(QgsTask):
+    """Calcola in background le statistiche di cardinalità delle relazioni
+
+    jobs va preparato nel thread principale con integrity.integrity_jobs.
+    Al termine le statistiche sono in self.results.
+    """
+
+    messageLogged = pyqtSignal(str)
+
+    def __init__(self, jobs, max_workers=4):
+        super(CardinalityTask, self).__init__("Statistiche relazioni", QgsTask.CanCancel)
+        self.jobs = jobs
+        self.max_workers = max_workers
+        self.results = []
+        self.exception = None
+
+    def run(self):
+        try:
+            self.results = compute_cardinality(self.jobs, self.messageLogged.emit, self.isCanceled,
+                                               self.setProgress, self.max_workers)
+            for stats in self.results:
+                if stats.error is not None:
+                    self.messageLogged.emit(
+                        f"❌ Statistiche non calcolate per '{stats.relation_id}': {stats.error}")
+            return not self.isCanceled()
+
+        except Exception as e:
+            self.exception = e
+            return False
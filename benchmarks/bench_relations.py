@@ -0,0 +1,316 @@
+# bench_relations.py
+"""Benchmark del plugin Relation Manager su progetti sintetici
+
+Costruisce progetti QGIS con layer OGR, ognuno letto da un proprio piccolo
+file CSV in una cartella temporanea, e relazioni tra di essi, poi misura separatamente serialize_relations,
+deserialize_relations, find_layer_by_name_or_source e refresh_relations
+(oltre alla costruzione dell'indice dei layer e del modello della
+tabella) per ogni combinazione di dimensioni richiesta. Funziona senza display
+(piattaforma Qt offscreen).
+
+Esempi:
+
+    python benchmarks/bench_relations.py --layers 50,200,800 --output bench.json
+    python benchmarks/bench_relations.py --layers 800 --baseline bench.json
+
+Con --baseline il risultato viene confrontato con un file prodotto in
+precedenza e lo script termina con codice 1 se una misura peggiora oltre
+la tolleranza.
+"""
+import argparse
+import importlib
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qgis.PyQt.QtCore import QEvent  # noqa: E402
+from qgis.core import (Qgis, QgsApplication, QgsProject, QgsRelation,  # noqa: E402
+                       QgsVectorLayer)
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "Relation Manager")
+PLUGIN_PACKAGE = "relation_manager_plugin"
+
+METRICS = ("serialize", "deserialize", "resolver_build", "find", "model_build", "refresh")
+
+
+def load_plugin():
+    """Importa il plugin come pacchetto (la cartella contiene uno spazio)"""
+    spec = importlib.util.spec_from_file_location(
+        PLUGIN_PACKAGE, os.path.join(PLUGIN_DIR, "__init__.py"),
+        submodule_search_locations=[PLUGIN_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PLUGIN_PACKAGE] = package
+    spec.loader.exec_module(package)
+    return {name: importlib.import_module(f"{PLUGIN_PACKAGE}.{name}")
+            for name in ("relation_dialog", "layer_resolver", "relation_model")}
+
+
+def parse_list(text, cast=int):
+    return [cast(value) for value in text.split(",") if value.strip()]
+
+
+def noisy_name(name, rng):
+    """Variante del nome che richiede la ricerca normalizzata o parziale"""
+    choice = rng.randrange(3)
+    if choice == 0:
+        return name.replace("_", "-")
+    if choice == 1:
+        return name.upper().replace("_", " ")
+    return name[:max(len(name) - 3, 4)]
+
+
+def noisy_source(source, rng):
+    """Variante della sorgente: stesso file scritto diversamente, o un file diverso"""
+    path, separator, options = source.partition("|")
+    folder, filename = os.path.split(path)
+    choice = rng.randrange(3)
+    if choice == 0:
+        path = os.path.join(folder, os.curdir, filename)
+    elif choice == 1:
+        path = os.path.join(folder, "copia", os.pardir, filename)
+    else:
+        path = os.path.join(folder, "altro", filename)
+    return path + separator + options
+
+
+def build_project(project, folder, layers, relations_per_layer, field_pairs, rng):
+    """Popola il progetto con layer CSV in folder e relazioni casuali tra di essi
+
+    Ogni layer ha un proprio file, quindi una sorgente distinta che la
+    ricerca per sorgente può usare.
+    """
+    project.clear()
+
+    header = ",".join(["id"] + [f"k{i}" for i in range(field_pairs)])
+    vector_layers = []
+    for i in range(layers):
+        name = f"layer_{i:05d}_{rng.choice(['parcel', 'road', 'pipe'])}"
+        path = os.path.join(folder, f"{name}.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(header + "\n")
+        vector_layers.append(QgsVectorLayer(path, name, "ogr"))
+    project.addMapLayers(vector_layers)
+
+    relation_manager = project.relationManager()
+    relations = []
+    for i, referencing in enumerate(vector_layers):
+        for j in range(relations_per_layer):
+            referenced = vector_layers[rng.randrange(layers)]
+            relation = QgsRelation()
+            relation.setId(f"rel_{i:05d}_{j}")
+            relation.setName(f"{referencing.name()} -> {referenced.name()}")
+            relation.setReferencingLayer(referencing.id())
+            relation.setReferencedLayer(referenced.id())
+            for k in range(field_pairs):
+                relation.addFieldPair(f"k{k}", f"k{k}")
+            relations.append(relation)
+    relation_manager.setRelations(relations)
+
+
+def add_noise(relations_data, noise, rng):
+    """Altera una frazione dei nomi e delle sorgenti dei layer nel catalogo esportato
+
+    Metà dei layer con la sorgente alterata riceve anche un nome che non
+    corrisponde a nessun layer, così la ricerca passa alla sorgente.
+    """
+    layers = list(relations_data.get("layers", {}).values())
+    if not layers:
+        for relation_data in relations_data["relations"]:
+            layers.extend((relation_data["parent_layer"], relation_data["child_layer"]))
+    for layer_data in layers:
+        if layer_data["name"] and rng.random() < noise:
+            layer_data["name"] = noisy_name(layer_data["name"], rng)
+        if layer_data["source"] and rng.random() < noise:
+            layer_data["source"] = noisy_source(layer_data["source"], rng)
+            if rng.random() < 0.5:
+                layer_data["name"] = f"rinominato_{rng.randrange(10 ** 6)}"
+
+
+def timed(function, repeat, setup=None):
+    """Tempo mediano in secondi su repeat esecuzioni; setup, se indicata, non è misurata"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_case(plugin, size, repeat, seed):
+    """Misura le operazioni per una combinazione di dimensioni"""
+    rng = random.Random(seed)
+    project = QgsProject.instance()
+    with tempfile.TemporaryDirectory(prefix="bench_relations_") as folder:
+        build_project(project, folder, size["layers"], size["relations_per_layer"],
+                      size["field_pairs"], rng)
+        return measure(plugin, project, size, repeat, rng)
+
+
+def measure(plugin, project, size, repeat, rng):
+    """Misura le operazioni sul progetto già costruito; al termine lo svuota"""
+    layer_resolver = plugin["layer_resolver"]
+    relation_manager = project.relationManager()
+
+    dialog = plugin["relation_dialog"].RelationDialog()
+    timings = {}
+
+    relations = relation_manager.relations()
+    timings["serialize"] = timed(lambda: dialog.serialize_relations(relations), repeat)
+
+    relations_data = dialog.serialize_relations(relations)
+    add_noise(relations_data, size["noise"], rng)
+    endpoints = [(layer_data["name"], layer_data["source"])
+                 for layer_data in relations_data["layers"].values()]
+
+    timings["resolver_build"] = timed(
+        lambda: layer_resolver.LayerResolver.from_project(project), repeat)
+
+    # Ricerca di tutti i layer distinti del catalogo, con un solo indice
+    # come durante un'importazione
+    def find_all():
+        resolver = layer_resolver.LayerResolver.from_project(project)
+        for name, source in endpoints:
+            dialog.find_layer_by_name_or_source(name, source, resolver)
+    timings["find"] = timed(find_all, repeat)
+
+    # Solo decodifica e applicazione: progetto svuotato fuori dalla misura e
+    # dialog scollegato come quando è nascosto, così tabella, grafo e filtro
+    # dei layer non si riallineano a ogni relazione creata
+    def clear_relations():
+        relation_manager.clear()
+        dialog.logSink.clear()
+    dialog.relationsModel.set_suspended(True)
+    dialog.relationGraph.unwatch()
+    timings["deserialize"] = timed(lambda: dialog.deserialize_relations(relations_data), repeat,
+                                   clear_relations)
+    dialog.relationGraph.watch(relation_manager)
+    dialog.relationsModel.set_suspended(False)
+
+    # Costruzione del modello da zero e riallineamento del modello esistente
+    def model_build():
+        model = plugin["relation_model"].RelationTableModel(project)
+        model.unwatch()
+        model.deleteLater()
+    timings["model_build"] = timed(model_build, repeat)
+    QgsApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    timings["refresh"] = timed(dialog.refresh_relations, repeat)
+
+    result = {
+        "size": size,
+        "relations": len(relation_manager.relations()),
+        "endpoints": len(endpoints),
+        "timings": timings,
+    }
+    # Scollega i segnali del dialog prima di eliminarlo: il caso successivo
+    # ricostruisce il progetto e non deve aggiornare dialog già eliminati
+    dialog.shutdown()
+    dialog.deleteLater()
+    QgsApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    project.clear()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Confronta i risultati con quelli di riferimento; restituisce le regressioni"""
+    reference = {json.dumps(item["size"], sort_keys=True): item["timings"]
+                 for item in baseline["results"]}
+    regressions = []
+    for item in results:
+        previous = reference.get(json.dumps(item["size"], sort_keys=True))
+        if previous is None:
+            continue
+        for metric, value in item["timings"].items():
+            if metric not in previous or previous[metric] <= 0:
+                continue
+            ratio = value / previous[metric]
+            item.setdefault("ratios", {})[metric] = ratio
+            if ratio > 1.0 + tolerance:
+                regressions.append((item["size"], metric, previous[metric], value, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layers", default="50,200,800",
+                        help="numeri di layer, separati da virgola")
+    parser.add_argument("--relations-per-layer", default="2",
+                        help="relazioni per layer, separate da virgola")
+    parser.add_argument("--field-pairs", default="1",
+                        help="coppie di campi per relazione, separate da virgola")
+    parser.add_argument("--noise", default="0.2",
+                        help="frazione di nomi di layer alterati nel catalogo")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="esecuzioni per misura (si usa la mediana)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="file JSON dei risultati (predefinito: stdout)")
+    parser.add_argument("--baseline", help="file JSON di riferimento per il confronto")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="peggioramento massimo ammesso rispetto al riferimento")
+    args = parser.parse_args(argv)
+
+    app = QgsApplication([], True)
+    app.initQgis()
+    try:
+        plugin = load_plugin()
+
+        results = []
+        for layers, relations_per_layer, field_pairs, noise in itertools.product(
+                parse_list(args.layers), parse_list(args.relations_per_layer),
+                parse_list(args.field_pairs), parse_list(args.noise, float)):
+            size = {"layers": layers, "relations_per_layer": relations_per_layer,
+                    "field_pairs": field_pairs, "noise": noise}
+            result = run_case(plugin, size, args.repeat, args.seed)
+            results.append(result)
+            print(f"{size}: " + ", ".join(f"{metric}={result['timings'][metric]:.4f}s"
+                                          for metric in METRICS), file=sys.stderr)
+
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "qgis": Qgis.QGIS_VERSION,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            report["regressions"] = [
+                {"size": size, "metric": metric, "baseline": before, "current": after,
+                 "ratio": ratio}
+                for size, metric, before, after, ratio in regressions]
+            for size, metric, before, after, ratio in regressions:
+                print(f"REGRESSIONE {metric} {size}: {before:.4f}s -> {after:.4f}s "
+                      f"(x{ratio:.2f})", file=sys.stderr)
+
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text)
+        else:
+            print(text)
+    finally:
+        app.exitQgis()
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+# conftest.py
+# I test coprono i moduli del plugin che non richiedono QGIS. La cartella
+# del plugin contiene uno spazio: viene importata come pacchetto
+# relation_manager_plugin, come fanno tools/ e benchmarks/.
+import importlib.util
+import os
+import sys
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "Relation Manager")
+PLUGIN_PACKAGE = "relation_manager_plugin"
+
+if PLUGIN_PACKAGE not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        PLUGIN_PACKAGE, os.path.join(PLUGIN_DIR, "__init__.py"),
+        submodule_search_locations=[PLUGIN_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PLUGIN_PACKAGE] = package
+    spec.loader.exec_module(package)
@@ -0,0 +1,104 @@
+# test_catalog_io.py
+import gzip
+import json
+import os
+
+import pytest
+
+from relation_manager_plugin.catalog_io import CatalogReader, read_catalog, write_catalog
+from relation_manager_plugin.relation_core import (FORMAT_VERSION, LEGACY_FORMAT_VERSION,
+                                                   FieldPair, LayerRef, RelationSpec,
+                                                   decode_catalog, encode_catalog)
+
+
+def sample_specs():
+    strade = LayerRef("strade_1", "Strade", 'dbname=\'gis\' table="public"."strade"')
+    civici = LayerRef("civici_2", "Civici àè", "/dati/civici.gpkg|layername=civici")
+    tratte = LayerRef("tratte_3", "Tratte", "/dati/tratte.shp")
+    return [
+        RelationSpec("rel_1", "Civici della strada", "1", civici, strade,
+                     (FieldPair(0, 2),)),
+        RelationSpec("rel_2", "Tratte della strada", "0", tratte, strade,
+                     (FieldPair("id_strada", "id"), FieldPair("tipo", "tipo"))),
+        # Stesso ID di layer con dati diversi: chiave resa univoca nel formato 2.0
+        RelationSpec("rel_3", "Tratte dei civici", None,
+                     LayerRef("tratte_3", "Tratte vecchie", "/dati/old.shp"), civici,
+                     (FieldPair(1, 0),)),
+    ]
+
+
+def normalized(specs):
+    """Confronto indipendente dalla rappresentazione dei campi (indice o testo)"""
+    return [spec._replace(field_pairs=tuple(FieldPair(str(pair.referencing_field),
+                                                      str(pair.referenced_field))
+                                            for pair in spec.field_pairs))
+            for spec in specs]
+
+
+@pytest.mark.parametrize("version", [LEGACY_FORMAT_VERSION, FORMAT_VERSION])
+def test_encode_decode_round_trip(version):
+    specs = sample_specs()
+    data = json.loads(json.dumps(encode_catalog(specs, "progetto.qgz", version)))
+    assert data["version"] == version
+    assert ("layers" in data) == (version == FORMAT_VERSION)
+    assert normalized(decode_catalog(data)) == normalized(specs)
+
+
+@pytest.mark.parametrize("extension", [".json", ".ndjson", ".jsonl", ".ndjson.gz"])
+@pytest.mark.parametrize("version", [LEGACY_FORMAT_VERSION, FORMAT_VERSION])
+def test_file_round_trip(tmp_path, extension, version):
+    specs = sample_specs()
+    filename = str(tmp_path / f"catalogo{extension}")
+    assert write_catalog(filename, specs, "progetto.qgz", version=version)
+
+    read = read_catalog(filename)
+    assert read.error is None
+    assert read.messages == []
+    assert normalized(read.specs) == normalized(specs)
+
+    with CatalogReader(filename) as reader:
+        assert reader.streaming == (extension != ".json")
+        assert reader.header["version"] == version
+
+
+@pytest.mark.parametrize("version", [LEGACY_FORMAT_VERSION, FORMAT_VERSION])
+def test_json_file_matches_json_dump(tmp_path, version):
+    specs = sample_specs()
+    filename = str(tmp_path / "catalogo.json")
+    write_catalog(filename, specs, "progetto.qgz", version=version)
+    with open(filename, encoding='utf-8') as f:
+        text = f.read()
+    expected = json.dumps(encode_catalog(specs, "progetto.qgz", version), indent=2,
+                          ensure_ascii=False)
+    assert text == expected
+
+
+def test_gzip_is_detected_by_content(tmp_path):
+    filename = str(tmp_path / "catalogo.ndjson.gz")
+    write_catalog(filename, sample_specs(), "progetto.qgz")
+    with open(filename, 'rb') as f:
+        assert f.read(2) == b'\x1f\x8b'
+    renamed = str(tmp_path / "catalogo.dat")
+    os.rename(filename, renamed)
+    assert normalized(read_catalog(renamed).specs) == normalized(sample_specs())
+
+
+def test_incomplete_relations_are_skipped(tmp_path):
+    filename = str(tmp_path / "catalogo.ndjson.gz")
+    lines = [{"version": "1.0", "format": "relation-manager-ndjson"},
+             {"id": "rel_1", "name": "Senza campi",
+              "parent_layer": {"id": "a", "name": "A", "source": ""},
+              "child_layer": {"id": "b", "name": "B", "source": ""}}]
+    with gzip.open(filename, 'wt', encoding='utf-8') as f:
+        f.write("\n".join(json.dumps(line) for line in lines) + "\n")
+
+    read = read_catalog(filename)
+    assert read.error is None
+    assert read.specs == []
+    assert len(read.messages) == 1 and "Senza campi" in read.messages[0]
+
+
+def test_canceled_write_removes_file(tmp_path):
+    filename = str(tmp_path / "catalogo.ndjson")
+    assert not write_catalog(filename, sample_specs(), "progetto.qgz", is_canceled=lambda: True)
+    assert not os.path.exists(filename)
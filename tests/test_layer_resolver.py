@@ -0,0 +1,90 @@
+# test_layer_resolver.py
+import random
+
+from relation_manager_plugin.layer_resolver import LayerResolver, canonical_source_key
+
+
+def linear_find(layers, name, source):
+    """Ricerca lineare originale di find_layer_by_name_or_source, su (id, nome, sorgente)"""
+    if name:
+        for layer_id, layer_name, layer_source in layers:
+            if layer_name == name:
+                return layer_id
+
+        name_clean = name.replace("-", "_").replace(" ", "_")
+        for layer_id, layer_name, layer_source in layers:
+            layer_name_clean = layer_name.replace("-", "_").replace(" ", "_")
+            if layer_name_clean.lower() == name_clean.lower():
+                return layer_id
+
+        for layer_id, layer_name, layer_source in layers:
+            if name.lower() in layer_name.lower() or layer_name.lower() in name.lower():
+                return layer_id
+
+    if source:
+        for layer_id, layer_name, layer_source in layers:
+            try:
+                if 'table=' in source and 'table=' in layer_source:
+                    source_table = source.split('table=')[1].split()[0].strip('"')
+                    layer_table = layer_source.split('table=')[1].split()[0].strip('"')
+                    if source_table == layer_table:
+                        return layer_id
+            except IndexError:
+                continue
+
+    return None
+
+
+def random_layers(rng, count):
+    words = ["strade", "Edifici", "rete-idrica", "rete idrica", "civici", "lotti", "a", "AB"]
+    layers = []
+    for i in range(count):
+        name = rng.choice(words) + rng.choice(["", "_2", " nord", "-sud", str(i)])
+        source = f'dbname=\'gis\' table="public"."{rng.choice(words)}{i % 7}" (geom)'
+        layers.append((f"layer_{i}", name, source))
+    return layers
+
+
+def test_resolver_matches_linear_search():
+    rng = random.Random(42)
+    for _ in range(20):
+        layers = random_layers(rng, rng.randint(1, 40))
+        resolver = LayerResolver(layers)
+        queries = [(name, source) for _, name, source in layers]
+        queries += [("rete_idrica", None), ("RETE IDRICA", None), ("strade nord x", None),
+                    ("zzz", 'table="public"."lotti3" (geom)'), ("zzz", 'table=public.lotti3'),
+                    ("", 'table="x"'), ("ci", None),
+                    (None, None)]
+        queries += [(name.upper()[1:], None) for _, name, _ in layers[:5]]
+        for name, source in queries:
+            assert resolver.find(name, source) == linear_find(layers, name, source), (name, source)
+
+
+def test_resolve_reports_strategy():
+    resolver = LayerResolver([("a", "Rete Idrica", "/dati/rete.shp"),
+                              ("b", "rete_idrica", "/dati/altra.shp"),
+                              ("c", "Edifici nord", "/dati/edifici.gpkg|layername=edifici")])
+    assert resolver.resolve("Rete Idrica", None) == ("a", 'exact')
+    assert resolver.resolve("rete-idrica", None) == ("a", 'normalized')
+    assert resolver.resolve("edifici", None) == ("c", 'partial')
+    assert resolver.resolve("scuole", "/dati/edifici.gpkg|layername=edifici") == ("c", 'source')
+    assert resolver.resolve("scuole", "/dati/scuole.shp") == (None, None)
+
+
+def test_canonical_source_key():
+    assert canonical_source_key('dbname=\'gis\' table="public"."roads" (geom)') == \
+        ('table', 'public"."roads')
+    # Come la ricerca originale, tabelle con e senza virgolette restano distinte
+    assert canonical_source_key("dbname='gis' table=public.roads (geom)") == \
+        ('table', 'public.roads')
+    assert canonical_source_key("/dati/x.gpkg|layername=roads") == \
+        ('layer', canonical_source_key("/dati/x.gpkg")[1], 'roads')
+    assert canonical_source_key("memory?geometry=Point") is None
+
+
+def test_quoted_and_unquoted_tables_do_not_match():
+    layers = [("a", "Strade", 'dbname=\'gis\' table="public"."strade" (geom)')]
+    resolver = LayerResolver(layers)
+    for source in ('table=public.strade (geom)', 'table="public"."strade" (geom)'):
+        assert resolver.find("scuole", source) == linear_find(layers, "scuole", source)
+    assert resolver.find("scuole", 'table=public.strade (geom)') is None
@@ -0,0 +1,94 @@
+# test_mapping_cache.py
+import json
+import os
+import threading
+
+from relation_manager_plugin.mapping_cache import CACHE_VERSION, MappingCache
+
+LAYERS = [("strade_1", "Strade", "/dati/strade.shp"), ("civici_2", "Civici", "/dati/civici.shp")]
+FIELDS = {"strade_1": ["fid", "id"], "civici_2": ["fid", "id_strada"]}
+
+
+def stored_mapping(cache, project_key, layer_id="strade_1"):
+    mapping = cache.mapping(project_key, LAYERS, FIELDS)
+    mapping.record("Strade", "/dati/strade.shp", layer_id, 'exact')
+    cache.store(mapping)
+    return mapping
+
+
+def test_round_trip_and_lookup(tmp_path):
+    filename = str(tmp_path / "cache" / "layer_mapping.json")
+    cache = MappingCache(filename)
+    stored_mapping(cache, "progetto.qgz")
+    cache.save()
+    assert os.listdir(os.path.dirname(filename)) == ["layer_mapping.json"]
+
+    cache = MappingCache(filename)
+    cache.load()
+    mapping = cache.mapping("progetto.qgz", LAYERS, FIELDS)
+    assert mapping.lookup("Strade", "/dati/strade.shp") == ("strade_1", 'exact')
+    assert mapping.lookup("Civici", "/dati/civici.shp") is None
+
+
+def test_save_keeps_projects_saved_by_other_instances(tmp_path):
+    filename = str(tmp_path / "layer_mapping.json")
+    first = MappingCache(filename)
+    second = MappingCache(filename)
+    first.load()
+    second.load()
+
+    stored_mapping(first, "a.qgz")
+    stored_mapping(second, "b.qgz")
+    first.save()
+    second.save()
+
+    cache = MappingCache(filename)
+    cache.load()
+    assert list(cache.projects) == ["a.qgz", "b.qgz"]
+
+
+def test_save_applies_lru_to_merged_projects(tmp_path):
+    filename = str(tmp_path / "layer_mapping.json")
+    old = MappingCache(filename, max_projects=2)
+    for key in ("a.qgz", "b.qgz"):
+        stored_mapping(old, key)
+    old.save()
+
+    cache = MappingCache(filename, max_projects=2)
+    stored_mapping(cache, "a.qgz", layer_id="civici_2")
+    stored_mapping(cache, "c.qgz")
+    cache.save()
+    assert list(cache.projects) == ["a.qgz", "c.qgz"]
+    assert cache.projects["a.qgz"]["entries"]
+    with open(filename, encoding='utf-8') as f:
+        data = json.load(f)
+    assert data["version"] == CACHE_VERSION
+    assert list(data["projects"]) == ["a.qgz", "c.qgz"]
+
+
+def test_concurrent_saves(tmp_path):
+    filename = str(tmp_path / "layer_mapping.json")
+    caches = [MappingCache(filename, max_projects=50) for _ in range(8)]
+    for i, cache in enumerate(caches):
+        stored_mapping(cache, f"p{i}.qgz")
+    threads = [threading.Thread(target=cache.save) for cache in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cache = MappingCache(filename)
+    cache.load()
+    assert sorted(cache.projects) == sorted(f"p{i}.qgz" for i in range(8))
+    assert os.listdir(str(tmp_path)) == ["layer_mapping.json"]
+
+
+def test_unreadable_file_is_replaced(tmp_path):
+    filename = str(tmp_path / "layer_mapping.json")
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write("{non json")
+    cache = MappingCache(filename)
+    stored_mapping(cache, "a.qgz")
+    cache.save()
+    cache.load()
+    assert list(cache.projects) == ["a.qgz"]
@@ -0,0 +1,207 @@
+# test_project_files.py
+import json
+import os
+import zipfile
+
+import pytest
+
+from relation_manager_plugin.catalog_io import read_catalog, write_catalog
+from relation_manager_plugin.project_files import (absolute_source, parse_project_xml,
+                                                   project_specs, read_project,
+                                                   update_project_file)
+from relation_manager_plugin.relation_core import CatalogMerge, FieldPair, LayerRef, RelationSpec
+
+LAYERS = """  <projectlayers>
+    <maplayer type="vector">
+      <id>strade_1</id>
+      <datasource>/dati/strade.shp</datasource>
+      <layername>Strade</layername>
+      <fieldConfiguration>
+        <field name="fid"/>
+        <field name="id"/>
+      </fieldConfiguration>
+    </maplayer>
+    <maplayer type="vector">
+      <id>civici_2</id>
+      <datasource>/dati/civici.shp</datasource>
+      <layername>Civici</layername>
+      <fieldConfiguration>
+        <field name="fid"/>
+        <field name="id_strada"/>
+      </fieldConfiguration>
+    </maplayer>
+    <maplayer type="raster">
+      <id>orto_3</id>
+      <datasource>/dati/orto.tif</datasource>
+      <layername>Ortofoto</layername>
+    </maplayer>
+  </projectlayers>
+"""
+
+EXISTING = """  <relations>
+    <relation id="rel_old" name="Vecchia" referencingLayer="civici_2" referencedLayer="strade_1" strength="Association">
+      <fieldRef referencingField="fid" referencedField="fid"/>
+    </relation>
+  </relations>
+"""
+
+
+def project_xml(relations=EXISTING):
+    return ('<!DOCTYPE qgis PUBLIC \'http://mrcc.com/qgis.dtd\' \'SYSTEM\'>\n'
+            '<qgis version="3.34.0" projectname="">\n'
+            '  <title>Prova è</title>\n'
+            + LAYERS + relations
+            + '  <mapcanvas name="theMapCanvas"/>\n'
+            '</qgis>\n').encode('utf-8')
+
+
+CIVICI = LayerRef("civici_x", "Civici", "/dati/civici.shp")
+STRADE = LayerRef("strade_x", "Strade", "/dati/strade.shp")
+NEW = RelationSpec("rel_new", "Civici della strada", "1", CIVICI, STRADE,
+                   (FieldPair("id_strada", "id"),))
+
+
+def write(path, data):
+    if path.endswith('.qgz'):
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr("progetto.qgs", data)
+            archive.writestr("progetto.qgd", b"dati ausiliari")
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def test_parse_project():
+    project = parse_project_xml(project_xml())
+    assert project.layers == [("strade_1", "Strade", "/dati/strade.shp"),
+                              ("civici_2", "Civici", "/dati/civici.shp"),
+                              ("orto_3", "Ortofoto", "/dati/orto.tif")]
+    assert project.fields == {"strade_1": ["fid", "id"], "civici_2": ["fid", "id_strada"]}
+    assert [relation.id for relation in project.relations] == ["rel_old"]
+
+    spec = project_specs(project)[0]
+    assert spec.parent_layer.name == "Civici"
+    # Campi per indice, come nelle esportazioni dal progetto aperto
+    assert spec.field_pairs == (FieldPair(0, 0),)
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("./dati/strade.shp", os.path.normpath("/progetti/dati/strade.shp")),
+    ("../dati/civici.gpkg|layername=civici",
+     os.path.normpath("/dati/civici.gpkg") + "|layername=civici"),
+    ("/dati/orto.tif", "/dati/orto.tif"),
+    ("dbname='gis' table=\"public\".\"strade\"", "dbname='gis' table=\"public\".\"strade\""),
+])
+def test_absolute_source(source, expected):
+    assert absolute_source(source, os.path.normpath("/progetti")) == expected
+    assert absolute_source(source, None) == source
+
+
+@pytest.mark.parametrize("name", ["progetto.qgs", "progetto.qgz"])
+def test_relative_sources_match_catalog(tmp_path, name):
+    # Progetto salvato con percorsi relativi in una sottocartella dei dati
+    folder = tmp_path / "progetti"
+    folder.mkdir()
+    path = str(folder / name)
+    data = project_xml().replace(b"/dati/", b"../dati/")
+    write(path, data)
+
+    layers = read_project(path).layers
+    assert layers[0][2] == os.path.join(str(tmp_path), "dati", "strade.shp")
+    assert parse_project_xml(data).layers[0][2] == "../dati/strade.shp"
+
+    # Il catalogo riporta i percorsi assoluti: i layer vengono trovati per sorgente
+    civici = LayerRef("x1", "Altro nome", os.path.join(str(tmp_path), "dati", "civici.shp"))
+    strade = LayerRef("x2", "Altro nome 2", os.path.join(str(tmp_path), "dati", "strade.shp"))
+    spec = NEW._replace(parent_layer=civici, child_layer=strade)
+    result = update_project_file(path, [spec], 'skip', backup=False)
+    assert result.error is None and result.imported == 1
+    relation = read_project(path).relations[-1]
+    assert (relation.referencing_layer, relation.referenced_layer) == ("civici_2", "strade_1")
+
+
+@pytest.mark.parametrize("name", ["progetto.qgs", "progetto.qgz"])
+def test_update_adds_relation_and_keeps_rest(tmp_path, name):
+    path = str(tmp_path / name)
+    original = project_xml()
+    write(path, original)
+
+    result = update_project_file(path, [NEW], 'skip')
+    assert result.error is None
+    assert (result.imported, result.removed) == (1, 0)
+    assert os.path.exists(path + '~')
+
+    project = read_project(path)
+    assert [relation.id for relation in project.relations] == ["rel_old", "rel_new"]
+    new = project.relations[1]
+    assert (new.referencing_layer, new.referenced_layer) == ("civici_2", "strade_1")
+    assert new.field_pairs == (FieldPair("id_strada", "id"),)
+    assert new.strength == "Composition"
+
+    if name.endswith('.qgz'):
+        with zipfile.ZipFile(path) as archive:
+            data = archive.read("progetto.qgs")
+            assert archive.read("progetto.qgd") == b"dati ausiliari"
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+    # Fuori dalla sezione <relations> il file è identico
+    before, after = original.split(b"  <relations>")[0], original.split(b"</relations>")[1]
+    assert data.startswith(before) and data.endswith(after)
+    assert EXISTING.split("\n")[1].encode('utf-8') in data
+
+    # Una seconda esecuzione non trova niente da fare
+    again = update_project_file(path, [NEW], 'skip')
+    assert (again.imported, again.removed) == (0, 0)
+
+
+@pytest.mark.parametrize("relations", ["  <relations/>\n", ""])
+def test_update_without_relations(tmp_path, relations):
+    path = str(tmp_path / "progetto.qgs")
+    write(path, project_xml(relations))
+
+    result = update_project_file(path, [NEW], 'skip', backup=False)
+    assert result.error is None and result.imported == 1
+    assert not os.path.exists(path + '~')
+    project = read_project(path)
+    assert [relation.id for relation in project.relations] == ["rel_new"]
+    assert [layer[0] for layer in project.layers] == ["strade_1", "civici_2", "orto_3"]
+
+
+def test_prune_and_dry_run(tmp_path):
+    path = str(tmp_path / "progetto.qgs")
+    original = project_xml()
+    write(path, original)
+
+    result = update_project_file(path, [NEW], 'prune', dry_run=True)
+    assert result.removed == 1
+    with open(path, 'rb') as f:
+        assert f.read() == original
+
+    result = update_project_file(path, [NEW], 'prune')
+    assert (result.imported, result.removed) == (1, 1)
+    assert [relation.id for relation in read_project(path).relations] == ["rel_new"]
+
+
+def test_prune_keeps_relations_with_invalid_catalog_entries(tmp_path):
+    path = str(tmp_path / "progetto.qgs")
+    write(path, project_xml())
+    catalog = str(tmp_path / "catalogo.ndjson")
+    write_catalog(catalog, [NEW], "modello.qgz")
+    with open(catalog, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"id": "rel_old", "name": "Vecchia troncata"}) + "\n")
+
+    read = read_catalog(catalog)
+    assert read.error is None and read.invalid == ["rel_old"]
+    merge = CatalogMerge()
+    merge.add("catalogo.ndjson", read.specs, invalid=read.invalid)
+    result = update_project_file(path, merge.specs, 'prune', invalid=merge.invalid)
+    assert (result.imported, result.removed) == (1, 0)
+    assert [relation.id for relation in read_project(path).relations] == ["rel_old", "rel_new"]
+
+
+def test_unreadable_project_is_reported(tmp_path):
+    path = str(tmp_path / "rotto.qgs")
+    write(path, b"<qgis><projectlayers>")
+    result = update_project_file(path, [NEW])
+    assert result.error is not None
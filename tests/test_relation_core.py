@@ -0,0 +1,109 @@
+# test_relation_core.py
+import pytest
+
+from relation_manager_plugin.relation_core import (CatalogDiff, CatalogMerge, FieldPair, LayerRef,
+                                                   ProjectSnapshot, RelationSpec, iter_specs,
+                                                   plan_relations, relation_fingerprint)
+
+STRADE = LayerRef("strade_1", "Strade", "/dati/strade.shp")
+CIVICI = LayerRef("civici_2", "Civici", "/dati/civici.shp")
+
+
+def spec(relation_id, name="Relazione", strength="0", field="id_strada"):
+    return RelationSpec(relation_id, name, strength, CIVICI, STRADE, (FieldPair(field, "id"),))
+
+
+# Progetto: rel_same invariata, rel_changed modificata, rel_missing assente dal catalogo
+PROJECT = {
+    "rel_same": relation_fingerprint(spec("rel_same")),
+    "rel_changed": relation_fingerprint(spec("rel_changed")),
+    "rel_missing": relation_fingerprint(spec("rel_missing")),
+}
+CATALOG = [spec("rel_same"), spec("rel_changed", name="Nuovo nome"), spec("rel_new"),
+           spec("rel_new")]
+
+
+@pytest.mark.parametrize("policy, selected, replace_ids, remove_ids", [
+    ('skip', ["rel_new"], set(), []),
+    ('update', ["rel_changed", "rel_new"], {"rel_changed"}, []),
+    ('replace', ["rel_same", "rel_changed", "rel_new"], {"rel_same", "rel_changed"}, []),
+    ('prune', ["rel_changed", "rel_new"], {"rel_changed"}, ["rel_missing"]),
+])
+def test_catalog_diff_policies(policy, selected, replace_ids, remove_ids):
+    diff = CatalogDiff(PROJECT, policy)
+    messages = []
+    assert [selected_spec.id for selected_spec in diff.select(CATALOG, messages.append)] == selected
+    assert diff.unchanged == ["rel_same"]
+    assert diff.changed == ["rel_changed"]
+    assert diff.new == ["rel_new"]
+    assert diff.duplicates == ["rel_new"]
+    assert diff.removed == ["rel_missing"]
+    assert diff.replace_ids == replace_ids
+    assert diff.remove_ids == remove_ids
+
+
+def test_prune_keeps_relations_of_invalid_catalog_entries():
+    # rel_missing è nel catalogo, ma non decodificabile
+    relations = [{"id": "rel_same", "name": "Relazione", "strength": "0",
+                  "parent_layer": CIVICI._asdict(), "child_layer": STRADE._asdict(),
+                  "field_pairs": [{"referencing_field": "id_strada", "referenced_field": "id"}]},
+                 {"id": "rel_missing", "name": "Rotta", "parent_layer": CIVICI._asdict()}]
+    diff = CatalogDiff(PROJECT, 'prune')
+    messages = []
+    specs = list(diff.select(iter_specs(relations, messages.append, on_invalid=diff.skip_invalid),
+                             messages.append))
+    assert specs == [] and len(messages) == 1
+    assert diff.invalid == ["rel_missing"]
+    assert diff.removed == ["rel_changed"]
+    assert diff.remove_ids == ["rel_changed"]
+
+
+def test_prune_is_refused_for_invalid_entries_without_id():
+    diff = CatalogDiff(PROJECT, 'prune')
+    list(diff.select([spec("rel_same")], print))
+    diff.skip_invalid(None)
+    assert diff.removed == ["rel_changed", "rel_missing"]
+    assert diff.remove_ids == []
+    assert "nessuna relazione rimossa" in diff.summary()
+
+
+def test_catalog_diff_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        CatalogDiff({}, 'merge')
+
+
+def test_fingerprint_ignores_strength_spelling_and_id():
+    assert relation_fingerprint(spec("a", strength="1")) == \
+        relation_fingerprint(spec("b", strength="RelationStrength.Composition"))
+    assert relation_fingerprint(spec("a", strength="0")) != relation_fingerprint(spec("a", strength="1"))
+
+
+def test_catalog_merge_conflicts():
+    merge = CatalogMerge()
+    merge.add("a.json", [spec("rel_1"), spec("rel_2")])
+    counts = merge.add("b.json", [spec("rel_1"), spec("rel_2", name="Altro"), spec("rel_3")],
+                       log=lambda message: None)
+    assert [merged.id for merged in merge.specs] == ["rel_1", "rel_2", "rel_3"]
+    assert merge.specs[1].name == "Relazione"
+    assert merge.conflicts == [("rel_2", "a.json", "b.json")]
+    assert (counts["added"], counts["duplicates"], counts["conflicts"]) == (1, 1, 1)
+
+
+def test_plan_relations_resolves_layers_and_field_indices():
+    snapshot = ProjectSnapshot(
+        [("l1", "strade", "/altro/strade.shp"), ("l2", "Civici", "/dati/civici.shp")],
+        {"l1": ["fid", "id"], "l2": ["fid", "id_strada"]}, {})
+    specs = [
+        RelationSpec("rel_1", "Per indice", "0", CIVICI, STRADE, (FieldPair(1, 1),)),
+        RelationSpec("rel_2", "Campo errato", "0", CIVICI, STRADE, (FieldPair("manca", "id"),)),
+        RelationSpec("rel_3", "Layer mancante", "0", LayerRef("x", "Scuole", "/dati/scuole.shp"),
+                     STRADE, (FieldPair("fid", "fid"),)),
+    ]
+    messages = []
+    planned = plan_relations(specs, snapshot, messages.append)
+    assert len(planned) == 1
+    assert planned[0].referencing_layer_id == "l2"
+    assert planned[0].referenced_layer_id == "l1"
+    assert planned[0].field_pairs == (FieldPair("id_strada", "id"),)
+    assert any("Campo 'manca'" in message for message in messages)
+    assert any("Scuole" in message for message in messages)
@@ -0,0 +1,126 @@
+# test_relation_graph.py
+import random
+
+from relation_manager_plugin.relation_core import FieldPair, PlannedRelation
+from relation_manager_plugin.relation_graph import RelationGraph, dependency_order
+
+
+def graph(*edges):
+    """Grafo da coppie (padre, figlio)"""
+    return RelationGraph((f"r{i}", child, parent) for i, (parent, child) in enumerate(edges))
+
+
+def assert_parents_first(g, order):
+    position = {layer_id: i for i, layer_id in enumerate(order)}
+    components = {layer_id: tuple(component) for component in g.components()
+                  for layer_id in component}
+    for relation_id in list(g._edges):
+        child, parent = g.edge(relation_id)
+        if components[child] != components[parent]:
+            assert position[parent] < position[child], (parent, child, order)
+
+
+def test_topological_order_without_cycles():
+    g = graph(("A", "B"), ("A", "C"), ("B", "D"), ("C", "D"))
+    assert g.topological_order() == ["A", "B", "C", "D"]
+    assert g.cycles() == []
+
+
+def test_layers_below_a_cycle_keep_dependency_order():
+    # L0 <-> L1 è un ciclo; sotto il ciclo L1 -> L5 -> L3
+    g = graph(("L0", "L1"), ("L1", "L0"), ("L1", "L5"), ("L5", "L3"))
+    order = g.topological_order()
+    assert sorted(order) == ["L0", "L1", "L3", "L5"]
+    assert order.index("L5") < order.index("L3")
+    assert max(order.index("L0"), order.index("L1")) < order.index("L5")
+    assert [sorted(cycle) for cycle in g.cycles()] == [["L0", "L1"]]
+
+
+def test_self_reference_is_a_cycle():
+    g = graph(("A", "A"), ("A", "B"))
+    assert g.topological_order() == ["A", "B"]
+    assert g.cycles() == [["A"]]
+
+
+def test_random_graphs_keep_parents_first():
+    rng = random.Random(7)
+    for _ in range(50):
+        layers = [f"L{i}" for i in range(rng.randint(2, 15))]
+        edges = [(rng.choice(layers), rng.choice(layers)) for _ in range(rng.randint(1, 30))]
+        g = graph(*edges)
+        order = g.topological_order()
+        assert sorted(order) == sorted(g.layers())
+        assert_parents_first(g, order)
+
+
+def test_descendants_and_sync():
+    g = graph(("A", "B"), ("B", "C"), ("X", "Y"))
+    assert g.descendants("A") == {"B", "C"}
+    assert g.subtree_relations("A") == {"r0", "r1"}
+
+    version = g.version
+    g.remove("r1")
+    assert g.descendants("A") == {"B"}
+    assert g.version > version
+    assert g.relations_of("B") == {"r0"}
+
+
+def test_dependency_order_puts_parent_relations_first():
+    def planned(relation_id, child, parent):
+        return PlannedRelation(relation_id, relation_id, None, child, parent,
+                               (FieldPair("a", "b"),))
+
+    relations = [planned("c_d", "D", "C"), planned("b_c", "C", "B"), planned("a_b", "B", "A"),
+                 planned("b_a", "A", "B")]
+    ordered, cycles = dependency_order(relations)
+    ids = [relation.id for relation in ordered]
+    assert ids.index("b_c") < ids.index("c_d")
+    assert [sorted(cycle) for cycle in cycles] == [["A", "B"]]
+
+
+class Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+
+class Relation:
+    def __init__(self, child, parent):
+        self.child = child
+        self.parent = parent
+
+    def referencingLayerId(self):
+        return self.child
+
+    def referencedLayerId(self):
+        return self.parent
+
+
+class RelationManager:
+    def __init__(self):
+        self.changed = Signal()
+        self.relationsLoaded = Signal()
+        self.items = {"r0": Relation("B", "A")}
+
+    def relations(self):
+        return dict(self.items)
+
+
+def test_watch_and_unwatch():
+    manager = RelationManager()
+    g = RelationGraph()
+    g.watch(manager)
+    assert "r0" in g
+    manager.items["r1"] = Relation("C", "B")
+    for slot in manager.changed.slots:
+        slot()
+    assert g.descendants("A") == {"B", "C"}
+
+    g.unwatch()
+    assert manager.changed.slots == [] and manager.relationsLoaded.slots == []
+    g.unwatch()
@@ -0,0 +1,131 @@
+# relation_projects.py
+"""Esporta e importa relazioni direttamente nei file di progetto .qgs/.qgz
+
+Non apre i progetti in QGIS e non richiede QGIS installato: layer e
+relazioni vengono letti dall'XML del progetto e, in importazione, viene
+riscritta solo la sezione <relations>. I progetti vengono elaborati in
+parallelo, uno per processo.
+
+Esempi:
+
+    python tools/relation_projects.py export modello.qgz catalogo.json
+    python tools/relation_projects.py apply catalogo.json --projects progetti/ --policy update
+    python tools/relation_projects.py apply cataloghi/ --projects progetti/ --dry-run
+
+Prima di modificare un file ne viene salvata una copia con il suffisso ~
+(come fa QGIS), a meno di usare --no-backup.
+"""
+import argparse
+import importlib
+import importlib.util
+import os
+import sys
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "Relation Manager")
+PLUGIN_PACKAGE = "relation_manager_plugin"
+
+
+def load_plugin():
+    """Importa i moduli del plugin che non richiedono QGIS (la cartella contiene uno spazio)"""
+    if PLUGIN_PACKAGE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PLUGIN_PACKAGE, os.path.join(PLUGIN_DIR, "__init__.py"),
+            submodule_search_locations=[PLUGIN_DIR])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[PLUGIN_PACKAGE] = package
+        spec.loader.exec_module(package)
+    return {name: importlib.import_module(f"{PLUGIN_PACKAGE}.{name}")
+            for name in ("catalog_io", "project_files", "relation_core")}
+
+
+# Caricato a livello di modulo: i processi del pool devono poter importare
+# le funzioni e i tipi del plugin anche quando vengono avviati con spawn
+plugin = load_plugin()
+
+
+def export_command(args):
+    project_files = plugin["project_files"]
+    project = project_files.read_project(args.project)
+    specs = project_files.project_specs(project)
+    plugin["catalog_io"].write_catalog(args.output, specs, args.project)
+    print(f"{len(specs)} relazioni esportate in {args.output}", file=sys.stderr)
+    return 0
+
+
+def read_specs(paths):
+    """Relazioni dei cataloghi indicati, unite come nell'importazione di più file
+
+    Restituisce anche gli ID delle relazioni non valide (vedi CatalogMerge.invalid).
+    """
+    catalog_io = plugin["catalog_io"]
+    merge = plugin["relation_core"].CatalogMerge()
+    for read in catalog_io.read_catalogs(catalog_io.catalog_files(paths)):
+        name = os.path.basename(read.filename)
+        for message in read.messages:
+            print(f"[{name}] {message}", file=sys.stderr)
+        if read.error is not None:
+            raise ValueError(f"{name}: {read.error}")
+        merge.add(name, read.specs, lambda message: print(message, file=sys.stderr),
+                  read.invalid)
+    print(merge.summary(), file=sys.stderr)
+    return merge.specs, merge.invalid
+
+
+def apply_command(args):
+    project_files = plugin["project_files"]
+    specs, invalid = read_specs(args.catalogs)
+    paths = project_files.project_paths(args.projects)
+    failed = []
+
+    def report(result):
+        if result.error is not None:
+            failed.append(result)
+            print(f"ERRORE {result.path}: {result.error}", file=sys.stderr)
+            return
+        print(f"{result.path}: {result.imported} importate, {result.removed} rimosse",
+              file=sys.stderr)
+        if args.verbose:
+            for message in result.messages:
+                print(f"  {message}", file=sys.stderr)
+            print("  " + result.summary.replace("\n", "\n  "), file=sys.stderr)
+
+    results = project_files.update_project_files(
+        paths, specs, args.policy, args.dry_run, not args.no_backup, args.workers, report,
+        invalid)
+    print(f"Progetti elaborati: {len(results)}, con errori: {len(failed)}"
+          + (" (simulazione, nessun file modificato)" if args.dry_run else ""), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="esporta le relazioni di un progetto")
+    export_parser.add_argument("project", help="file .qgs o .qgz")
+    export_parser.add_argument("output", help="catalogo da scrivere (.json, .ndjson, .ndjson.gz)")
+    export_parser.set_defaults(function=export_command)
+
+    apply_parser = commands.add_parser("apply", help="importa cataloghi nei progetti")
+    apply_parser.add_argument("catalogs", nargs="+", help="file di catalogo o cartelle")
+    apply_parser.add_argument("--projects", nargs="+", required=True,
+                              help="file di progetto o cartelle (anche sottocartelle)")
+    apply_parser.add_argument("--policy", default="skip",
+                              choices=plugin["relation_core"].IMPORT_POLICIES,
+                              help="cosa fare con le relazioni già presenti")
+    apply_parser.add_argument("--dry-run", action="store_true",
+                              help="mostra solo il confronto, senza modificare i file")
+    apply_parser.add_argument("--workers", type=int, help="numero di processi")
+    apply_parser.add_argument("--no-backup", action="store_true",
+                              help="non salva la copia ~ dei progetti modificati")
+    apply_parser.add_argument("--verbose", action="store_true",
+                              help="mostra il log completo di ogni progetto")
+    apply_parser.set_defaults(function=apply_command)
+
+    args = parser.parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())